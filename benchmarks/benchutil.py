@@ -0,0 +1,43 @@
+# benchutil.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU General Public License v2
+#
+# What the playlist benchmarks share: made-up playlists and timing
+#
+
+import time
+
+
+def make_entries(count, local=False):
+    """
+    A playlist of count videos, on YouTube or local files
+    """
+
+    return [{
+        'title': u'Video {} \u2013 part {}'.format(i, i % 7),
+        'author': 'Author {}'.format(i % 100),
+        'video_url': None if local else
+        'https://www.youtube.com/watch?v=v{:010d}'.format(i),
+        'local_path': '/home/user/Videos/video-{}.mp4'.format(i) if local
+        else None,
+        'thumbnail': None if local else
+        'https://i.ytimg.com/vi/v{:010d}/0.jpg'.format(i),
+        'big_thumb': None,
+        'description': 'A video about the number {}. '.format(i) * 4,
+        'viewcount': i * 37,
+        'duration': i % 3600,
+        'duration_min': i % 3600 / 60,
+        'duration_sec': i % 60
+    } for i in xrange(count)]
+
+
+def timed(results, label, function, *args, **kwargs):
+    """
+    Calls function, appending how long it took to results
+    """
+
+    start = time.time()
+    result = function(*args, **kwargs)
+    results.append((label, time.time() - start))
+    return result
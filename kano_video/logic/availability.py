@@ -0,0 +1,370 @@
+# availability.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tells which local videos of the playlists are missing, before playing
+#
+# The files are checked in batches, one background thread per drive, and
+# the results kept by mount point: only the videos on a drive which was
+# mounted or unmounted since are checked again, as told by polling
+# /proc/self/mounts. A drive whose files take too long to stat is given
+# up on until it is mounted again.
+#
+
+
+import os
+import time
+import select
+import threading
+
+from kano.logging import logger
+
+mounts_file = '/proc/self/mounts'
+
+# Seconds a stat may take before the drive of the file is given up on,
+# whether it comes back or not
+SLOW_STAT = 2.0
+
+
+def unescape_mount_point(text):
+    """
+    Mount points have their spaces and tabs escaped as octal in the mount
+    table, e.g. /media/My\\040Drive
+    """
+
+    parts = text.split('\\')
+    result = parts[0]
+
+    for part in parts[1:]:
+        if len(part) >= 3 and part[:3].isdigit():
+            result += chr(int(part[:3], 8)) + part[3:]
+        else:
+            result += '\\' + part
+
+    return result
+
+
+def read_mounts(openfile):
+    """
+    The device mounted on each mount point
+    """
+
+    mounts = {}
+
+    openfile.seek(0)
+    for line in openfile.read().splitlines():
+        fields = line.split()
+        if len(fields) >= 2:
+            mounts[unescape_mount_point(fields[1])] = fields[0]
+
+    return mounts
+
+
+def get_mount_point(path, mount_points):
+    """
+    The mount point a path is under, given the mount points longest first
+    """
+
+    for mount_point in mount_points:
+        if mount_point == '/' or path == mount_point or \
+                path.startswith(mount_point + '/'):
+            return mount_point
+
+    return '/'
+
+
+class PathValidator(object):
+    """
+    Whether each local video which was asked about exists. Videos not
+    checked yet are taken to be there, and checked in the background.
+
+    The listeners are called from the background thread with the paths
+    whose availability changed, the UI has to take them back to the main
+    loop.
+    """
+
+    def __init__(self, filepath=mounts_file):
+        super(PathValidator, self).__init__()
+
+        self.filepath = filepath
+
+        self._cond = threading.Condition()
+        # Paths waiting to be checked
+        self._queue = set()
+        # mount point -> {path: whether it exists}
+        self._results = {}
+        # Mount points given up on, until they are mounted again
+        self._unresponsive = set()
+        # mount point -> when the batch being checked on it was started
+        self._busy = {}
+        self._listeners = []
+        self._thread = None
+
+        self._mounts_file = None
+        self._mounts = {}
+        try:
+            self._mounts_file = open(filepath)
+            self._mounts = read_mounts(self._mounts_file)
+        except IOError as e:
+            logger.warn('Not watching {} for drives: {}'.format(filepath, e))
+
+        self._mount_points = self._sort(self._mounts)
+
+    @staticmethod
+    def _sort(mounts):
+        return sorted(mounts, key=len, reverse=True)
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def is_available(self, path):
+        """
+        Whether a local video exists, as far as is known. Unknown ones are
+        checked, and said to exist in the meantime.
+        """
+
+        with self._cond:
+            mount_point = get_mount_point(path, self._mount_points)
+            available = self._results.get(mount_point, {}).get(path)
+
+        if available is None:
+            self.check([path])
+            return True
+
+        return available
+
+    def check(self, paths):
+        """
+        Queues local videos to be checked, all in one batch
+        """
+
+        with self._cond:
+            self._queue.update(paths)
+            self._start()
+            self._cond.notify()
+
+    def recheck(self, path):
+        """
+        Forgets what is known of a video, e.g. after the player could not
+        open it, and checks it again
+        """
+
+        with self._cond:
+            for results in self._results.itervalues():
+                results.pop(path, None)
+
+        self.check([path])
+
+    def _start(self):
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+        if self._mounts_file is not None:
+            thread = threading.Thread(target=self._watch_mounts)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batches = self._take_batches()
+                while not batches:
+                    # Woken up in time to give up on a hung drive
+                    self._cond.wait(SLOW_STAT if self._busy else None)
+                    batches = self._take_batches()
+
+                started = time.time()
+                for mount_point in batches:
+                    self._busy[mount_point] = started
+
+            # A drive whose stat hangs only holds up its own batch
+            for mount_point, batch in batches.iteritems():
+                thread = threading.Thread(target=self._run_batch,
+                                          args=(mount_point, sorted(batch),
+                                                started))
+                thread.daemon = True
+                thread.start()
+
+    def _take_batches(self):
+        """
+        Takes the queued paths by mount point, but for the mount points
+        still being checked. Gives up on those which took too long.
+        """
+
+        now = time.time()
+        for mount_point, started in self._busy.iteritems():
+            if now - started > SLOW_STAT and \
+                    mount_point not in self._unresponsive:
+                logger.warn('{} is not responding, taking its videos as '
+                            'missing'.format(mount_point))
+                self._unresponsive.add(mount_point)
+
+        batches = {}
+        for path in self._queue:
+            mount_point = get_mount_point(path, self._mount_points)
+            # Nothing is stat'ed on an unresponsive mount point
+            if mount_point not in self._busy or \
+                    mount_point in self._unresponsive:
+                batches.setdefault(mount_point, []).append(path)
+
+        for batch in batches.itervalues():
+            self._queue.difference_update(batch)
+
+        return batches
+
+    def _run_batch(self, mount_point, paths, started):
+        try:
+            changed = self._check_batch(mount_point, paths)
+        finally:
+            with self._cond:
+                # Unless the drive was mounted again in the meantime
+                if self._busy.get(mount_point) == started:
+                    del self._busy[mount_point]
+                self._cond.notify()
+
+        if changed:
+            self._notify(changed)
+
+    def _check_batch(self, mount_point, paths):
+        """
+        Stats the paths on a mount point, returns those whose availability
+        changed from what was known or assumed
+        """
+
+        results = {}
+
+        with self._cond:
+            unresponsive = mount_point in self._unresponsive
+
+        for path in paths:
+            # Or given up on while this batch was being checked
+            if unresponsive or mount_point in self._unresponsive:
+                results[path] = False
+                continue
+
+            start = time.time()
+            results[path] = os.path.isfile(path)
+
+            if time.time() - start > SLOW_STAT:
+                logger.warn('{} is too slow, taking its videos as '
+                            'missing'.format(mount_point))
+                unresponsive = True
+
+        with self._cond:
+            if unresponsive:
+                self._unresponsive.add(mount_point)
+
+            known = self._results.setdefault(mount_point, {})
+            changed = [path for path, available in results.iteritems()
+                       if known.get(path, True) != available]
+            known.update(results)
+
+        missing = sum(1 for available in results.itervalues()
+                      if not available)
+        if missing:
+            logger.info('{} of {} videos missing under {}'.format(
+                missing, len(results), mount_point))
+
+        return changed
+
+    def _watch_mounts(self):
+        poll = select.poll()
+        poll.register(self._mounts_file.fileno(),
+                      select.POLLPRI | select.POLLERR)
+
+        while True:
+            try:
+                poll.poll()
+            except select.error:
+                continue
+
+            # Has to be read again for the next change to be reported
+            mounts = read_mounts(self._mounts_file)
+            self._mounts_changed(mounts)
+
+    def _mounts_changed(self, mounts):
+        """
+        Checks again the videos under the mount points which changed,
+        along with those they were found under before
+        """
+
+        with self._cond:
+            changed = set(mount_point for mount_point in
+                          set(mounts) | set(self._mounts)
+                          if mounts.get(mount_point) !=
+                          self._mounts.get(mount_point))
+            if not changed:
+                return
+
+            logger.info('Drives changed: {}'.format(
+                ', '.join(sorted(changed))))
+
+            self._mounts = mounts
+            self._mount_points = self._sort(mounts)
+            self._unresponsive -= changed
+            for mount_point in changed:
+                self._busy.pop(mount_point, None)
+
+            # Kept under the mount point they are now under, with what was
+            # last known of them until they are checked again
+            paths = set()
+            for mount_point in self._results.keys():
+                results = self._results[mount_point]
+                for path in results.keys():
+                    new_mount_point = get_mount_point(path,
+                                                      self._mount_points)
+                    if mount_point in changed or new_mount_point in changed:
+                        paths.add(path)
+                        self._results.setdefault(new_mount_point, {})[path] = \
+                            results.pop(path)
+
+            self._queue.update(paths)
+            self._cond.notify()
+
+    def _notify(self, paths):
+        for callback in self._listeners:
+            try:
+                callback(paths)
+            except Exception as e:
+                logger.error('Availability listener failed: {}'.format(e))
+
+
+_validator = None
+
+
+def get_path_validator():
+    global _validator
+
+    if _validator is None:
+        _validator = PathValidator()
+
+    return _validator
+
+
+def _on_playlist_change(name, kind, video):
+    if kind == 'add' and video.get('local_path'):
+        get_path_validator().check([video['local_path']])
+    elif kind == 'reload':
+        get_path_validator().check(
+            [entry['local_path'] for entry in video
+             if entry.get('local_path')])
+
+
+def start_validating():
+    """
+    Checks the videos of the library in the background, and those added to
+    any playlist as they are
+    """
+
+    from .playlist import library_playlist, add_listener
+
+    validator = get_path_validator()
+    validator.check([video['local_path'] for video in
+                     library_playlist.playlist if video.get('local_path')])
+
+    add_listener(_on_playlist_change)
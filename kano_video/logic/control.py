@@ -0,0 +1,202 @@
+# control.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Control channels to drive a running video player
+#
+
+
+import os
+import getpass
+import subprocess
+
+from kano.logging import logger
+
+
+class StdinControl(object):
+    """
+    Drives a player by sending it single keypresses through its stdin
+    """
+
+    KEYS = {
+        'quit': 'q',
+        'pause': ' ',
+        'volume_down': '-',
+        'volume_up': '+'
+    }
+
+    def __init__(self, process):
+        super(StdinControl, self).__init__()
+
+        self.process = process
+
+    def send_key(self, key):
+        try:
+            self.process.stdin.write(key)
+            self.process.stdin.flush()
+        except (IOError, ValueError):
+            # The player has gone and took its stdin pipe with it
+            return False
+
+        return True
+
+    def supports(self, name):
+        return name in self.KEYS
+
+    def command(self, name):
+        key = self.KEYS.get(name)
+        if key is None:
+            return False
+
+        return self.send_key(key)
+
+    def get_position(self):
+        return None
+
+    def get_duration(self):
+        return None
+
+
+class VlcControl(StdinControl):
+    """
+    Drives VLC through its remote control interface on stdin,
+    see the --extraintf rc option
+    """
+
+    KEYS = {
+        'quit': 'quit\n',
+        'pause': 'pause\n',
+        'volume_down': 'voldown 1\n',
+        'volume_up': 'volup 1\n',
+        'previous_chapter': 'chapter_p\n',
+        'next_chapter': 'chapter_n\n',
+        'info': 'info\n'
+    }
+
+
+class OmxplayerControl(StdinControl):
+    """
+    Drives omxplayer through its stdin and, when it has been given a
+    unique --dbus_name, through its DBus MPRIS interface
+    """
+
+    DBUS_PREFIX = 'org.mpris.MediaPlayer2.omxplayer'
+    DBUS_ADDRESS_FILE = '/tmp/omxplayerdbus.{user}'
+    DBUS_TIMEOUT_MS = 500
+
+    KEYS = {
+        'quit': 'q',
+        'pause': 'p',
+        'volume_down': '-',
+        'volume_up': '+',
+        'seek_back': '\x1b[D',
+        'seek_forward': '\x1b[C',
+        'seek_back_long': '\x1b[B',
+        'seek_forward_long': '\x1b[A',
+        'previous_chapter': 'i',
+        'next_chapter': 'o',
+        'subtitles': 's',
+        'info': 'z'
+    }
+
+    def __init__(self, process, dbus_name=None):
+        super(OmxplayerControl, self).__init__(process)
+
+        self.dbus_name = dbus_name
+
+    @staticmethod
+    def get_dbus_env():
+        """
+        The omxplayer launcher starts a private session bus and writes
+        its address to a well known file
+        """
+
+        address_file = OmxplayerControl.DBUS_ADDRESS_FILE.format(
+            user=getpass.getuser())
+
+        try:
+            with open(address_file) as openfile:
+                address = openfile.read().strip()
+        except IOError:
+            return None
+
+        env = dict(os.environ)
+        env['DBUS_SESSION_BUS_ADDRESS'] = address
+        return env
+
+    def dbus_call(self, method, *args):
+        """
+        Calls a method on the player's MPRIS object.
+        Returns the raw reply or None if the call could not be made.
+        """
+
+        if not self.dbus_name:
+            return None
+
+        env = self.get_dbus_env()
+        if not env:
+            return None
+
+        cmd = [
+            'dbus-send', '--print-reply=literal', '--session',
+            '--reply-timeout={}'.format(self.DBUS_TIMEOUT_MS),
+            '--dest={}'.format(self.dbus_name),
+            '/org/mpris/MediaPlayer2', method
+        ]
+        cmd.extend(args)
+
+        try:
+            dbus = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            output, _ = dbus.communicate()
+        except OSError as e:
+            logger.warn('Could not run dbus-send: {}'.format(e))
+            return None
+
+        if dbus.returncode != 0:
+            return None
+
+        return output
+
+    def pause(self):
+        # Unlike Action 16, PLAYPAUSE in omxplayer's key map, Pause does not
+        # toggle: a call which timed out but still got through is harmless
+        return self.dbus_call('org.mpris.MediaPlayer2.Player.Pause') \
+            is not None
+
+    def play(self):
+        return self.dbus_call('org.mpris.MediaPlayer2.Player.Play') \
+            is not None
+
+    def set_alpha(self, alpha):
+        return self.dbus_call('org.mpris.MediaPlayer2.Player.SetAlpha',
+                              'objpath:/not/used',
+                              'int64:{}'.format(alpha)) is not None
+
+    def get_position(self):
+        """
+        Returns the playback position in seconds, None if unknown
+        """
+
+        reply = self.dbus_call('org.freedesktop.DBus.Properties.Position')
+        try:
+            # Replies as "int64 <microseconds>"
+            return int(reply.split()[-1]) / 1000000.0
+        except (AttributeError, IndexError, ValueError):
+            return None
+
+    def get_duration(self):
+        reply = self.dbus_call('org.freedesktop.DBus.Properties.Duration')
+        try:
+            return int(reply.split()[-1]) / 1000000.0
+        except (AttributeError, IndexError, ValueError):
+            return None
+
+    def set_volume(self, millibel):
+        # omxplayer takes the DBus volume as a linear amplitude
+        volume = pow(10, millibel / 2000.0)
+        return self.dbus_call('org.freedesktop.DBus.Properties.Set',
+                              'string:org.mpris.MediaPlayer2.Player',
+                              'string:Volume',
+                              'double:{}'.format(volume)) is not None
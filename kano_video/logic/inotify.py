@@ -0,0 +1,134 @@
+# inotify.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# A minimal, non-blocking binding to the Linux inotify API through libc
+#
+
+
+import os
+import errno
+import struct
+import ctypes
+import ctypes.util
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0x80000
+
+# struct inotify_event: int wd, uint32 mask, uint32 cookie, uint32 len
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 4096
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+
+    return _libc
+
+
+class InotifyEvent(object):
+    __slots__ = ('wd', 'mask', 'cookie', 'name', 'path')
+
+    def __init__(self, wd, mask, cookie, name, path):
+        self.wd = wd
+        self.mask = mask
+        self.cookie = cookie
+        self.name = name
+        self.path = path
+
+    def __repr__(self):
+        return 'InotifyEvent({}, {:#x})'.format(self.path, self.mask)
+
+
+class Inotify(object):
+    """
+    An inotify instance. Its fd never blocks, so it can either be put in a
+    poll set or simply drained with read_events() whenever convenient.
+    Raises OSError if inotify is not available.
+    """
+
+    def __init__(self):
+        super(Inotify, self).__init__()
+
+        libc = _get_libc()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self._watches = {}
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask):
+        wd = _get_libc().inotify_add_watch(self._fd, path, mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+
+        self._watches[wd] = path
+        return wd
+
+    def read_events(self):
+        """
+        Returns all the events queued so far, an empty list if none
+        """
+
+        events = []
+
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+
+            if not data:
+                break
+
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = \
+                    _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+
+                directory = self._watches.get(wd)
+                path = os.path.join(directory, name) \
+                    if directory and name else directory
+
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+
+                events.append(InotifyEvent(wd, mask, cookie, name, path))
+
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -0,0 +1,229 @@
+# inputdevices.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Finds the input devices able to control a video, parsing them once from
+# /proc/bus/input/devices and keeping them until /dev/input changes
+#
+
+
+import os
+import struct
+import threading
+
+from kano.logging import logger
+
+from . import inotify
+
+proc_devices = '/proc/bus/input/devices'
+dev_input_dir = '/dev/input'
+
+# Event types, see linux/input-event-codes.h
+EV_KEY = 0x01
+
+# Keys used to control the player, a device able to send any of them is
+# treated as a keyboard. Remotes often only have the media keys.
+KEY_ESC = 1
+KEY_Q = 16
+KEY_SPACE = 57
+KEY_STOPCD = 166
+KEY_PLAYPAUSE = 164
+KEY_PLAYCD = 200
+CONTROL_KEYS = (KEY_ESC, KEY_Q, KEY_SPACE, KEY_PLAYPAUSE, KEY_STOPCD,
+                KEY_PLAYCD)
+
+
+class InputDevice(object):
+    """
+    A block of /proc/bus/input/devices
+    """
+
+    def __init__(self):
+        super(InputDevice, self).__init__()
+
+        self.name = ''
+        self.phys = ''
+        self.info = {}
+        self.handlers = []
+        self.capabilities = {}
+
+    @property
+    def event_node(self):
+        for handler in self.handlers:
+            if handler.startswith('event'):
+                return os.path.join(dev_input_dir, handler)
+
+        return None
+
+    def has_capability(self, kind, bit):
+        return bool(self.capabilities.get(kind, 0) & (1 << bit))
+
+    def is_keyboard(self):
+        if not self.event_node or not self.has_capability('EV', EV_KEY):
+            return False
+
+        return any(self.has_capability('KEY', key) for key in CONTROL_KEYS)
+
+    def __repr__(self):
+        return 'InputDevice({!r}, {})'.format(self.name, self.event_node)
+
+
+def parse_bitmap(words, word_bits):
+    """
+    The kernel prints bitmaps as longs in hex, most significant first
+    """
+
+    bitmap = 0
+    for word in words:
+        bitmap = (bitmap << word_bits) | int(word, 16)
+
+    return bitmap
+
+
+def parse_input_devices(fdevice_list=proc_devices):
+    """
+    Parses the blank-line separated device blocks of
+    /proc/bus/input/devices, capability bitmaps included.
+    https://www.kernel.org/doc/Documentation/input/input.txt
+    """
+
+    blocks = []
+    current = []
+
+    with open(fdevice_list) as devices:
+        for line in devices:
+            line = line.strip()
+            if line:
+                current.append(line)
+            elif current:
+                blocks.append(current)
+                current = []
+    if current:
+        blocks.append(current)
+
+    # Bitmap words are kernel longs: a word wider than 32 bits gives
+    # away a 64 bit kernel, even under a 32 bit userland
+    word_bits = struct.calcsize('l') * 8
+    bitmaps = []
+
+    devices = []
+    for block in blocks:
+        device = InputDevice()
+
+        for line in block:
+            kind, _, value = line.partition(': ')
+
+            if kind == 'I':
+                for pair in value.split():
+                    key, _, val = pair.partition('=')
+                    device.info[key] = val
+            elif kind == 'N':
+                device.name = value.partition('=')[2].strip('"')
+            elif kind == 'P':
+                device.phys = value.partition('=')[2]
+            elif kind == 'H':
+                device.handlers = value.partition('=')[2].split()
+            elif kind == 'B':
+                name, _, words = value.partition('=')
+                words = words.split()
+                if any(len(word) > 8 for word in words):
+                    word_bits = 64
+                bitmaps.append((device, name, words))
+
+        devices.append(device)
+
+    for device, name, words in bitmaps:
+        try:
+            device.capabilities[name] = parse_bitmap(words, word_bits)
+        except ValueError:
+            pass
+
+    return devices
+
+
+class InputDeviceCache(object):
+    """
+    Keeps the parsed devices until inotify reports a node being added,
+    removed or having its permissions changed in /dev/input.
+    Without inotify, the directory modification time is checked instead.
+    """
+
+    WATCH_MASK = inotify.IN_CREATE | inotify.IN_DELETE | inotify.IN_ATTRIB | \
+        inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO
+
+    def __init__(self, fdevice_list=proc_devices, directory=dev_input_dir):
+        super(InputDeviceCache, self).__init__()
+
+        self.fdevice_list = fdevice_list
+        self.directory = directory
+
+        self._lock = threading.Lock()
+        self._devices = None
+        self._mtime = None
+        self._watch = None
+
+        try:
+            self._watch = inotify.Inotify()
+            self._watch.add_watch(directory, self.WATCH_MASK)
+        except OSError as e:
+            logger.warn('Not watching {} for devices: {}'.format(directory, e))
+            if self._watch:
+                self._watch.close()
+            self._watch = None
+
+    def fileno(self):
+        """
+        Readable whenever the devices might have changed, for poll sets.
+        None if inotify is not available.
+        """
+
+        if self._watch:
+            return self._watch.fileno()
+        return None
+
+    def check(self):
+        """
+        Drops the cached devices if /dev/input changed.
+        Returns True if it did.
+        """
+
+        with self._lock:
+            if self._watch:
+                changed = bool(self._watch.read_events())
+            else:
+                try:
+                    mtime = os.stat(self.directory).st_mtime
+                except OSError:
+                    mtime = None
+                changed = mtime != self._mtime
+                self._mtime = mtime
+
+            if changed:
+                self._devices = None
+
+        return changed
+
+    def get_devices(self):
+        self.check()
+
+        with self._lock:
+            if self._devices is None:
+                self._devices = parse_input_devices(self.fdevice_list)
+            return self._devices
+
+    def get_keyboards(self):
+        return [device.event_node for device in self.get_devices()
+                if device.is_keyboard()]
+
+
+_cache = None
+
+
+def get_input_device_cache():
+    global _cache
+
+    if _cache is None:
+        _cache = InputDeviceCache()
+
+    return _cache
@@ -0,0 +1,310 @@
+# keyboard.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Listens to every keyboard at once, straight from the evdev nodes
+#
+
+
+import os
+import time
+import fcntl
+import errno
+import select
+import struct
+import threading
+
+from kano.logging import logger
+
+# struct input_event: long int, long int, unsigned short, unsigned short,
+# unsigned int
+EVENT_FORMAT = 'llHHI'
+EVENT = struct.Struct(EVENT_FORMAT)
+EVENT_SIZE = EVENT.size
+
+# Most events drained from a device with a single read
+READ_EVENTS = 64
+READ_SIZE = READ_EVENTS * EVENT_SIZE
+
+EV_KEY = 1
+
+# Seconds between checks for keyboards being plugged in or out, when
+# there is no watcher to tell
+RESCAN_INTERVAL = 2
+
+
+def iter_events(data):
+    """
+    Unpacks every input event in a buffer, which the kernel only ever
+    fills with whole events
+    """
+
+    end = len(data) - len(data) % EVENT_SIZE
+    for offset in xrange(0, end, EVENT_SIZE):
+        yield EVENT.unpack_from(data, offset)
+
+
+def dispatch(data, handler):
+    """
+    Decodes a buffer of whole input events and hands the key ones to the
+    handler. Returns True if the handler asked to stop.
+    """
+
+    for _, _, ev_type, code, value in iter_events(data):
+        if ev_type == EV_KEY and handler(code, value):
+            return True
+
+    return False
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class KeyboardMultiplexer(object):
+    """
+    Waits on all the keyboard evdev nodes in a single epoll set, on a
+    single thread which serves one play after the other.
+
+    attach(handler) makes handler(code, value) receive every key event,
+    until it returns True or is detached. While nothing is attached the
+    keyboards are closed and the thread sleeps. A self-pipe in the epoll
+    set wakes it up as soon as a handler comes or goes.
+
+    watcher is optional, an object with fileno() and check() methods such
+    as InputDeviceCache. Its fd joins the epoll set and the devices are
+    rescanned when check() says they changed. Without it, they are
+    rescanned every RESCAN_INTERVAL seconds.
+    """
+
+    def __init__(self, list_devices, watcher=None):
+        super(KeyboardMultiplexer, self).__init__()
+
+        self.list_devices = list_devices
+
+        self._lock = threading.Lock()
+        self._handler = None
+        self._thread = None
+        self._closed = False
+
+        self._epoll = select.epoll()
+        self._paths = {}
+        self._fds = {}
+        self._last_scan = 0
+
+        self._wake_r, self._wake_w = os.pipe()
+        _set_nonblocking(self._wake_r)
+        _set_nonblocking(self._wake_w)
+        self._epoll.register(self._wake_r, select.EPOLLIN)
+
+        self._watcher = None
+        self._watcher_fd = None
+        if watcher is not None and watcher.fileno() is not None:
+            self._watcher = watcher
+            self._watcher_fd = watcher.fileno()
+            self._epoll.register(self._watcher_fd, select.EPOLLIN)
+
+    def attach(self, handler):
+        """
+        Sends the key events to handler from now on, in place of any
+        previous one
+        """
+
+        with self._lock:
+            if self._closed:
+                return
+
+            self._handler = handler
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+        self._wake()
+
+    def detach(self, handler=None):
+        """
+        Stops sending key events to handler, or to whichever is attached
+        """
+
+        with self._lock:
+            if handler is None or self._handler is handler:
+                self._handler = None
+
+        self._wake()
+
+    def is_attached(self, handler):
+        return self._handler is handler
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._handler = None
+            thread = self._thread
+
+        self._wake()
+        if thread:
+            thread.join()
+
+        if self._watcher_fd is not None:
+            # The watcher is shared, it only leaves this epoll set
+            self._epoll.unregister(self._watcher_fd)
+        self._epoll.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def get_devices(self):
+        return sorted(self._paths.keys())
+
+    def get_stats(self):
+        """
+        What the reader is holding on to, so soak tests can check that
+        plays do not leak threads or file descriptors
+        """
+
+        thread_alive = self._thread is not None and self._thread.is_alive()
+
+        # Keyboards, plus the epoll fd and both ends of the self-pipe
+        fds = 0 if self._closed else len(self._paths) + 3
+
+        return {
+            'threads': 1 if thread_alive else 0,
+            'devices': len(self._paths),
+            'fds': fds,
+            'attached': self._handler is not None
+        }
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, 'x')
+        except OSError:
+            # Full pipe: a wake up is pending anyway
+            pass
+
+    def _drain_wake(self):
+        try:
+            while os.read(self._wake_r, 512):
+                pass
+        except OSError:
+            pass
+
+    def add_device(self, path):
+        if path in self._paths:
+            return
+
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError as e:
+            logger.warn('Cannot listen to keyboard {}: {}'.format(path, e))
+            return
+
+        self._epoll.register(fd, select.EPOLLIN)
+        self._paths[path] = fd
+        self._fds[fd] = path
+        logger.info('Listening to keyboard {}'.format(path))
+
+    def remove_device(self, path):
+        fd = self._paths.pop(path, None)
+        if fd is None:
+            return
+
+        del self._fds[fd]
+        try:
+            self._epoll.unregister(fd)
+        except (IOError, ValueError):
+            pass
+        os.close(fd)
+        logger.info('Stopped listening to keyboard {}'.format(path))
+
+    def remove_all_devices(self):
+        for path in self._paths.keys():
+            self.remove_device(path)
+
+    def rescan(self):
+        self._last_scan = time.time()
+
+        try:
+            paths = set(self.list_devices())
+        except (IOError, OSError) as e:
+            logger.warn('Could not list keyboards: {}'.format(e))
+            return
+
+        for path in set(self._paths) - paths:
+            self.remove_device(path)
+        for path in paths - set(self._paths):
+            self.add_device(path)
+
+    def _run(self):
+        try:
+            while not self._closed:
+                self._loop_once()
+        finally:
+            self.remove_all_devices()
+
+    def _loop_once(self):
+        handler = self._handler
+        timeout = -1
+
+        if handler is None:
+            # Nobody to listen for, let go of the keyboards and look them
+            # up again for the next handler
+            self.remove_all_devices()
+            self._last_scan = 0
+        elif self._watcher is None:
+            if time.time() - self._last_scan >= RESCAN_INTERVAL:
+                self.rescan()
+            timeout = RESCAN_INTERVAL
+        elif not self._paths:
+            self.rescan()
+
+        try:
+            ready = self._epoll.poll(timeout)
+        except IOError as e:
+            if e.errno == errno.EINTR:
+                return
+            raise
+
+        for fd, mask in ready:
+            if fd == self._wake_r:
+                self._drain_wake()
+            elif fd == self._watcher_fd:
+                if self._watcher.check() and handler is not None:
+                    self.rescan()
+            elif handler is not None and handler is self._handler:
+                if self._read_events(fd, mask, handler):
+                    self.detach(handler)
+                    handler = None
+
+    def _read_events(self, fd, mask, handler):
+        path = self._fds.get(fd)
+        if path is None:
+            return False
+
+        if mask & (select.EPOLLERR | select.EPOLLHUP):
+            self.remove_device(path)
+            return False
+
+        while True:
+            try:
+                data = os.read(fd, READ_SIZE)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    # ENODEV once the keyboard is unplugged
+                    self.remove_device(path)
+                return False
+
+            if len(data) < EVENT_SIZE:
+                self.remove_device(path)
+                return False
+
+            if dispatch(data, handler):
+                return True
+
+            # A short read means the device has been drained
+            if len(data) < READ_SIZE:
+                return False
@@ -0,0 +1,192 @@
+# keymap.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Maps keyboard keys to player commands
+#
+# Commands are backend independent names, e.g. 'pause' or 'seek_forward',
+# which each control channel in control.py translates for its player.
+# The map can be changed in ~/.kano-video/keymap.json, e.g.
+#   {"KEY_N": "seek_forward", "KEY_LEFT": {"command": "seek_back",
+#    "on": ["press", "repeat"]}, "KEY_P": null}
+#
+
+
+import os
+import json
+
+from kano.logging import logger
+from kano_video.paths import user_dir
+
+keymap_file = os.path.join(user_dir, 'keymap.json')
+
+# Key event values
+RELEASE = 0
+PRESS = 1
+REPEAT = 2
+KEY_VALUES = {'release': RELEASE, 'press': PRESS, 'repeat': REPEAT}
+
+# Key codes from linux/input-event-codes.h
+KEY_CODES = {
+    'KEY_ESC': 1, 'KEY_1': 2, 'KEY_2': 3, 'KEY_3': 4, 'KEY_4': 5,
+    'KEY_5': 6, 'KEY_6': 7, 'KEY_7': 8, 'KEY_8': 9, 'KEY_9': 10,
+    'KEY_0': 11, 'KEY_MINUS': 12, 'KEY_EQUAL': 13, 'KEY_BACKSPACE': 14,
+    'KEY_TAB': 15, 'KEY_Q': 16, 'KEY_W': 17, 'KEY_E': 18, 'KEY_R': 19,
+    'KEY_T': 20, 'KEY_Y': 21, 'KEY_U': 22, 'KEY_I': 23, 'KEY_O': 24,
+    'KEY_P': 25, 'KEY_LEFTBRACE': 26, 'KEY_RIGHTBRACE': 27, 'KEY_ENTER': 28,
+    'KEY_A': 30, 'KEY_S': 31, 'KEY_D': 32, 'KEY_F': 33, 'KEY_G': 34,
+    'KEY_H': 35, 'KEY_J': 36, 'KEY_K': 37, 'KEY_L': 38, 'KEY_SEMICOLON': 39,
+    'KEY_APOSTROPHE': 40, 'KEY_GRAVE': 41, 'KEY_BACKSLASH': 43, 'KEY_Z': 44,
+    'KEY_X': 45, 'KEY_C': 46, 'KEY_V': 47, 'KEY_B': 48, 'KEY_N': 49,
+    'KEY_M': 50, 'KEY_COMMA': 51, 'KEY_DOT': 52, 'KEY_SLASH': 53,
+    'KEY_KPASTERISK': 55, 'KEY_SPACE': 57, 'KEY_F1': 59, 'KEY_F2': 60,
+    'KEY_F3': 61, 'KEY_F4': 62, 'KEY_F5': 63, 'KEY_F6': 64, 'KEY_F7': 65,
+    'KEY_F8': 66, 'KEY_F9': 67, 'KEY_F10': 68, 'KEY_KP7': 71, 'KEY_KP8': 72,
+    'KEY_KP9': 73, 'KEY_KPMINUS': 74, 'KEY_KP4': 75, 'KEY_KP5': 76,
+    'KEY_KP6': 77, 'KEY_KPPLUS': 78, 'KEY_KP1': 79, 'KEY_KP2': 80,
+    'KEY_KP3': 81, 'KEY_KP0': 82, 'KEY_KPDOT': 83, 'KEY_F11': 87,
+    'KEY_F12': 88, 'KEY_KPENTER': 96, 'KEY_KPSLASH': 98, 'KEY_HOME': 102,
+    'KEY_UP': 103, 'KEY_PAGEUP': 104, 'KEY_LEFT': 105, 'KEY_RIGHT': 106,
+    'KEY_END': 107, 'KEY_DOWN': 108, 'KEY_PAGEDOWN': 109, 'KEY_INSERT': 110,
+    'KEY_DELETE': 111, 'KEY_MUTE': 113, 'KEY_VOLUMEDOWN': 114,
+    'KEY_VOLUMEUP': 115, 'KEY_POWER': 116, 'KEY_KPEQUAL': 117,
+    'KEY_PAUSE': 119, 'KEY_STOP': 128, 'KEY_BACK': 158, 'KEY_FORWARD': 159,
+    'KEY_NEXTSONG': 163, 'KEY_PLAYPAUSE': 164, 'KEY_PREVIOUSSONG': 165,
+    'KEY_STOPCD': 166, 'KEY_REWIND': 168, 'KEY_EXIT': 174, 'KEY_PLAYCD': 200,
+    'KEY_PAUSECD': 201, 'KEY_FASTFORWARD': 208, 'KEY_OK': 352,
+    'KEY_INFO': 358, 'KEY_SUBTITLE': 370
+}
+
+# Commands act on key release unless told otherwise, as they always have
+DEFAULT_KEYMAP = {
+    'KEY_ESC': 'quit',
+    'KEY_Q': 'quit',
+    'KEY_STOP': 'quit',
+    'KEY_STOPCD': 'quit',
+    'KEY_EXIT': 'quit',
+    'KEY_BACK': 'quit',
+    'KEY_SPACE': 'pause',
+    'KEY_P': 'pause',
+    'KEY_PAUSE': 'pause',
+    'KEY_PLAYPAUSE': 'pause',
+    'KEY_PLAYCD': 'pause',
+    'KEY_PAUSECD': 'pause',
+    'KEY_OK': 'pause',
+    'KEY_MINUS': 'volume_down',
+    'KEY_KPMINUS': 'volume_down',
+    'KEY_VOLUMEDOWN': 'volume_down',
+    'KEY_EQUAL': 'volume_up',
+    'KEY_KPPLUS': 'volume_up',
+    'KEY_VOLUMEUP': 'volume_up',
+    'KEY_LEFT': 'seek_back',
+    'KEY_REWIND': 'seek_back',
+    'KEY_RIGHT': 'seek_forward',
+    'KEY_FASTFORWARD': 'seek_forward',
+    'KEY_DOWN': 'seek_back_long',
+    'KEY_UP': 'seek_forward_long',
+    'KEY_PREVIOUSSONG': 'previous_chapter',
+    'KEY_NEXTSONG': 'next_chapter',
+    'KEY_S': 'subtitles',
+    'KEY_SUBTITLE': 'subtitles',
+    'KEY_Z': 'info',
+    'KEY_INFO': 'info'
+}
+
+
+def compile_keymap(keymap):
+    """
+    Turns a {key name: command} map into the {(code, value): command}
+    table used to dispatch key events
+    """
+
+    table = {}
+
+    for name, binding in keymap.iteritems():
+        code = KEY_CODES.get(name)
+        if code is None:
+            try:
+                code = int(name)
+            except ValueError:
+                logger.warn('Unknown key in key map: {}'.format(name))
+                continue
+
+        if binding is None:
+            continue
+
+        if isinstance(binding, dict):
+            command = binding.get('command')
+            on = binding.get('on', ['release'])
+            if not isinstance(on, list):
+                on = [on]
+        else:
+            command = binding
+            on = ['release']
+
+        for value in on:
+            if value in KEY_VALUES:
+                table[(code, KEY_VALUES[value])] = command
+
+    return table
+
+
+def load_keymap(filepath=keymap_file):
+    """
+    The default key map with the user's changes on top, a binding of
+    null removes the default for that key
+    """
+
+    keymap = dict(DEFAULT_KEYMAP)
+
+    try:
+        with open(filepath) as openfile:
+            keymap.update(json.load(openfile))
+    except IOError:
+        pass
+    except ValueError as e:
+        logger.error('Ignoring malformed key map {}: {}'.format(filepath, e))
+
+    return compile_keymap(keymap)
+
+
+_keymap = None
+
+
+def get_keymap():
+    global _keymap
+
+    if _keymap is None:
+        _keymap = load_keymap()
+
+    return _keymap
+
+
+class KeyDispatcher(object):
+    """
+    Sends the command bound to each key event to a player control channel
+    """
+
+    def __init__(self, control, keymap=None):
+        super(KeyDispatcher, self).__init__()
+
+        self.control = control
+        self.keymap = keymap if keymap is not None else get_keymap()
+
+    def __call__(self, code, value):
+        """
+        Handles a key event, returns True once the player is being quit or
+        is gone, so listening can stop
+        """
+
+        command = self.keymap.get((code, value))
+        if command is None:
+            return False
+
+        sent = self.control.command(command)
+        if command == 'quit':
+            logger.info('Quit key detected, terminating the player')
+            return True
+
+        # The player has gone if its control channel failed on a command
+        # which it does support
+        return not sent and self.control.supports(command)
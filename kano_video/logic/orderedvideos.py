@@ -0,0 +1,247 @@
+# orderedvideos.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# An ordered list of videos which knows where each video is
+#
+
+
+from .playliststore import video_key
+
+# Tombstones tolerated before the slots are compacted, at least
+MIN_TOMBSTONES = 32
+
+
+class OrderedVideos(object):
+    """
+    The videos of a playlist in order, each one at most once, indexed by
+    video_key() so that a video is found whatever the rest of its entry
+    says, e.g. a refreshed viewcount.
+
+    Removed videos leave a tombstone in their slot, and a Fenwick tree
+    over the slots counts the live ones before any slot. That makes
+    membership O(1), and finding, removing or appending a video
+    O(log n). Inserting anywhere but at the end shifts the slots, O(n).
+
+    Supports the list operations used on playlists: len, iteration,
+    indexing, del, insert, pop, append and index.
+    """
+
+    def __init__(self, videos=(), key=video_key):
+        super(OrderedVideos, self).__init__()
+
+        self.key = key
+
+        # Videos dropped for being in the list already
+        self.duplicates = []
+
+        self._rebuild(videos)
+
+    def _rebuild(self, videos):
+        self._slots = []
+        self._keys = []
+        self._positions = {}
+
+        for video in videos:
+            key = self.key(video)
+            if key in self._positions:
+                self.duplicates.append(video)
+                continue
+
+            self._positions[key] = len(self._slots)
+            self._slots.append(video)
+            self._keys.append(key)
+
+        # Fenwick tree of the live slots, built in O(n)
+        size = len(self._slots)
+        self._tree = [0] + [1] * size
+        for i in xrange(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                self._tree[parent] += self._tree[i]
+
+        self._live = size
+
+    def _add_to_tree(self, slot, delta):
+        i = slot + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _rank(self, slot):
+        """
+        The number of live slots before slot
+        """
+
+        count = 0
+        i = slot
+        while i > 0:
+            count += self._tree[i]
+            i -= i & -i
+
+        return count
+
+    def _select(self, index):
+        """
+        The slot of the live video at index
+        """
+
+        if index < 0:
+            index += self._live
+        if not 0 <= index < self._live:
+            raise IndexError('video index out of range')
+
+        slot = 0
+        step = 1
+        while step * 2 < len(self._tree):
+            step *= 2
+
+        # Descend the tree to the last slot with index live ones before it
+        remaining = index + 1
+        while step:
+            if slot + step < len(self._tree) and \
+                    self._tree[slot + step] < remaining:
+                slot += step
+                remaining -= self._tree[slot]
+            step //= 2
+
+        return slot
+
+    def _get_key(self, video):
+        if isinstance(video, basestring):
+            return video
+        return self.key(video)
+
+    def __len__(self):
+        return self._live
+
+    def __iter__(self):
+        for video in self._slots:
+            if video is not None:
+                yield video
+
+    def __contains__(self, video):
+        return self._get_key(video) in self._positions
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.to_list()[index]
+
+        return self._slots[self._select(index)]
+
+    def __delitem__(self, index):
+        self._delete_slot(self._select(index))
+
+    def __repr__(self):
+        return 'OrderedVideos({!r})'.format(self.to_list())
+
+    def to_list(self):
+        return list(self)
+
+    def keys(self):
+        return [key for key, video in zip(self._keys, self._slots)
+                if video is not None]
+
+    def get(self, video):
+        """
+        The entry held for a video or its key, None if there is none
+        """
+
+        slot = self._positions.get(self._get_key(video))
+        if slot is None:
+            return None
+
+        return self._slots[slot]
+
+    def index(self, video):
+        """
+        The position of a video, or of its key, in O(log n)
+        """
+
+        slot = self._positions.get(self._get_key(video))
+        if slot is None:
+            raise ValueError('video not in the playlist')
+
+        return self._rank(slot)
+
+    def append(self, video):
+        """
+        Adds a video at the end, returns False if it was there already
+        """
+
+        key = self.key(video)
+        if key in self._positions:
+            return False
+
+        slot = len(self._slots)
+        self._slots.append(video)
+        self._keys.append(key)
+        self._positions[key] = slot
+
+        # The new node covers the slots from slot + 1 - lowbit to itself
+        i = slot + 1
+        low = i - (i & -i)
+        self._tree.append(self._rank(slot) - self._rank(low) + 1)
+        self._live += 1
+
+        return True
+
+    def insert(self, index, video):
+        if index >= self._live:
+            return self.append(video)
+
+        if video in self:
+            return False
+
+        videos = self.to_list()
+        videos.insert(index, video)
+        self._rebuild(videos)
+
+        return True
+
+    def pop(self, index=-1):
+        slot = self._select(index)
+        video = self._slots[slot]
+        self._delete_slot(slot)
+
+        return video
+
+    def remove(self, video):
+        """
+        Removes a video, or the video with a key, whatever the rest of its
+        entry says. Returns its position.
+        """
+
+        index = self.index(video)
+        del self[index]
+
+        return index
+
+    def move(self, old_index, new_index):
+        self.insert(new_index, self.pop(old_index))
+
+    def reorder(self, order):
+        """
+        Puts the videos in a new order, given as the list of their current
+        positions
+        """
+
+        videos = self.to_list()
+        if sorted(order) != range(len(videos)):
+            raise ValueError('not a reordering of the videos')
+
+        self._rebuild([videos[i] for i in order])
+
+    def _delete_slot(self, slot):
+        video = self._slots[slot]
+        del self._positions[self._keys[slot]]
+        self._slots[slot] = None
+        self._add_to_tree(slot, -1)
+        self._live -= 1
+
+        tombstones = len(self._slots) - self._live
+        if tombstones > max(MIN_TOMBSTONES, self._live):
+            self._rebuild(self.to_list())
+
+        return video
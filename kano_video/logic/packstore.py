@@ -0,0 +1,431 @@
+# packstore.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Keeps the playlist snapshots in a compact binary format
+#
+# Enabled with "playlist_storage": "pack" in the settings, the JSON
+# playlists are then imported once. The journals stay as they are, see
+# JsonPlaylistStore.
+#
+# A pack file is made of, all integers little-endian:
+#   a header, see HEADER
+#   the generation of the snapshot, as long as the header says
+#   the videos, each one a record prefixed with its length
+#   the index, the offset of each record as a fixed-width integer
+#   the string table, the offset of each string, then the strings
+#   the shapes, as JSON
+# The file is mapped into memory, so the count is read from the header,
+# and any video found through the index, without reading anything else.
+#
+# A record is the number of its shape followed by the values of its fields
+# as a JSON array. A shape is the names of the fields, kept once for all
+# the videos which have the same fields, and which of them are in the
+# string table: the authors, kept once however many videos they made.
+# Loading a whole playlist parses the arrays all at once.
+#
+
+
+import os
+import json
+import mmap
+import struct
+
+from kano.logging import logger
+
+from .playliststore import JsonPlaylistStore, playlist_dir
+from .storage import atomic_open
+
+pack_dir = os.path.join(playlist_dir, 'pack')
+
+MAGIC = 'KVPK'
+VERSION = 2
+
+# magic, version, flags, count, string count, index offset, string table
+# offset, shapes offset, length of the generation
+HEADER = struct.Struct('<4sHHIIIIIH')
+
+FLAG_PERMANENT = 0x1
+
+# Fields whose values are kept in the string table
+INTERNED_FIELDS = ('author',)
+
+U32 = struct.Struct('<I')
+
+# The length of a record and its shape
+RECORD_HEADER = struct.Struct('<II')
+
+# Created once the JSON playlists have been imported
+IMPORT_STAMP = 'imported.stamp'
+
+
+def _text(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class Table(object):
+    """
+    Gives each item kept once in a pack its number, the same one every
+    time
+    """
+
+    def __init__(self):
+        super(Table, self).__init__()
+
+        self.items = []
+        self._ids = {}
+
+    def get_id(self, item):
+        item_id = self._ids.get(item)
+        if item_id is None:
+            item_id = self._ids[item] = len(self.items)
+            self.items.append(item)
+
+        return item_id
+
+
+def encode_video(video, strings, shapes):
+    """
+    The record of a video, its shape put in shapes and its authors in
+    strings
+    """
+
+    fields = tuple(sorted(video))
+    values = []
+    refs = []
+
+    for i, field in enumerate(fields):
+        value = video[field]
+        if field in INTERNED_FIELDS and isinstance(value, basestring):
+            value = strings.get_id(_text(value))
+            refs.append(i)
+        values.append(value)
+
+    shape_id = shapes.get_id((fields, tuple(refs)))
+
+    return U32.pack(shape_id) + json.dumps(values, separators=(',', ':'))
+
+
+def write_pack(openfile, permanent, generation, videos):
+    """
+    Writes a pack a video at a time: only the index, the strings and the
+    shapes are kept in memory
+    """
+
+    strings = Table()
+    shapes = Table()
+    offsets = []
+
+    generation = _text(generation or '')
+    if len(generation) > 0xffff:
+        raise ValueError('generation too long: {}'.format(generation))
+
+    openfile.write('\0' * HEADER.size + generation)
+    offset = HEADER.size + len(generation)
+
+    for video in videos:
+        record = encode_video(video, strings, shapes)
+        offsets.append(offset)
+        openfile.write(U32.pack(len(record)) + record)
+        offset += U32.size + len(record)
+
+    index_offset = offset
+    openfile.write(struct.pack('<{}I'.format(len(offsets)), *offsets))
+    offset += U32.size * len(offsets)
+
+    strings_offset = offset
+    string_offsets = []
+    offset += U32.size * len(strings.items)
+    for text in strings.items:
+        string_offsets.append(offset)
+        offset += U32.size + len(text)
+
+    openfile.write(struct.pack('<{}I'.format(len(string_offsets)),
+                               *string_offsets))
+    for text in strings.items:
+        openfile.write(U32.pack(len(text)) + text)
+
+    shapes_offset = offset
+    openfile.write(json.dumps(shapes.items))
+
+    openfile.seek(0)
+    openfile.write(HEADER.pack(
+        MAGIC, VERSION, FLAG_PERMANENT if permanent else 0, len(offsets),
+        len(strings.items), index_offset, strings_offset, shapes_offset,
+        len(generation)))
+
+
+class PlaylistPack(object):
+    """
+    A pack file, mapped into memory. The videos are only decoded when they
+    are asked for, see get() and page(), or all at once by videos().
+    """
+
+    def __init__(self, filepath):
+        super(PlaylistPack, self).__init__()
+
+        self.filepath = filepath
+        self._map = None
+
+        with open(filepath, 'rb') as openfile:
+            size = os.fstat(openfile.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError('not a playlist pack: {}'.format(filepath))
+            self._map = mmap.mmap(openfile.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+        magic, version, flags, self.count, self._string_count, \
+            self._index_offset, self._strings_offset, self._shapes_offset, \
+            generation_length = HEADER.unpack_from(self._map, 0)
+
+        if magic != MAGIC or version != VERSION or \
+                max(self._index_offset + U32.size * self.count,
+                    self._strings_offset + U32.size * self._string_count,
+                    self._shapes_offset,
+                    HEADER.size + generation_length) > size:
+            self.close()
+            raise ValueError('not a playlist pack: {}'.format(filepath))
+
+        self.permanent = bool(flags & FLAG_PERMANENT)
+        generation = self._map[HEADER.size:HEADER.size + generation_length]
+        self.generation = generation.decode('utf-8') or None
+
+        self._strings = {}
+        self._shapes = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in xrange(self.count):
+            yield self.get(i)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _get_string(self, string_id):
+        text = self._strings.get(string_id)
+        if text is None:
+            if string_id >= self._string_count:
+                raise ValueError('bad string in {}'.format(self.filepath))
+
+            offset = U32.unpack_from(
+                self._map, self._strings_offset + U32.size * string_id)[0]
+            length = U32.unpack_from(self._map, offset)[0]
+            offset += U32.size
+            text = self._map[offset:offset + length].decode('utf-8')
+            self._strings[string_id] = text
+
+        return text
+
+    def _get_shapes(self):
+        if self._shapes is None:
+            self._shapes = json.loads(self._map[self._shapes_offset:])
+
+        return self._shapes
+
+    def _get_record(self, index):
+        offset = U32.unpack_from(
+            self._map, self._index_offset + U32.size * index)[0]
+        length = U32.unpack_from(self._map, offset)[0]
+        offset += U32.size
+
+        shape_id = U32.unpack_from(self._map, offset)[0]
+
+        return shape_id, self._map[offset + U32.size:offset + length]
+
+    def _make_video(self, shape_id, values):
+        fields, refs = self._get_shapes()[shape_id]
+        for i in refs:
+            values[i] = self._get_string(values[i])
+
+        return dict(zip(fields, values))
+
+    def get(self, index):
+        """
+        Decodes the video at index, as it was in the JSON playlist
+        """
+
+        if not 0 <= index < self.count:
+            raise IndexError('no video at {}'.format(index))
+
+        shape_id, values = self._get_record(index)
+
+        return self._make_video(shape_id, json.loads(values))
+
+    def page(self, start, count):
+        """
+        The videos from start on, count at most
+        """
+
+        return [self.get(i)
+                for i in xrange(max(start, 0), min(start + count, self.count))]
+
+    def videos(self):
+        """
+        All the videos, their values parsed in one go
+        """
+
+        data = self._map
+        offsets = struct.unpack_from('<{}I'.format(self.count), data,
+                                     self._index_offset)
+
+        shape_ids = []
+        records = []
+        for offset in offsets:
+            length, shape_id = RECORD_HEADER.unpack_from(data, offset)
+            shape_ids.append(shape_id)
+            records.append(data[offset + RECORD_HEADER.size:
+                                offset + U32.size + length])
+
+        values = json.loads('[' + ','.join(records) + ']')
+
+        shapes = self._get_shapes()
+        get_string = self._get_string
+        videos = []
+
+        for shape_id, video_values in zip(shape_ids, values):
+            fields, refs = shapes[shape_id]
+            for i in refs:
+                video_values[i] = get_string(video_values[i])
+            videos.append(dict(zip(fields, video_values)))
+
+        return videos
+
+
+def json_to_pack(json_path, pack_path):
+    """
+    Converts a JSON playlist, whose first item may be its header, to a
+    pack
+    """
+
+    with open(json_path) as openfile:
+        data = json.load(openfile)
+
+    permanent = False
+    generation = None
+    if len(data) is not 0 and 'permanent' in data[0]:
+        permanent = data[0]['permanent']
+        generation = data[0].get('generation')
+        del data[0]
+
+    with atomic_open(pack_path) as openfile:
+        write_pack(openfile, permanent, generation, data)
+
+
+def pack_to_json(pack_path, json_path):
+    """
+    Converts a pack back to a JSON playlist, header included
+    """
+
+    with PlaylistPack(pack_path) as pack:
+        data = [{'permanent': pack.permanent,
+                 'generation': pack.generation}]
+        data.extend(pack.videos())
+
+    with atomic_open(json_path) as openfile:
+        json.dump(data, openfile)
+
+
+class PackPlaylistStore(JsonPlaylistStore):
+    """
+    Keeps each playlist as a pack snapshot, Name.pack, along with a
+    journal as JsonPlaylistStore does. The summaries are read from the
+    header of the packs and the journals, without decoding any video.
+    """
+
+    SNAPSHOT_EXT = '.pack'
+
+    def __init__(self, directory=pack_dir):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        super(PackPlaylistStore, self).__init__(directory)
+
+    def migrate(self, json_store):
+        """
+        Imports the JSON playlists, the first time only
+        """
+
+        stamp = os.path.join(self.directory, IMPORT_STAMP)
+        if os.path.exists(stamp):
+            return
+
+        count = 0
+        for name in json_store.get_summaries():
+            data = json_store.load(name)
+            if data is not None:
+                self.replace(name, data[0], data[1])
+                count += 1
+
+        with atomic_open(stamp) as openfile:
+            openfile.write('{}\n'.format(count))
+
+        logger.info('Imported {} playlists into {}'.format(
+            count, self.directory))
+
+    def _open_pack(self, name):
+        """
+        The pack of a playlist, None if there is none or it cannot be read
+        """
+
+        filepath = self._get_path(name, self.SNAPSHOT_EXT)
+        try:
+            return PlaylistPack(filepath)
+        except IOError:
+            return None
+        except ValueError as e:
+            logger.error('Ignoring the playlist {}: {}'.format(name, e))
+            return None
+
+    def _read_snapshot(self, name):
+        pack = self._open_pack(name)
+        if pack is None:
+            return None
+
+        with pack:
+            try:
+                return pack.permanent, pack.generation, pack.videos()
+            except (ValueError, IndexError, TypeError, struct.error) as e:
+                logger.error('Ignoring the playlist {}: {}'.format(name, e))
+                return None
+
+    def _write_snapshot(self, name, permanent, generation, videos):
+        with atomic_open(self._get_path(name, self.SNAPSHOT_EXT)) as openfile:
+            write_pack(openfile, permanent, generation, videos)
+
+    def _load_summary(self, name):
+        pack = self._open_pack(name)
+        if pack is None:
+            return None
+
+        with pack:
+            permanent = pack.permanent
+            generation = pack.generation
+            count = pack.count
+
+        header, ops = self._get_journal(name).read()
+        if header is None or generation is None or \
+                header.get('generation') != generation:
+            return permanent, count
+
+        # Only adds and removes change the count
+        for op in ops:
+            if op['op'] == 'add':
+                count += 1
+            elif op['op'] == 'remove':
+                count -= 1
+
+        return permanent, count
+
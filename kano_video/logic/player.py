@@ -9,9 +9,11 @@
 import sys
 import os
 
-from kano.utils import is_installed, run_bg, get_volume, percent_to_millibel
+from kano.utils import is_installed, get_volume, percent_to_millibel
 from kano.logging import logger
 from .youtube import get_video_file_url
+from .control import VlcControl, OmxplayerControl
+from .transcode import get_playable_file
 
 
 # Support for Gtk versions 3 and 2
@@ -21,20 +23,23 @@ except ImportError:
     import gobject as GObject
 
 import playudev
+from . import processes
 
 subtitles_dir = '/usr/share/kano-media/videos/subtitles'
 
+_dbus_counter = 0
+
 omxplayer_present = is_installed('omxplayer')
 vlc_present = is_installed('vlc')
 if not omxplayer_present and not vlc_present:
     sys.exit('Neither vlc nor omxplayer is installed!')
 
 
-def play_video(_button=None, video_url=None, localfile=None, subtitles=None,
-               init_threads=True, keyboard_engulfer=True):
+def get_video_link(video_url=None, localfile=None):
     """
-    Plays a local or remote video using the optimal video player found.
-    Handles sound settings and subtitles.
+    Resolves what the player should open: the stream behind a YouTube url
+    or the local file itself, or its transcoded copy. Returns None if there
+    is nothing to play.
     """
 
     if video_url:
@@ -42,25 +47,64 @@ def play_video(_button=None, video_url=None, localfile=None, subtitles=None,
         success, data = get_video_file_url(video_url)
         if not success:
             logger.error('Error with getting YouTube url: {}'.format(data))
-            if _button:
-                _button.set_sensitive(True)
-            return
-        link = data
+            return None
+        return data
+
+    return get_playable_file(localfile)
+
+
+def get_volume_millibel():
+    return percent_to_millibel(get_volume(), raspberry_mod=True)
+
+
+def get_dbus_name():
+    """
+    A DBus name unique to each omxplayer started by this process, so that
+    players can be controlled without clashing with each other
+    """
+
+    global _dbus_counter
+    _dbus_counter += 1
+
+    return '{}.kano{}_{}'.format(OmxplayerControl.DBUS_PREFIX,
+                                 os.getpid(), _dbus_counter)
+
 
-    elif localfile:
-        link = localfile
+def get_player_control(process, dbus_name=None):
+    if omxplayer_present:
+        return OmxplayerControl(process, dbus_name)
     else:
-        if _button:
-            _button.set_sensitive(True)
-        return
+        return VlcControl(process)
+
+
+def format_position(seconds):
+    seconds = int(seconds)
+    return '{:02d}:{:02d}:{:02d}'.format(seconds / 3600, seconds / 60 % 60,
+                                         seconds % 60)
+
+
+def get_player_cmd(link, localfile=None, subtitles=None, dbus_name=None,
+                   speculative=False, start=None):
+    """
+    Builds the command line for the optimal video player found.
+    Handles sound settings, subtitles and starting at an offset in seconds.
 
-    logger.info('Launching player...')
+    If speculative is set, omxplayer is started muted and fully transparent
+    so it can be revealed later through its dbus_name.
+    """
 
     if omxplayer_present:
 
-        volume_percent = get_volume()
-        volume_str = '--vol {}'.format(
-            percent_to_millibel(volume_percent, raspberry_mod=True))
+        if speculative:
+            volume_str = '--vol -6000 --alpha 0'
+        else:
+            volume_str = '--vol {}'.format(get_volume_millibel())
+
+        if dbus_name:
+            volume_str += ' --dbus_name {}'.format(dbus_name)
+
+        if start:
+            volume_str += ' --pos {}'.format(format_position(start))
 
         if not subtitles or not os.path.isfile(subtitles):
             subtitles = None
@@ -103,13 +147,47 @@ def play_video(_button=None, video_url=None, localfile=None, subtitles=None,
                          subtitles=subtitles_str
                      )
     else:
+        start_str = ''
+        if start:
+            start_str = '--start-time={} '.format(int(start))
+
+        # The rc interface lets VlcControl drive it through stdin
         player_cmd = 'vlc -f --no-video-title-show ' \
-            '"{link}"'.format(link=link)
+            '--extraintf rc --rc-fake-tty {start}' \
+            '"{link}"'.format(link=link, start=start_str)
+
+    return player_cmd
+
+
+def play_video(_button=None, video_url=None, localfile=None, subtitles=None,
+               init_threads=True, keyboard_engulfer=True, process=None,
+               start=None):
+    """
+    Plays a local or remote video using the optimal video player found,
+    optionally from start seconds in.
+
+    process can be a player that has already been started for this video,
+    see speculation.py, in which case it is taken over instead.
+    """
+
+    if process is None:
+        link = get_video_link(video_url, localfile)
+        if not link:
+            if _button:
+                _button.set_sensitive(True)
+            return
+
+        logger.info('Launching player...')
+        player_cmd = get_player_cmd(link, localfile, subtitles, start=start)
+    else:
+        logger.info('Taking over the prespawned player...')
+        player_cmd = None
 
     # Play with keyboard interaction coming from udev directly
     # so that we do not lose focus and capture all key presses
     playudev.run_player(player_cmd, init_threads=init_threads,
-                        keyboard_engulfer=keyboard_engulfer)
+                        keyboard_engulfer=keyboard_engulfer,
+                        process=process, control_factory=get_player_control)
 
     # finally, enable the button back again
     if _button:
@@ -141,11 +219,8 @@ def get_centred_coords(width, height):
 
 def stop_videos(_button=None):
     """
-    Kills all videos that are currently playing
-    # TODO: Stop only videos which are managed by this module
+    Stops all videos that were started by this module, leaving players
+    which belong to other applications alone
     """
 
-    if omxplayer_present:
-        run_bg('killall omxplayer.bin')
-    else:
-        run_bg('killall vlc')
+    processes.stop_all()
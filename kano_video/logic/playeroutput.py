@@ -0,0 +1,213 @@
+# playeroutput.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Drains the output of the player and turns it into structured events
+#
+
+
+import os
+import re
+import time
+import threading
+
+from kano.logging import logger
+
+# Bytes read from a pipe at once
+READ_SIZE = 4096
+
+# Longest line kept, anything longer is player garbage
+MAX_LINE = 4096
+
+STREAM_INFO = 'stream_info'
+BUFFERING = 'buffering'
+UNDERRUN = 'underrun'
+ERROR = 'error'
+END = 'end'
+
+# (event kind, pattern) in order of precedence, the named groups of the
+# first match become the event data. Covers omxplayer and VLC.
+PATTERNS = [
+    (STREAM_INFO, re.compile(
+        r'^Video codec (?P<video_codec>\S+) width (?P<width>\d+) '
+        r'height (?P<height>\d+)(?: profile (?P<profile>-?\d+))?'
+        r'(?: fps (?P<fps>[\d.]+))?')),
+    (STREAM_INFO, re.compile(
+        r'^Audio codec (?P<audio_codec>\S+) channels (?P<channels>\d+) '
+        r'samplerate (?P<samplerate>\d+)')),
+    (BUFFERING, re.compile(r'[Bb]uffering\D*(?P<percent>\d+(?:\.\d+)?)?%?')),
+    (UNDERRUN, re.compile(
+        r'(?P<what>picture is too late|audio output is starving|'
+        r'buffer deadlock|underrun|underflow|dropping frame)',
+        re.IGNORECASE)),
+    (END, re.compile(r'^have a nice day')),
+    (ERROR, re.compile(
+        r'(?P<message>.*(?:\berror\b|failed to open|[Ii]nvalid|'
+        r'[Cc]ould not|[Uu]nable to).*)')),
+]
+
+
+class PlayerEvent(object):
+    """
+    Something the player reported about the current play
+    """
+
+    __slots__ = ('kind', 'data', 'line', 'time')
+
+    def __init__(self, kind, data, line):
+        self.kind = kind
+        self.data = data
+        self.line = line
+        self.time = time.time()
+
+    def __repr__(self):
+        return 'PlayerEvent({}, {})'.format(self.kind, self.data)
+
+
+def parse_line(line):
+    """
+    Returns the PlayerEvent for a line of player output, None if the
+    line carries nothing of interest
+    """
+
+    line = line.strip()
+    if not line:
+        return None
+
+    for kind, pattern in PATTERNS:
+        match = pattern.search(line)
+        if match:
+            data = dict((k, v) for k, v in match.groupdict().iteritems()
+                        if v is not None)
+            return PlayerEvent(kind, data, line)
+
+    return None
+
+
+class PlayerOutputReader(object):
+    """
+    Reads the stdout and stderr pipes of a player on background threads so
+    they never fill up, calling callback(event) from those threads for
+    every parsed PlayerEvent
+    """
+
+    def __init__(self, process, callback=None):
+        super(PlayerOutputReader, self).__init__()
+
+        self.process = process
+        self.callback = callback
+        self.bytes_read = 0
+
+        self._threads = []
+        for stream in (process.stdout, process.stderr):
+            if stream is None:
+                continue
+
+            thread = threading.Thread(target=self._drain, args=(stream,))
+            thread.daemon = True
+            self._threads.append(thread)
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+        return self
+
+    def set_callback(self, callback):
+        self.callback = callback
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _drain(self, stream):
+        fd = stream.fileno()
+        pending = ''
+
+        while True:
+            try:
+                chunk = os.read(fd, READ_SIZE)
+            except OSError as e:
+                logger.warn('Stopped reading player output: {}'.format(e))
+                break
+
+            if not chunk:
+                break
+
+            self.bytes_read += len(chunk)
+
+            # Progress lines are rewritten in place with a carriage return
+            lines = (pending + chunk).replace('\r', '\n').split('\n')
+            pending = lines.pop()[-MAX_LINE:]
+
+            for line in lines:
+                self._handle(line)
+
+        if pending:
+            self._handle(pending)
+
+        stream.close()
+
+    def _handle(self, line):
+        event = parse_line(line)
+        if event is None:
+            return
+
+        if event.kind == ERROR:
+            logger.warn('Player reported: {}'.format(event.line))
+
+        callback = self.callback
+        if callback:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error('Player event handler failed: {}'.format(e))
+
+
+class PlayMetrics(object):
+    """
+    Statistics gathered over a single play from the player events
+    """
+
+    def __init__(self):
+        super(PlayMetrics, self).__init__()
+
+        self.started_at = time.time()
+        self.stream_opened_at = None
+        self.ended_at = None
+        self.stream_info = {}
+        self.buffering = 0
+        self.underruns = 0
+        self.errors = []
+
+    def add_event(self, event):
+        if event.kind == STREAM_INFO:
+            self.stream_info.update(event.data)
+            if self.stream_opened_at is None:
+                self.stream_opened_at = event.time
+        elif event.kind == BUFFERING:
+            self.buffering += 1
+        elif event.kind == UNDERRUN:
+            self.underruns += 1
+        elif event.kind == ERROR:
+            self.errors.append(event.line)
+
+    def finish(self):
+        self.ended_at = time.time()
+
+    def get_startup_time(self):
+        if self.stream_opened_at is None:
+            return None
+
+        return self.stream_opened_at - self.started_at
+
+    def as_dict(self):
+        return {
+            'startup_time': self.get_startup_time(),
+            'duration': (self.ended_at or time.time()) - self.started_at,
+            'stream_info': dict(self.stream_info),
+            'buffering': self.buffering,
+            'underruns': self.underruns,
+            'errors': list(self.errors)
+        }
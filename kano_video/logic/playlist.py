@@ -9,69 +9,484 @@
 
 import os
 import json
+import time
 import errno
-import shutil
+import hashlib
+import threading
 
+from kano.logging import logger
 from kano_video.paths import playlist_path
 
-playlist_dir = 'playlists'
+from .playliststore import get_playlist_store, playlist_dir, STORE_ERRORS, \
+    apply_op, merge_ops, video_key
+from .orderedvideos import OrderedVideos
+from .storage import atomic_write
+
+# Seconds without changes before they are saved, and at most since the
+# first unsaved one
+AUTOSAVE_DELAY = 2
+AUTOSAVE_MAX_DELAY = 10
+
+# Playlists shipped with the app. Library contains videos included with the
+# kano-video-files package, Kano contains online videos that are useful to
+# users.
+BUNDLED_PLAYLISTS = ('Library', 'Kano')
+
+# What was last merged from each bundled playlist
+seed_file = os.path.join(playlist_dir, 'bundled.stamp')
+
+# Called with (playlist name, 'add' or 'remove', entry) for every video
+# added to or removed from a playlist, (name, 'delete', None) when a
+# playlist is deleted and (name, 'reload', entries) when it is read again
+# after another process saved it
+listeners = []
+
+
+def add_listener(callback):
+    listeners.append(callback)
+
+
+def notify_listeners(name, kind, video):
+    for callback in listeners:
+        try:
+            callback(name, kind, video)
+        except Exception as e:
+            logger.error('Playlist listener failed: {}'.format(e))
+
+
+def read_bundled_playlist(filepath):
+    """
+    Returns the hash of a bundled playlist file, its permanent flag and
+    its videos
+    """
+
+    with open(filepath) as openfile:
+        content = openfile.read()
+
+    data = json.loads(content)
+
+    permanent = False
+    if len(data) is not 0 and 'permanent' in data[0]:
+        permanent = data[0]['permanent']
+        del data[0]
+
+    return hashlib.sha1(content).hexdigest(), permanent, data
+
+
+def seed_playlists(store):
+    """
+    Merges the bundled playlists into the user's, only when they changed
+    since they were last merged, so a normal start writes nothing.
+
+    Permanent playlists are replaced. In the others, the videos of the
+    user are kept, the new bundled videos added and the videos dropped
+    from the bundle removed.
+    """
+
+    if os.path.realpath(playlist_path) == os.path.realpath(playlist_dir):
+        # Running from the source tree, the bundled files are the user's
+        return
+
+    try:
+        with open(seed_file) as openfile:
+            seeds = json.load(openfile)
+    except (IOError, ValueError):
+        seeds = {}
+
+    changed = False
+
+    for name in BUNDLED_PLAYLISTS:
+        try:
+            digest, permanent, bundled = read_bundled_playlist(
+                os.path.join(playlist_path, name + '.json'))
+        except (IOError, ValueError) as e:
+            logger.error('Could not read bundled playlist {}: {}'.format(
+                name, e))
+            continue
+
+        seed = seeds.get(name, {})
+        if seed.get('hash') == digest:
+            continue
+
+        keys = [video_key(video) for video in bundled]
+
+        try:
+            data = store.load(name)
+
+            if data is None or permanent:
+                videos = bundled
+            else:
+                user_permanent, user_videos = data
+                dropped = set(seed.get('keys', [])) - set(keys)
+
+                merged = OrderedVideos(video for video in user_videos
+                                       if video_key(video) not in dropped)
+                for video in bundled:
+                    merged.append(video)
+
+                permanent = user_permanent
+                videos = merged.to_list()
+
+            store.replace(name, permanent, videos)
+        except STORE_ERRORS as e:
+            logger.error('Could not merge bundled playlist {}: {}'.format(
+                name, e))
+            continue
+
+        logger.info('Merged bundled playlist {}'.format(name))
+        seeds[name] = {'hash': digest, 'keys': keys}
+        changed = True
+
+    if changed:
+        try:
+            atomic_write(seed_file, json.dumps(seeds))
+        except (IOError, OSError) as e:
+            logger.error('Could not save {}: {}'.format(seed_file, e))
+
+
+class Autosaver(object):
+    """
+    Saves the playlists with unsaved changes on a background thread, a
+    little while after the last change
+    """
+
+    def __init__(self, delay=AUTOSAVE_DELAY, max_delay=AUTOSAVE_MAX_DELAY):
+        super(Autosaver, self).__init__()
+
+        self.delay = delay
+        self.max_delay = max_delay
+
+        self._cond = threading.Condition()
+        self._pending = set()
+        self._first_change = None
+        self._last_change = None
+        self._thread = None
+
+    def schedule(self, playlist):
+        with self._cond:
+            now = time.time()
+            if not self._pending:
+                self._first_change = now
+            self._last_change = now
+            self._pending.add(playlist)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._cond.notify()
+
+    def cancel(self, playlist):
+        with self._cond:
+            self._pending.discard(playlist)
+
+            # Back to waiting without a timeout if nothing is left
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+
+                while self._pending:
+                    due = min(self._last_change + self.delay,
+                              self._first_change + self.max_delay)
+                    remaining = due - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                playlists = list(self._pending)
+                self._pending.clear()
+
+            for playlist in playlists:
+                playlist.save()
+
+
+autosaver = Autosaver()
 
 
 class Playlist(object):
     """
-    An object to hold a collection of videos
+    An object to hold a collection of videos, kept in the playlist store
+    (see playliststore.py)
+
+    Changes are kept in memory and saved by the autosaver in the
+    background, or by save().
+
+    Given a summary from the store, the videos are only loaded the first
+    time they are needed.
+
+    The videos are held in an OrderedVideos, so each video is in a
+    playlist at most once.
     """
 
-    def __init__(self, name):
+    def __init__(self, name, summary=None, store=None):
         super(Playlist, self).__init__()
 
         self.name = name
-        self.filename = os.path.join(playlist_dir, name + '.json')
+        self.store = store or get_playlist_store()
+        self.permanent = False
 
-        self.load()
+        # Operations not saved yet
+        self._ops = []
+        # Whether they have to be saved with the whole playlist, made
+        # against videos which have since been merged
+        self._rewrite = False
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
 
-    def load_from_file(self, filepath):
-        with open(filepath) as openfile:
-            raw_data = openfile.read()
+        self._playlist = None
+        self._count = 0
 
-            data = json.loads(raw_data)
+        if summary is None:
+            self.load()
+        else:
+            self.permanent = summary['permanent']
+            self._count = summary['count']
 
-            if len(data) is not 0 and 'permanent' in data[0]:
-                self.permanent = data[0]['permanent']
-                del data[0]
-            else:
-                self.permanent = False
+    @classmethod
+    def new(cls, name, store=None):
+        """
+        A playlist which is not in the store yet, written there when it is
+        first saved
+        """
+
+        playlist = cls(name, {'permanent': False, 'count': 0}, store)
+        playlist.playlist = OrderedVideos()
+
+        return playlist
+
+    @property
+    def playlist(self):
+        if self._playlist is None:
+            self.load()
+
+        return self._playlist
+
+    @playlist.setter
+    def playlist(self, videos):
+        self._playlist = videos
+
+    @property
+    def loaded(self):
+        return self._playlist is not None
 
-            self.playlist = data
+    @property
+    def count(self):
+        if self._playlist is None:
+            return self._count
+
+        return len(self._playlist)
+
+    @property
+    def dirty(self):
+        return bool(self._ops)
 
     def load(self):
-        try:
-            self.load_from_file(self.filename)
-        except IOError:
-            self.playlist = []
+        data = self.store.load(self.name)
+
+        if data is None:
+            self.playlist = OrderedVideos()
             self.permanent = False
-            self.save()
+            self.compact()
+            return
+
+        self.permanent = data[0]
+        self.playlist = OrderedVideos(data[1])
+
+        if self.playlist.duplicates:
+            logger.info('Dropping {} duplicate videos from playlist {}'.format(
+                len(self.playlist.duplicates), self.name))
+            self.playlist.duplicates = []
+            self.compact()
+
+    def change(self, *ops):
+        """
+        Applies operations and marks the playlist as dirty, they are saved
+        together
+        """
 
-    def save_to_file(self, filepath):
-        with open(filepath, 'w') as savefile:
-            data = self.playlist[:]
-            data.insert(0, {'permanent': self.permanent})
-            json.dump(data, savefile)
+        changes = []
+
+        with self._lock:
+            for op in ops:
+                if op['op'] == 'remove':
+                    video = self.playlist[op['index']]
+                    changes.append(('remove', video))
+                    # Found again by key if merged, see merge_ops()
+                    op.setdefault('key', video_key(video))
+
+                apply_op(self.playlist, op)
+                self._ops.append(op)
+
+                if op['op'] == 'add':
+                    changes.append(('add', op['video']))
+
+        autosaver.schedule(self)
+
+        for kind, video in changes:
+            notify_listeners(self.name, kind, video)
 
     def save(self):
-        self.save_to_file(self.filename)
+        """
+        Saves the unsaved changes, if any: a few hundred bytes each
+        whatever the size of the playlist
+        """
+
+        autosaver.cancel(self)
+
+        with self._save_lock:
+            with self._lock:
+                ops = self._ops
+                rewrite = self._rewrite
+                self._ops = []
+                self._rewrite = False
+                playlist = self.playlist.to_list()
+
+            if not ops:
+                return
+
+            try:
+                if rewrite:
+                    self.store.replace(self.name, self.permanent, playlist)
+                    return
+
+                merged = self.store.write(self.name, self.permanent,
+                                          playlist, ops)
+            except STORE_ERRORS as e:
+                logger.error('Could not save playlist {}: {}'.format(
+                    self.name, e))
+                return
+
+            if merged is None:
+                return
+
+            # Another process saved the playlist since it was loaded
+            with self._lock:
+                self.playlist = OrderedVideos(merge_ops(merged, self._ops))
+                self._rewrite = bool(self._ops)
+                videos = self.playlist.to_list()
+
+        notify_listeners(self.name, 'reload', videos)
+
+    def reload(self):
+        """
+        Reads the playlist again after another process saved it. Unsaved
+        changes are saved first, merged with what the other process saved.
+        """
+
+        self.save()
+
+        if self.dirty:
+            # Changed again meanwhile, merged when they are saved
+            return
+
+        self.load()
+        notify_listeners(self.name, 'reload', self.playlist.to_list())
+
+    def discard(self):
+        """
+        Drops the unsaved changes, e.g. of a playlist another process
+        deleted
+        """
+
+        autosaver.cancel(self)
+
+        with self._lock:
+            self._ops = []
+            self._rewrite = False
+
+    def compact(self):
+        """
+        Saves the playlist as a whole
+        """
+
+        with self._save_lock:
+            with self._lock:
+                self._ops = []
+                self._rewrite = False
+                playlist = self.playlist.to_list()
+
+            self.store.replace(self.name, self.permanent, playlist)
+
+    def contains(self, video):
+        """
+        Whether the playlist has a video, found by its key (see video_key)
+        """
+
+        return video in self.playlist
 
     def add(self, video):
-        self.playlist.append(video)
+        """
+        Adds a video at the end, returns False if it is in the playlist
+        already
+        """
+
+        if video in self.playlist:
+            return False
+
+        self.change({'op': 'add', 'video': video})
+        return True
+
+    def add_many(self, videos):
+        """
+        Adds the videos which are not in the playlist yet, saving them all
+        at once. Returns the number added.
+        """
+
+        added = OrderedVideos()
+        for video in videos:
+            if video not in self.playlist:
+                added.append(video)
+
+        self.change(*[{'op': 'add', 'video': video} for video in added])
+        return len(added)
 
     def delete(self):
-        try:
-            os.remove(self.filename)
-        except IOError:
-            pass
+        autosaver.cancel(self)
+
+        with self._save_lock:
+            with self._lock:
+                self._ops = []
+                self._rewrite = False
+
+            self.store.delete(self.name)
+
+        notify_listeners(self.name, 'delete', None)
 
     def remove(self, video):
-        self.playlist.remove(video)
+        """
+        Removes a video, found by its key whatever the rest of its entry
+        says. Returns False if it is not in the playlist.
+        """
+
+        if video not in self.playlist:
+            return False
+
+        self.change({'op': 'remove', 'index': self.playlist.index(video)})
+        return True
+
+    def move(self, old_index, new_index):
+        self.change({'op': 'move', 'from': old_index, 'to': new_index})
+
+    def reorder(self, videos):
+        """
+        Puts the videos, or their keys, in the given order. Videos left
+        out keep their order, after them.
+        """
+
+        order = []
+        for video in videos:
+            if video in self.playlist:
+                order.append(self.playlist.index(video))
+
+        seen = set(order)
+        order.extend(i for i in xrange(len(self.playlist)) if i not in seen)
+
+        self.change({'op': 'reorder', 'order': order})
 
 
 class PlaylistCollection(object):
@@ -79,19 +494,21 @@ class PlaylistCollection(object):
     An object to manage a collection of playlists
     """
 
-    def __init__(self, directory):
+    def __init__(self, store=None):
         super(PlaylistCollection, self).__init__()
 
         self.collection = {}
 
         self.init_playlists()
 
-        for filename in os.listdir(directory):
-            playlist_name = os.path.splitext(filename)[0]
+        self.store = store or get_playlist_store()
+        seed_playlists(self.store)
 
+        # Only the summaries are read, see Playlist
+        for name, summary in self.store.get_summaries().iteritems():
             # 'Library' is a playlist which is handled separately
-            if playlist_name != 'Library':
-                self.add(Playlist(playlist_name))
+            if name != 'Library':
+                self.collection[name] = Playlist(name, summary, self.store)
 
     def add(self, playlist):
         self.collection[playlist.name] = playlist
@@ -100,7 +517,54 @@ class PlaylistCollection(object):
         self.collection[playlist_name].delete()
         del self.collection[playlist_name]
 
+    def move_video(self, video, from_name, to_name):
+        """
+        Moves a video from a playlist to another, each one is saved once
+        """
+
+        if self.collection[to_name].contains(video):
+            return self.collection[from_name].remove(video)
+
+        if not self.collection[from_name].remove(video):
+            return False
+
+        return self.collection[to_name].add(video)
+
+    def reload(self, names):
+        """
+        Brings the playlists saved, created or deleted by other processes
+        up to date, given their names, see the store's get_changes()
+        """
+
+        for name in names:
+            playlist = self.collection.get(name)
+
+            if not self.store.exists(name):
+                if playlist is not None:
+                    playlist.discard()
+                    del self.collection[name]
+                    notify_listeners(name, 'delete', None)
+            elif playlist is None:
+                playlist = Playlist(name, store=self.store)
+                self.collection[name] = playlist
+                notify_listeners(name, 'reload', playlist.playlist.to_list())
+            else:
+                playlist.reload()
+
+    def find_videos(self, **fields):
+        """
+        Returns the (playlist name, entry) of the saved videos with the
+        given values, see the store's find_videos()
+        """
+
+        return self.store.find_videos(**fields)
+
     def save(self):
+        """
+        Writes the changes not autosaved yet, only dirty playlists are
+        touched
+        """
+
         for _, playlist in self.collection.iteritems():
             playlist.save()
 
@@ -113,16 +577,21 @@ class PlaylistCollection(object):
             else:
                 raise
 
-        try:
-            # Library contains videos included with the kano-video-files package
-            shutil.copy(os.path.join(playlist_path, 'Library.json'),
-                        playlist_dir)
-            # Kano contains online videos that are useful to users
-            shutil.copy(os.path.join(playlist_path, 'Kano.json'),
-                        playlist_dir)
-        except shutil.Error:
-            pass
-
 
-playlistCollection = PlaylistCollection('playlists')
+playlistCollection = PlaylistCollection()
 library_playlist = Playlist('Library')
+
+
+def reload_playlists(names):
+    """
+    Reads again the playlists, the library included, which other processes
+    saved, created or deleted
+    """
+
+    names = set(names)
+
+    if 'Library' in names:
+        names.discard('Library')
+        library_playlist.reload()
+
+    playlistCollection.reload(names)
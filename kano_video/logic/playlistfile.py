@@ -0,0 +1,289 @@
+# playlistfile.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Imports and exports playlists as M3U, M3U8 and XSPF files
+#
+# Files are read a line, or an XML element, at a time and written as they
+# go, so even very large ones take little memory.
+#
+
+
+import os
+import urllib
+import urlparse
+from xml.sax.saxutils import XMLGenerator
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+from kano.logging import logger
+
+from .scanner import make_entry
+from .storage import atomic_open
+
+PLAYLIST_EXTENSIONS = ('m3u', 'm3u8', 'xspf')
+
+# What a broken or unreadable playlist file raises, XML errors included
+IMPORT_ERRORS = (IOError, OSError, ValueError, SyntaxError)
+
+XSPF_NS = 'http://xspf.org/ns/0/'
+
+
+def get_format(filepath):
+    ext = os.path.splitext(filepath)[1][1:].lower()
+    if ext not in PLAYLIST_EXTENSIONS:
+        raise ValueError('not a playlist file: {}'.format(filepath))
+
+    return 'xspf' if ext == 'xspf' else 'm3u'
+
+
+def make_video(location, base_dir, title=None, author=None, duration=None,
+               description=None, thumbnail=None):
+    """
+    The playlist entry of a location found in a playlist file: a URL, a
+    file:// URI or a path, relative to the file
+    """
+
+    scheme = urlparse.urlparse(location).scheme
+
+    if scheme and scheme != 'file' and len(scheme) > 1:
+        entry = {
+            'title': title or location,
+            'video_url': location,
+            'local_path': None,
+            'thumbnail': thumbnail,
+            'big_thumb': None,
+            'author': author or '',
+            'description': description or '',
+            'viewcount': 0
+        }
+    else:
+        if scheme == 'file':
+            # Percent-escapes are of UTF-8 bytes
+            path = urlparse.urlparse(location.encode('utf-8')).path
+            location = _decode(urllib.url2pathname(path))
+
+        entry = make_entry(os.path.join(base_dir, location))
+
+        if title:
+            entry['title'] = title
+        if author:
+            entry['author'] = author
+        if description:
+            entry['description'] = description
+
+    if duration is not None and duration >= 0:
+        entry['duration'] = duration
+        entry['duration_min'] = duration / 60
+        entry['duration_sec'] = duration % 60
+    elif entry['local_path'] is None:
+        entry['duration_min'] = 0
+        entry['duration_sec'] = 0
+
+    return entry
+
+
+def _decode(text):
+    if isinstance(text, unicode):
+        return text
+
+    try:
+        return text.decode('utf-8')
+    except UnicodeDecodeError:
+        # Plain .m3u files are often in Latin-1
+        return text.decode('latin-1')
+
+
+def iter_m3u(filepath):
+    """
+    Yields the entries of an M3U or M3U8 file, a line at a time
+    """
+
+    base_dir = _decode(os.path.dirname(os.path.abspath(filepath)))
+    title = None
+    duration = None
+
+    with open(filepath, 'rb') as openfile:
+        for line in openfile:
+            line = _decode(line).lstrip(u'\ufeff').strip()
+
+            if not line:
+                continue
+
+            if line.startswith('#EXTINF:'):
+                info, _, title = line[len('#EXTINF:'):].partition(',')
+                try:
+                    duration = int(float(info.split()[0]))
+                except (ValueError, IndexError):
+                    duration = None
+                continue
+
+            if line.startswith('#'):
+                continue
+
+            yield make_video(line, base_dir, title=title or None,
+                             duration=duration)
+
+            title = None
+            duration = None
+
+
+def iter_xspf(filepath):
+    """
+    Yields the entries of an XSPF file, a track at a time. Each track is
+    dropped from the tree once read.
+    """
+
+    base_dir = _decode(os.path.dirname(os.path.abspath(filepath)))
+    track_list = None
+
+    def get_text(track, name):
+        text = track.findtext('{{{}}}{}'.format(XSPF_NS, name))
+        return text.strip() if text else None
+
+    for event, elem in ElementTree.iterparse(filepath, ('start', 'end')):
+        if event == 'start':
+            if elem.tag == '{{{}}}trackList'.format(XSPF_NS):
+                track_list = elem
+            continue
+
+        if elem.tag != '{{{}}}track'.format(XSPF_NS):
+            continue
+
+        location = get_text(elem, 'location')
+        if location:
+            try:
+                duration = int(get_text(elem, 'duration')) / 1000
+            except (TypeError, ValueError):
+                duration = None
+
+            thumbnail = get_text(elem, 'image')
+            if thumbnail and not thumbnail.startswith(('http:', 'https:')):
+                thumbnail = None
+
+            yield make_video(location, base_dir,
+                             title=get_text(elem, 'title'),
+                             author=get_text(elem, 'creator'),
+                             duration=duration,
+                             description=get_text(elem, 'annotation'),
+                             thumbnail=thumbnail)
+
+        elem.clear()
+        if track_list is not None:
+            track_list.remove(elem)
+
+
+def iter_playlist_file(filepath):
+    if get_format(filepath) == 'xspf':
+        return iter_xspf(filepath)
+
+    return iter_m3u(filepath)
+
+
+def get_location(video):
+    return video.get('local_path') or video.get('video_url')
+
+
+def write_m3u(openfile, videos):
+    openfile.write('#EXTM3U\n')
+
+    for video in videos:
+        location = get_location(video)
+        if not location:
+            continue
+
+        title = _decode(video.get('title') or '').replace('\n', ' ')
+        line = u'#EXTINF:{},{}\n{}\n'.format(
+            video.get('duration', -1), title, _decode(location))
+        openfile.write(line.encode('utf-8'))
+
+
+def write_xspf(openfile, videos, name):
+    xml = XMLGenerator(openfile, 'utf-8')
+    xml.startDocument()
+    xml.startPrefixMapping(None, XSPF_NS)
+
+    def element(tag, text=None):
+        xml.startElementNS((XSPF_NS, tag), tag, {})
+        if text is not None:
+            xml.characters(_decode(text) if isinstance(text, basestring)
+                           else unicode(text))
+        xml.endElementNS((XSPF_NS, tag), tag)
+
+    xml.startElementNS((XSPF_NS, 'playlist'), 'playlist',
+                       {(None, 'version'): '1'})
+    element('title', name)
+    xml.startElementNS((XSPF_NS, 'trackList'), 'trackList', {})
+
+    for video in videos:
+        location = video.get('video_url')
+        if video.get('local_path'):
+            location = 'file://' + urllib.pathname2url(
+                _decode(video['local_path']).encode('utf-8'))
+        if not location:
+            continue
+
+        xml.startElementNS((XSPF_NS, 'track'), 'track', {})
+        element('location', location)
+        for tag, field in (('title', 'title'), ('creator', 'author'),
+                           ('annotation', 'description')):
+            if video.get(field):
+                element(tag, video[field])
+        if video.get('duration') is not None:
+            element('duration', int(video['duration']) * 1000)
+        if video.get('thumbnail'):
+            element('image', video['thumbnail'])
+        xml.endElementNS((XSPF_NS, 'track'), 'track')
+
+    xml.endElementNS((XSPF_NS, 'trackList'), 'trackList')
+    xml.endElementNS((XSPF_NS, 'playlist'), 'playlist')
+    xml.endPrefixMapping(None)
+    xml.endDocument()
+
+
+def read_playlist_file(filepath):
+    """
+    The videos of a playlist file, all read before any is added, so a
+    broken file changes no playlist
+    """
+
+    return list(iter_playlist_file(filepath))
+
+
+def import_playlist(videos, playlist):
+    """
+    Adds the videos read from a playlist file to a playlist, skipping
+    those it has already, and saves them in a single write. Returns the
+    number of videos added.
+    """
+
+    added = playlist.add_many(videos)
+    if added:
+        playlist.save()
+    elif not playlist.store.exists(playlist.name):
+        # A new playlist is kept even if the file had nothing new
+        playlist.compact()
+
+    logger.info('Imported {} videos into {}'.format(added, playlist.name))
+
+    return added
+
+
+def export_playlist(playlist, filepath):
+    """
+    Writes a playlist to an M3U, M3U8 or XSPF file, picked by extension
+    """
+
+    videos = playlist.playlist
+
+    with atomic_open(filepath) as openfile:
+        if get_format(filepath) == 'xspf':
+            write_xspf(openfile, videos, playlist.name)
+        else:
+            write_m3u(openfile, videos)
+
+    logger.info('Exported {} to {}'.format(playlist.name, filepath))
@@ -0,0 +1,581 @@
+# playliststore.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Where the playlists are kept on disk
+#
+# A store saves and loads whole playlists by name, and the changes made
+# to them as a list of operations:
+#   {'op': 'add', 'video': entry}
+#   {'op': 'remove', 'index': i, 'key': video_key of the video}
+#   {'op': 'move', 'from': i, 'to': j}
+#   {'op': 'reorder', 'order': [old positions in their new order]}
+# JsonPlaylistStore is the default. sqlitestore.py and packstore.py have
+# the alternatives, picked with the 'playlist_storage' setting.
+#
+# Several processes may use the same store. A write made to a playlist
+# another process saved since it was last loaded is merged into what that
+# process saved, see merge_ops(), and write() returns the merged videos.
+# get_changes() tells which playlists other processes saved, deleted or
+# created, see playlistwatch.py.
+#
+
+
+import os
+import json
+import sqlite3
+import binascii
+import threading
+from contextlib import contextmanager
+
+from kano.logging import logger
+
+from .settings import get_setting
+from .storage import Journal, atomic_write, file_lock
+from .youtube import get_youtube_id
+
+playlist_dir = 'playlists'
+
+# Operations journaled before the playlist is compacted into its snapshot
+COMPACT_OPS = 100
+
+# Summaries of the playlists, read at start-up instead of the playlists
+INDEX_FILE = 'playlists.idx'
+
+# Taken by every process around the reads and writes of the JSON files
+LOCK_FILE = 'playlists.lock'
+
+# What the stores raise when they fail to save
+STORE_ERRORS = (IOError, OSError, sqlite3.Error)
+
+
+def video_key(entry):
+    """
+    What identifies a video whatever the rest of its entry says: its
+    YouTube id, its file or its URL
+    """
+
+    def text(value):
+        if isinstance(value, str):
+            return value.decode('utf-8', 'replace')
+        return value
+
+    youtube_id = get_youtube_id(entry.get('video_url'))
+    if youtube_id:
+        return u'yt:{}'.format(text(youtube_id))
+
+    if entry.get('local_path'):
+        return u'file:{}'.format(text(entry['local_path']))
+
+    if entry.get('video_url'):
+        return u'url:{}'.format(text(entry['video_url']))
+
+    return u'title:{}'.format(text(entry.get('title')))
+
+
+def apply_op(videos, op):
+    """
+    Applies an operation to a list of videos
+    """
+
+    kind = op['op']
+
+    if kind == 'add':
+        videos.append(op['video'])
+    elif kind == 'remove':
+        del videos[op['index']]
+    elif kind == 'move':
+        videos.insert(op['to'], videos.pop(op['from']))
+    elif kind == 'reorder':
+        if hasattr(videos, 'reorder'):
+            videos.reorder(op['order'])
+        else:
+            videos[:] = [videos[i] for i in op['order']]
+    else:
+        raise ValueError('unknown operation')
+
+
+def merge_ops(videos, ops):
+    """
+    Applies operations made on an out of date copy of a playlist to the
+    videos another process saved since, video by video: the videos added
+    are appended and the videos removed, found by key, dropped. Moves and
+    reorders were made against another order and are left out.
+    """
+
+    from .orderedvideos import OrderedVideos
+
+    merged = OrderedVideos(videos)
+
+    for op in ops:
+        if op['op'] == 'add':
+            merged.append(op['video'])
+        elif op['op'] == 'remove' and op.get('key') in merged:
+            merged.remove(op['key'])
+
+    return merged.to_list()
+
+
+def new_generation():
+    return binascii.hexlify(os.urandom(8))
+
+
+class PlaylistIndex(object):
+    """
+    The count and permanent flag of each playlist, along with the stamp of
+    its files when they were taken. A summary whose stamp is out of date
+    is not used, so the index may be saved later than the playlists.
+    """
+
+    def __init__(self, filepath):
+        super(PlaylistIndex, self).__init__()
+
+        self.filepath = filepath
+        self.summaries = {}
+        # Whether there are updates not saved yet
+        self.dirty = False
+        self._lock = threading.Lock()
+
+        try:
+            with open(filepath) as openfile:
+                self.summaries = json.load(openfile)
+        except (IOError, ValueError):
+            pass
+
+    def get(self, name, stamp):
+        summary = self.summaries.get(name)
+        if summary and summary.get('stamp') == stamp:
+            return summary
+
+        return None
+
+    def update(self, name, count, permanent, stamp, save=True):
+        with self._lock:
+            self.summaries[name] = {
+                'count': count,
+                'permanent': permanent,
+                'stamp': stamp
+            }
+            self.dirty = True
+
+        if save:
+            self.save()
+
+    def remove(self, name, save=True):
+        with self._lock:
+            self.summaries.pop(name, None)
+            self.dirty = True
+
+        if save:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            try:
+                atomic_write(self.filepath, json.dumps(self.summaries))
+                self.dirty = False
+            except (IOError, OSError) as e:
+                logger.error('Could not save playlist index: {}'.format(e))
+
+
+class JsonPlaylistStore(object):
+    """
+    Keeps each playlist as a JSON snapshot, Name.json, whose first item is
+    a header, along with a journal of the operations made since,
+    Name.journal.
+
+    The journal names the generation of the snapshot it applies to, so it
+    is never replayed twice once it has been compacted into a new one.
+
+    The files are only read and written with LOCK_FILE held, so a process
+    never sees a journal another one is writing, nor repairs it as torn.
+
+    Subclasses may keep the snapshots in another format, see packstore.py.
+    """
+
+    SNAPSHOT_EXT = '.json'
+
+    def __init__(self, directory=playlist_dir):
+        super(JsonPlaylistStore, self).__init__()
+
+        self.directory = directory
+        self.index = PlaylistIndex(os.path.join(directory, INDEX_FILE))
+
+        self._generations = {}
+        self._journals = {}
+        # name -> stamp of the playlist when this process last read or
+        # wrote it
+        self._seen = {}
+
+        # Loads happen on the main thread, saves on the autosaver's
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+
+    @contextmanager
+    def _locked(self):
+        """
+        Holds the lock of the store, against the other threads and the
+        other processes. Can be nested.
+        """
+
+        with self._lock:
+            self._lock_depth += 1
+            try:
+                if self._lock_depth > 1:
+                    yield
+                else:
+                    with file_lock(os.path.join(self.directory, LOCK_FILE)):
+                        yield
+            finally:
+                self._lock_depth -= 1
+
+    def _get_path(self, name, ext):
+        return os.path.join(self.directory, name + ext)
+
+    def _get_journal(self, name):
+        journal = self._journals.get(name)
+        if journal is None:
+            journal = Journal(self._get_path(name, '.journal'))
+            self._journals[name] = journal
+
+        return journal
+
+    def get_stamp(self, name):
+        """
+        The modification time and size of the snapshot and journal of a
+        playlist, which change whenever the playlist is saved
+        """
+
+        stamp = []
+        for ext in (self.SNAPSHOT_EXT, '.journal'):
+            try:
+                info = os.stat(self._get_path(name, ext))
+                stamp.extend([info.st_mtime, info.st_size])
+            except OSError:
+                stamp.extend([0, 0])
+
+        return stamp
+
+    def exists(self, name):
+        return os.path.exists(self._get_path(name, self.SNAPSHOT_EXT))
+
+    def get_summaries(self):
+        """
+        The count and permanent flag of every playlist, and a version
+        which changes whenever it is saved. Only playlists changed since
+        the index was saved are read.
+        """
+
+        with self._locked():
+            return self._get_summaries()
+
+    def _get_summaries(self):
+        summaries = {}
+        stale = set(self.index.summaries)
+        changed = False
+
+        for filename in os.listdir(self.directory):
+            name, ext = os.path.splitext(filename)
+
+            # Skip journals, temporary files and the index
+            if ext != self.SNAPSHOT_EXT:
+                continue
+
+            stale.discard(name)
+
+            stamp = self.get_stamp(name)
+            summary = self.index.get(name, stamp)
+
+            if summary is None:
+                data = self._load_summary(name)
+                if data is None:
+                    continue
+                permanent, count = data
+                summary = {'count': count, 'permanent': permanent}
+                stamp = self.get_stamp(name)
+                self.index.update(name, count, permanent, stamp, save=False)
+                changed = True
+
+            summaries[name] = dict(summary, version=stamp)
+            # Not over what the playlists loaded before were read from
+            self._seen.setdefault(name, stamp)
+
+        for name in stale:
+            self.index.remove(name, save=False)
+
+        if changed or stale:
+            self.index.save()
+
+        return summaries
+
+    def load(self, name):
+        """
+        Returns the permanent flag and the videos of a playlist, None if
+        it does not exist
+        """
+
+        with self._locked():
+            data = self._load(name)
+            self._seen[name] = self.get_stamp(name)
+
+        return data
+
+    def _read_snapshot(self, name):
+        """
+        Returns the permanent flag, the generation and the videos of the
+        snapshot of a playlist, None if there is none
+        """
+
+        try:
+            with open(self._get_path(name, self.SNAPSHOT_EXT)) as openfile:
+                data = json.load(openfile)
+        except IOError:
+            return None
+
+        permanent = False
+        generation = None
+        if len(data) is not 0 and 'permanent' in data[0]:
+            permanent = data[0]['permanent']
+            generation = data[0].get('generation')
+            del data[0]
+
+        return permanent, generation, data
+
+    def _write_snapshot(self, name, permanent, generation, videos):
+        data = list(videos)
+        data.insert(0, {'permanent': permanent, 'generation': generation})
+        atomic_write(self._get_path(name, self.SNAPSHOT_EXT), json.dumps(data))
+
+    def _load_summary(self, name):
+        """
+        Returns the permanent flag and the count of a playlist, None if it
+        does not exist
+        """
+
+        data = self._load(name)
+        if data is None:
+            return None
+
+        return data[0], len(data[1])
+
+    def _load(self, name):
+        snapshot = self._read_snapshot(name)
+        if snapshot is None:
+            return None
+
+        permanent, generation, data = snapshot
+
+        self._generations[name] = generation
+
+        journal = self._get_journal(name)
+        header, ops = journal.read()
+
+        if header is None:
+            return permanent, data
+
+        if generation is None or header.get('generation') != generation:
+            # Left over from a snapshot which has since been replaced
+            journal.remove()
+            return permanent, data
+
+        for op in ops:
+            try:
+                apply_op(data, op)
+            except (KeyError, IndexError, ValueError, TypeError) as e:
+                logger.error('Stopping replay of {} at {}: {}'.format(
+                    journal.filepath, op, e))
+                # Whatever follows does not apply anymore
+                self._replace(name, permanent, data)
+                break
+
+        return permanent, data
+
+    def replace(self, name, permanent, videos):
+        """
+        Writes a new snapshot of the playlist, which takes in the journal
+        """
+
+        with self._locked():
+            self._replace(name, permanent, videos)
+
+    def _replace(self, name, permanent, videos):
+        generation = new_generation()
+
+        self._write_snapshot(name, permanent, generation, videos)
+
+        self._generations[name] = generation
+        self._get_journal(name).start({'generation': generation})
+
+        stamp = self.get_stamp(name)
+        self._seen[name] = stamp
+        self.index.update(name, len(videos), permanent, stamp)
+
+    def write(self, name, permanent, videos, ops):
+        """
+        Saves the operations which turned the playlist into videos: a few
+        hundred bytes each, whatever the size of the playlist.
+
+        Returns None, or the merged videos if another process saved the
+        playlist since this one last read it.
+        """
+
+        with self._locked():
+            if self._changed_elsewhere(name):
+                return self._merge(name, permanent, videos, ops)
+
+            journal = self._get_journal(name)
+
+            if self._generations.get(name) is None or \
+                    journal.count + len(ops) > COMPACT_OPS:
+                # Snapshots from before the journal, or shipped with the
+                # app, are given a generation first
+                self._replace(name, permanent, videos)
+                return None
+
+            journal.extend(ops)
+
+            # The index is saved with the next snapshot, or by flush(): a
+            # stale summary is only read again
+            stamp = self.get_stamp(name)
+            self._seen[name] = stamp
+            self.index.update(name, len(videos), permanent, stamp,
+                              save=False)
+
+        return None
+
+    def flush(self):
+        """
+        Saves the index if changes were journaled since it last was, e.g.
+        on exit
+        """
+
+        with self._locked():
+            if self.index.dirty:
+                self.index.save()
+
+    def _changed_elsewhere(self, name):
+        seen = self._seen.get(name)
+        return seen is not None and seen != self.get_stamp(name)
+
+    def _merge(self, name, permanent, videos, ops):
+        data = self._load(name)
+        if data is None:
+            # Deleted meanwhile, the changes bring it back
+            merged = videos
+        else:
+            merged = merge_ops(data[1], ops)
+
+        logger.info('Merging playlist {} with the one saved by another '
+                    'process'.format(name))
+        self._replace(name, permanent, merged)
+
+        return merged
+
+    def delete(self, name):
+        with self._locked():
+            for filepath in (self._get_path(name, self.SNAPSHOT_EXT),
+                             self._get_path(name, '.journal')):
+                try:
+                    os.remove(filepath)
+                except OSError:
+                    pass
+
+            self._generations.pop(name, None)
+            self._journals.pop(name, None)
+            self._seen.pop(name, None)
+            self.index.remove(name)
+
+    def get_changes(self, paths=None):
+        """
+        The names of the playlists saved, created or deleted by another
+        process since this one last read or wrote them, until they are
+        loaded again. Only those of the given files are checked, e.g. as
+        reported by inotify, all of them without.
+        """
+
+        if paths is None:
+            names = set(self._seen)
+            names.update(os.path.splitext(filename)[0]
+                         for filename in os.listdir(self.directory)
+                         if filename.endswith(self.SNAPSHOT_EXT))
+        else:
+            names = set()
+            for path in paths:
+                if os.path.dirname(path) != self.directory:
+                    continue
+                name, ext = os.path.splitext(os.path.basename(path))
+                if ext in (self.SNAPSHOT_EXT, '.journal'):
+                    names.add(name)
+
+        changed = set()
+
+        with self._locked():
+            for name in names:
+                stamp = self.get_stamp(name)
+                if not any(stamp):
+                    # Deleted, or never there
+                    stamp = None
+
+                if stamp != self._seen.get(name):
+                    changed.add(name)
+                    # Seen once read again, see load()
+                    if stamp is None:
+                        self._seen.pop(name, None)
+
+        return changed
+
+    def watch_paths(self):
+        """
+        The directories whose changes may be those of playlists
+        """
+
+        return [self.directory]
+
+    def find_videos(self, **fields):
+        """
+        Returns the (playlist name, entry) of every video whose entry has
+        the given values, e.g. local_path='/home/...', or video_key='yt:...'
+        """
+
+        key = fields.pop('video_key', None)
+        found = []
+
+        for name in self.get_summaries():
+            with self._locked():
+                data = self._load(name)
+            if data is None:
+                continue
+
+            for entry in data[1]:
+                if key is not None and video_key(entry) != key:
+                    continue
+                if all(entry.get(f) == v for f, v in fields.iteritems()):
+                    found.append((name, entry))
+
+        return found
+
+
+_store = None
+
+
+def get_playlist_store():
+    global _store
+
+    if _store is None:
+        if get_setting('playlist_storage') == 'sqlite':
+            from .sqlitestore import SqlitePlaylistStore, database_file
+
+            json_store = JsonPlaylistStore()
+            _store = SqlitePlaylistStore(database_file)
+            _store.migrate(json_store)
+        elif get_setting('playlist_storage') == 'pack':
+            from .packstore import PackPlaylistStore, pack_dir
+
+            json_store = JsonPlaylistStore()
+            _store = PackPlaylistStore(pack_dir)
+            _store.migrate(json_store)
+        else:
+            _store = JsonPlaylistStore()
+
+    return _store
@@ -0,0 +1,101 @@
+# playlistwatch.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Notices the playlists other processes save, e.g. kano-video-cli
+#
+# The files of the store are watched with inotify, so only the playlists
+# whose files changed are looked at, and only those another process saved
+# are read again. Without inotify, every playlist is checked on each poll.
+#
+
+
+from kano.logging import logger
+
+from . import inotify
+from .playlist import playlistCollection, reload_playlists
+from .playliststore import STORE_ERRORS
+
+# Seconds between checks without inotify
+POLL_INTERVAL = 5
+
+
+class PlaylistWatcher(object):
+    """
+    Tells which playlists other processes saved, created or deleted since
+    the last check
+    """
+
+    WATCH_MASK = inotify.IN_CLOSE_WRITE | inotify.IN_MODIFY | \
+        inotify.IN_MOVED_TO | inotify.IN_DELETE
+
+    def __init__(self, store=None):
+        super(PlaylistWatcher, self).__init__()
+
+        self.store = store or playlistCollection.store
+        self._watch = None
+
+        try:
+            self._watch = inotify.Inotify()
+            for path in self.store.watch_paths():
+                self._watch.add_watch(path, self.WATCH_MASK)
+        except OSError as e:
+            logger.warn('Not watching the playlists for changes: {}'.format(
+                e))
+            if self._watch:
+                self._watch.close()
+            self._watch = None
+
+    def fileno(self):
+        """
+        Readable whenever a playlist might have changed, for poll sets.
+        None if inotify is not available, check() has to be polled then.
+        """
+
+        if self._watch:
+            return self._watch.fileno()
+        return None
+
+    def get_changes(self):
+        """
+        The names of the playlists other processes changed
+        """
+
+        if self._watch is None:
+            return self.store.get_changes()
+
+        events = self._watch.read_events()
+        if not events:
+            return set()
+
+        if any(event.mask & inotify.IN_Q_OVERFLOW for event in events):
+            # Events were lost
+            return self.store.get_changes()
+
+        return self.store.get_changes(
+            [event.path for event in events if event.path])
+
+    def check(self):
+        """
+        Reads again the playlists other processes changed. Returns their
+        names.
+        """
+
+        try:
+            names = self.get_changes()
+            if names:
+                logger.info('Playlists changed by another process: '
+                            '{}'.format(', '.join(sorted(names))))
+                reload_playlists(names)
+        except STORE_ERRORS as e:
+            logger.error('Could not read the changed playlists: {}'.format(
+                e))
+            return set()
+
+        return names
+
+    def close(self):
+        if self._watch:
+            self._watch.close()
+            self._watch = None
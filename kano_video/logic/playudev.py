@@ -8,13 +8,18 @@
 # Play media using omxplayer, but listening for keyboard events from udev directly
 #
 
-import struct
 import subprocess
 import threading
-import csv
 
 from kano.logging import logger
 
+from .playeroutput import PlayerOutputReader
+from . import processes
+from .keyboard import KeyboardMultiplexer
+from .inputdevices import get_input_device_cache, parse_input_devices
+from .keymap import KeyDispatcher
+from .control import OmxplayerControl
+
 #
 # We need to play well with Gtk version 2 and version 3 clients
 #
@@ -29,134 +34,133 @@ except ImportError:
 def get_keyboard_input_device(fdevice_list='/proc/bus/input/devices'):
     '''
     Most keyboards send data to /dev/input/event0, but some use a different device.
-    This function heuristically finds the correct device name that the kernel decides to map.
-    We are reading /proc/bus/input/devices in search for an entry H: (handler)
-    that says "kbd".
+    This function finds the last keyboard capable device that the kernel reports,
+    reading the capability bitmaps of /proc/bus/input/devices (see inputdevices.py).
 
-    The name at the end *should* be the device name mapped at /dev/input.
-    Any other combination seems to point to other devices (trackpads and various other goodies)
+    Kept for callers which can only handle a single device, see
+    get_keyboard_input_devices() for all of them.
 
-    On pre 4.4.7 linux kernels we were used to see this:
+    https://www.kernel.org/doc/Documentation/input/input.txt
+    '''
 
-    "H: Handlers=kbd event0"
+    # If we can't find the device, we default to most commonly used
+    keyboard_input_device = '/dev/input/event0'
 
-    But, starting on recent kernel 4.4.7-v7+, we notice that the keyboard is reported with leds support.
+    keyboards = get_keyboard_input_devices(fdevice_list)
+    if keyboards:
+        keyboard_input_device = keyboards[-1]
 
-    "H: Handlers=kbd leds event1"
+    return keyboard_input_device
 
-    The correct mapping in this case seems to be the last reported one (there are commonly 2 reported).
-    Tested on 2 common keyboards, and 3 RT, trackpad based ones, including the official Kano Keyboard.
 
-    https://www.kernel.org/doc/Documentation/input/input.txt
+def get_keyboard_input_devices(fdevice_list=None):
     '''
+    Lists every /dev/input node able to send the keys that control a video:
+    keyboards, remotes and the like.
 
-    # If we can't find the device, we default to most commonly used
-    keyboard_input_device = '/dev/input/event0'
+    By default the list is cached until /dev/input changes. Pass fdevice_list
+    to parse a given copy of /proc/bus/input/devices instead, e.g. a fixture.
+    '''
 
-    with open(fdevice_list, 'r') as csvfile:
-        input_devices = csv.reader(csvfile, delimiter=' ', lineterminator='\n', skipinitialspace=True)
-        for ndevice, device_info in enumerate(input_devices):
+    if fdevice_list is None:
+        return get_input_device_cache().get_keyboards()
 
-            try:
-                if device_info[1] == 'Handlers=kbd' and \
-                   device_info[2] == 'leds' and \
-                   device_info[3].startswith('event'):
+    return [device.event_node for device in parse_input_devices(fdevice_list)
+            if device.is_keyboard()]
 
-                    # will iterate until the last reported kbd device is captured
-                    keyboard_input_device='/dev/input/{}'.format(device_info[3].strip())
-            except:
-                pass
 
-    return keyboard_input_device
+_keyboard_reader = None
 
 
-def wait_for_keys(pomx):
+def get_keyboard_reader():
     '''
-    Listens for keyboard events from /dev/input
-    translates ESC, Q, Space, P, -, + to omxplayer via its stdin.
-    pomx is a subprocess Popen object.
+    The keyboard reader shared by every play: a single thread and epoll set
+    which is only handed over to the next player, see keyboard.py.
     '''
+    global _keyboard_reader
 
-    # Ask the kernel which device is mapping the input keyboard
-    infile_path = get_keyboard_input_device()
-    logger.info('wait_for_keys is using keyboard input device: %s' % infile_path)
-
-    # long int, long int, unsigned short, unsigned short, unsigned int
-    FORMAT = 'llHHI'
-    EVENT_SIZE = struct.calcsize(FORMAT)
-
-    # Open the keyboard device file in binary mode
-    in_file = open(infile_path, "rb")
+    if _keyboard_reader is None:
+        _keyboard_reader = KeyboardMultiplexer(get_keyboard_input_devices,
+                                               get_input_device_cache())
 
-    event = in_file.read(EVENT_SIZE)
+    return _keyboard_reader
 
-    while event:
-        (tv_sec, tv_usec, type, code, value) = struct.unpack(FORMAT, event)
 
-        # other keys you wish to send to omxplayer should be added here
-        # future updates to omxplayer need to be taken into account here
+def listen_for_keys(pomx, control=None):
+    '''
+    Sends the commands bound to the keys of every keyboard in /dev/input
+    (see keymap.py) to the player, keyboards plugged in or out during the
+    video included, without blocking. pomx is a subprocess Popen object and
+    control its control channel, omxplayer's stdin by default.
+    Returns the key handler, to pass to stop_listening_for_keys().
+    '''
 
-        #print "type {} | code {} | value {}".format(type, code, value)
+    if control is None:
+        control = OmxplayerControl(pomx)
 
-        try:
-            if (type == 1 and code == 1 and value == 0) or (type == 1 and code == 16 and value == 0):
+    dispatcher = KeyDispatcher(control)
+    get_keyboard_reader().attach(dispatcher)
 
-                logger.info('keyboard Esc/Q has been detected, terminating omxplayer')
+    return dispatcher
 
-                # The key "esc" or "q" has been released, quit omxplayer
-                pomx.stdin.write('q')
-                pomx.stdin.flush()
-                
-                # finish the thread
-                break
 
-            elif (type == 1 and code == 25 and value == 0) or (type == 1 and code == 57 and value == 0):
-                # The key "p" or "space" has been released, pause/resume the media
-                pomx.stdin.write(' ')
-                pomx.stdin.flush()
+def stop_listening_for_keys(dispatcher):
+    get_keyboard_reader().detach(dispatcher)
 
-            elif type == 1 and code == 12 and value == 0:
-                # The key "-" has been released, decrease the volume
-                pomx.stdin.write('-')
-                pomx.stdin.flush()
 
-            elif type == 1 and code == 13 and value == 0:
-                # The key "+" has been released, increase the volume
-                pomx.stdin.write('+')
-                pomx.stdin.flush()
+def wait_for_keys(pomx, control=None):
+    '''
+    Listens for keyboard events until the player terminates, see
+    listen_for_keys().
+    '''
 
-        except IOError:
-            # OMXplayer terminated and the pipe is not valid anymore. Terminate this thread
-            in_file.close()
-            return
+    dispatcher = listen_for_keys(pomx, control)
 
-        except:
-            # We want to attend the user as much as we can, so blindfold on any unrelated problem
-            pass
+    try:
+        pomx.wait()
+    finally:
+        stop_listening_for_keys(dispatcher)
 
-        # read the next event from the keyboard input stream
-        event = in_file.read(EVENT_SIZE)
 
-    in_file.close()
+def start_player(cmdline, key=None):
+    '''
+    Start the player process, with a stdin pipe for the keyboard thread.
+    Its stdout and stderr pipes must be drained, see PlayerOutputReader.
+    The player gets its own process group and is registered under key,
+    or its pid, so that it can be stopped on its own later on.
+    '''
+    pomx = subprocess.Popen(cmdline, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, shell=True, close_fds=True,
+                            preexec_fn=processes.new_process_group)
+    processes.register(key or pomx.pid, pomx)
+    return pomx
 
 
-def run_video(win, cmdline):
+def run_video(win, cmdline, pomx=None, control_factory=None):
     '''
     Start omxplayer along with a thread to watch and send special keyboard
     keys like Q, Space, etc. If win is not None, it is meant to be a Gtk Window
     which will be sent a "destroy" event asynchronously once omxplayer terminates.
+    If pomx is given, it is an already running player to attach to instead.
+    control_factory(pomx) returns the control channel the keys go through.
     Returns omxplayer error code.
     '''
-    logger.info('playudev starting video Popen object along with Keyboard event thread')
-    pomx = subprocess.Popen(cmdline, stdin=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
+    if pomx is None:
+        logger.info('playudev starting video Popen object along with Keyboard event thread')
+        pomx = start_player(cmdline)
+        PlayerOutputReader(pomx).start()
+
+    control = None
+    if control_factory:
+        control = control_factory(pomx)
 
-    # A thread will listen for key events and send them to OMXPlayer
-    t = threading.Thread(target=wait_for_keys, args=(pomx,))
-    t.daemon = True
-    t.start()
+    # The keyboard reader thread will send key events to OMXPlayer
+    dispatcher = listen_for_keys(pomx, control)
 
     # Wait for OMXPLayer to terminate
     rc = pomx.wait()
+    stop_listening_for_keys(dispatcher)
+    processes.unregister(pomx.pid)
 
     if win:
         GObject.idle_add(win.destroy)
@@ -164,29 +168,40 @@ def run_video(win, cmdline):
     logger.info('playudev omxplayer process has terminated')
 
 
-class VideoKeyboardEngulfer(Gtk.Window):
+class KeyboardEngulfer(Gtk.Window):
     '''
     Create a full screen empty window to capture and discard all keyboard and
     mouse events. Omxplayer will be positioned itself on top of it.
     '''
-    def __init__(self, cmdline):
+    def __init__(self):
         Gtk.Window.__init__(self)
-        self.rc = -1
         self.fullscreen()
-        self.play_video(cmdline)
 
-    def play_video(self, cmdline):
+
+class VideoKeyboardEngulfer(KeyboardEngulfer):
+    '''
+    A KeyboardEngulfer which plays a video, and destroys itself when it ends.
+    '''
+    def __init__(self, cmdline, process=None, control_factory=None):
+        KeyboardEngulfer.__init__(self)
+        self.rc = -1
+        self.play_video(cmdline, process, control_factory)
+
+    def play_video(self, cmdline, process=None, control_factory=None):
         '''
         Detach a thread to launch omxplayer and a keyboard event watcher
         '''
-        t = threading.Thread(target=run_video, args=(self, cmdline,))
+        t = threading.Thread(target=run_video, args=(self, cmdline, process, control_factory))
         t.daemon = True
         t.start()
 
 
-def run_player(cmdline, init_threads=True, keyboard_engulfer=True):
+def run_player(cmdline, init_threads=True, keyboard_engulfer=True, process=None,
+               control_factory=None):
     '''
     This is the main function to play a video, cmdline is the omxplayer command.
+    Alternatively, process is an omxplayer Popen object that was started earlier.
+    control_factory(process) returns the control channel for another player.
 
     Set init_threads to False if your app is multi-threaded and you 
     already called GObject.threads_init().
@@ -204,12 +219,12 @@ def run_player(cmdline, init_threads=True, keyboard_engulfer=True):
         GObject.threads_init()
 
     if keyboard_engulfer:
-        win = VideoKeyboardEngulfer(cmdline)
+        win = VideoKeyboardEngulfer(cmdline, process, control_factory)
         win.connect("destroy", Gtk.main_quit)
         win.show_all()
         Gtk.main()
         rc = win.rc
     else:
-        rc = run_video(None, cmdline)
+        rc = run_video(None, cmdline, process, control_factory)
 
     return rc
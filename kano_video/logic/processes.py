@@ -0,0 +1,243 @@
+# processes.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Keeps track of the player processes started by this module so they can
+# be stopped without touching players that belong to anybody else, and
+# runs background jobs which give way to them
+#
+
+
+import os
+import time
+import atexit
+import signal
+import threading
+import subprocess
+
+from kano.logging import logger
+from kano.utils import is_installed
+
+# Seconds given to the player to quit on its own, then to honour SIGTERM.
+# omxplayer takes a good part of a second to tear down after 'q', the
+# signals are only there for a player which hung.
+QUIT_TIMEOUT = 1.0
+TERM_TIMEOUT = 0.15
+POLL_INTERVAL = 0.01
+
+# How often background jobs check whether a player started or stopped
+JOB_POLL_INTERVAL = 0.5
+
+_lock = threading.Lock()
+_registry = {}
+_jobs = set()
+
+
+class PlayerProcess(object):
+    """
+    A player started in its own process group, so that the player binary
+    launched by a wrapper script is reached as well
+    """
+
+    def __init__(self, key, process, control=None):
+        super(PlayerProcess, self).__init__()
+
+        self.key = key
+        self.process = process
+        self.pid = process.pid
+        self.control = control
+        self.started_at = time.time()
+
+        try:
+            self.pgid = os.getpgid(process.pid)
+        except OSError:
+            self.pgid = None
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        while self.is_alive():
+            if time.time() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+
+        return True
+
+    def signal(self, signum):
+        try:
+            # Only signal the group if it really is the player's own one
+            if self.pgid is not None and self.pgid == self.pid:
+                os.killpg(self.pgid, signum)
+            else:
+                os.kill(self.pid, signum)
+        except OSError:
+            pass
+
+    def stop(self):
+        """
+        Asks the player to quit through its control channel, escalating
+        to SIGTERM and SIGKILL on its process group only if it does not.
+        Bounded to roughly QUIT_TIMEOUT + 2 * TERM_TIMEOUT.
+        """
+
+        if not self.is_alive():
+            return True
+
+        if self.control and self.control.command('quit') and \
+                self.wait(QUIT_TIMEOUT):
+            return True
+
+        logger.info('Player {} did not quit, terminating it'.format(self.key))
+        self.signal(signal.SIGTERM)
+        if self.wait(TERM_TIMEOUT):
+            return True
+
+        logger.warn('Player {} ignored SIGTERM, killing it'.format(self.key))
+        self.signal(signal.SIGKILL)
+        self.wait(TERM_TIMEOUT)
+
+        return not self.is_alive()
+
+
+def new_process_group():
+    # Used as a Popen preexec_fn
+    os.setsid()
+
+
+def register(key, process, control=None):
+    entry = PlayerProcess(key, process, control)
+
+    with _lock:
+        _registry[key] = entry
+
+    return entry
+
+
+def unregister(key):
+    with _lock:
+        return _registry.pop(key, None)
+
+
+def rekey(old_key, new_key):
+    """
+    Moves a player over to a new owner, e.g. a prespawned player taken
+    over by a session
+    """
+
+    with _lock:
+        entry = _registry.pop(old_key, None)
+        if entry:
+            entry.key = new_key
+            _registry[new_key] = entry
+
+    return entry
+
+
+def set_control(key, control):
+    with _lock:
+        entry = _registry.get(key)
+        if entry:
+            entry.control = control
+
+
+def get_players():
+    with _lock:
+        return dict(_registry)
+
+
+def stop(key):
+    entry = unregister(key)
+    if entry is None:
+        return True
+
+    return entry.stop()
+
+
+def stop_all():
+    """
+    Stops every player started by this module, all at the same time so the
+    whole lot still takes no longer than a single one
+    """
+
+    with _lock:
+        entries = _registry.values()
+        _registry.clear()
+
+    threads = []
+    for entry in entries:
+        thread = threading.Thread(target=entry.stop)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    return not any(entry.is_alive() for entry in entries)
+
+
+def is_playing():
+    return any(entry.is_alive() for entry in get_players().itervalues())
+
+
+def _lower_priority():
+    # Used as a Popen preexec_fn
+    os.nice(19)
+
+
+def run_idle(cmd):
+    """
+    Runs a background job, e.g. an ffmpeg, at the lowest CPU and disk
+    priority, stopped whenever a player is running so it never competes
+    with the playback. Returns its exit status, None if it did not start.
+    """
+
+    if is_installed('ionice'):
+        # Idle disk priority, the SD card is shared with the player
+        cmd = ['ionice', '-c', '3'] + cmd
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen(cmd, stdout=devnull, stderr=devnull,
+                                       preexec_fn=_lower_priority)
+    except OSError as e:
+        logger.error('Could not run {}: {}'.format(cmd[0], e))
+        return None
+
+    with _lock:
+        _jobs.add(process)
+
+    stopped = False
+    try:
+        while process.poll() is None:
+            playing = is_playing()
+            if playing != stopped:
+                process.send_signal(signal.SIGSTOP if playing
+                                    else signal.SIGCONT)
+                stopped = playing
+            time.sleep(JOB_POLL_INTERVAL)
+    finally:
+        with _lock:
+            _jobs.discard(process)
+
+    return process.returncode
+
+
+@atexit.register
+def stop_jobs():
+    """
+    Kills the background jobs, a stopped one would be left behind forever
+    """
+
+    with _lock:
+        jobs = list(_jobs)
+        _jobs.clear()
+
+    for process in jobs:
+        try:
+            process.kill()
+        except OSError:
+            pass
@@ -0,0 +1,217 @@
+# resume.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Remembers where each video was left so it can be resumed
+#
+# The store is an append-only log with one JSON record per line:
+#   [video_id, position, completed, timestamp]
+# The last record for an id wins. The log is compacted, and stale entries
+# purged, once it holds a lot more records than live entries.
+#
+
+
+import os
+import json
+import time
+
+from kano.logging import logger
+from kano_video.paths import user_dir
+
+from .youtube import get_youtube_id
+
+resume_file = os.path.join(user_dir, 'resume.log')
+
+# Positions closer than this to either end of the video are not resumed
+MIN_POSITION = 10
+END_MARGIN = 20
+
+# Seconds between two writes of the positions reported during a play
+FLUSH_INTERVAL = 30
+
+# Entries not played for this long are purged
+MAX_AGE = 90 * 24 * 60 * 60
+MAX_ENTRIES = 500
+
+# Compact once there are this many more records than live entries
+COMPACT_SLACK = 200
+
+
+def get_video_id(video_url=None, localfile=None):
+    """
+    A stable id for a video: the YouTube id, or for local files the path
+    along with its size and modification time, so a replaced file is
+    not resumed at the position of the previous one
+    """
+
+    if localfile:
+        try:
+            info = os.stat(localfile)
+        except OSError:
+            return None
+        return 'file:{}:{}:{}'.format(localfile, info.st_size,
+                                      int(info.st_mtime))
+
+    youtube_id = get_youtube_id(video_url)
+    if youtube_id:
+        return 'yt:{}'.format(youtube_id)
+
+    if video_url:
+        return 'url:{}'.format(video_url)
+
+    return None
+
+
+class ResumeStore(object):
+    """
+    The last playback position and completion of each video
+    """
+
+    def __init__(self, filepath=resume_file):
+        super(ResumeStore, self).__init__()
+
+        self.filepath = filepath
+
+        # video_id -> [position, completed, timestamp]
+        self.entries = {}
+        self._dirty = set()
+        self._records = 0
+        self._last_flush = time.time()
+
+        self.load()
+
+    def load(self):
+        self.entries = {}
+        self._records = 0
+
+        try:
+            with open(self.filepath) as openfile:
+                for line in openfile:
+                    try:
+                        video_id, position, completed, timestamp = \
+                            json.loads(line)
+                    except ValueError:
+                        # Most likely a record cut short by a power cut
+                        continue
+
+                    self.entries[video_id] = [position, completed, timestamp]
+                    self._records += 1
+        except IOError:
+            pass
+
+        if self._purge() or self._needs_compaction():
+            self.compact()
+
+    def get_start(self, video_id):
+        """
+        Returns the position to resume the video at, None to start over
+        """
+
+        entry = self.entries.get(video_id)
+        if not entry:
+            return None
+
+        position, completed, _ = entry
+        if completed or position < MIN_POSITION:
+            return None
+
+        return position
+
+    def update(self, video_id, position, duration=None, completed=False):
+        """
+        Records a position in memory, it reaches the disk on the next
+        flush(), which happens by itself every FLUSH_INTERVAL seconds
+        """
+
+        if not video_id or position is None:
+            return
+
+        if duration and position >= duration - END_MARGIN:
+            completed = True
+
+        self.entries[video_id] = [int(position), completed, int(time.time())]
+        self._dirty.add(video_id)
+
+        if time.time() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.time()
+
+        if not self._dirty:
+            return
+
+        lines = []
+        for video_id in self._dirty:
+            if video_id in self.entries:
+                lines.append(json.dumps([video_id] +
+                                        self.entries[video_id]) + '\n')
+        self._dirty.clear()
+
+        try:
+            if not os.path.isdir(os.path.dirname(self.filepath)):
+                os.makedirs(os.path.dirname(self.filepath))
+
+            with open(self.filepath, 'a') as openfile:
+                openfile.writelines(lines)
+        except (IOError, OSError) as e:
+            logger.error('Could not save resume positions: {}'.format(e))
+            return
+
+        self._records += len(lines)
+
+        if self._needs_compaction():
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrites the log with a single record per entry
+        """
+
+        tmp_path = self.filepath + '.tmp'
+
+        try:
+            with open(tmp_path, 'w') as openfile:
+                for video_id, entry in self.entries.iteritems():
+                    openfile.write(json.dumps([video_id] + entry) + '\n')
+                openfile.flush()
+                os.fsync(openfile.fileno())
+
+            os.rename(tmp_path, self.filepath)
+        except (IOError, OSError) as e:
+            logger.error('Could not compact resume positions: {}'.format(e))
+            return
+
+        self._records = len(self.entries)
+        self._dirty.clear()
+
+    def _needs_compaction(self):
+        return self._records > len(self.entries) + COMPACT_SLACK
+
+    def _purge(self):
+        now = time.time()
+        stale = [video_id for video_id, entry in self.entries.iteritems()
+                 if now - entry[2] > MAX_AGE]
+
+        if len(self.entries) - len(stale) > MAX_ENTRIES:
+            by_age = sorted(self.entries.iteritems(), key=lambda e: e[1][2])
+            stale.extend(video_id for video_id, _ in
+                         by_age[:len(self.entries) - MAX_ENTRIES])
+
+        for video_id in stale:
+            self.entries.pop(video_id, None)
+
+        return bool(stale)
+
+
+_store = None
+
+
+def get_resume_store():
+    global _store
+
+    if _store is None:
+        _store = ResumeStore()
+
+    return _store
@@ -0,0 +1,410 @@
+# scanner.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Finds the videos in a folder and its subfolders, for importing them
+#
+# The duration and codecs of each video are read with ffprobe, a few files
+# at a time. What was read is kept in ~/.kano-video/scan.idx along with the
+# inode, size and modification time of the file, so scanning the same
+# folder again only probes the files which changed.
+#
+
+
+import os
+import json
+import hashlib
+import subprocess
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from kano.logging import logger
+from kano.utils import is_installed
+from kano_video.paths import user_dir
+
+from .storage import atomic_write
+
+try:
+    # Lists a directory along with the type of each entry, saving a stat
+    # per entry on large folders
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+scan_index_file = os.path.join(user_dir, 'scan.idx')
+
+VIDEO_EXTENSIONS = (
+    'mkv',
+    'm4v',
+    'mp4',
+    'avi',
+    'flv',
+    'mov',
+    'ogg',
+    'wmv'
+)
+
+# Probes running at once, at most
+MAX_PROBES = 2
+
+# ffprobe, or avprobe which takes the same options
+PROBE_COMMANDS = ('ffprobe', 'avprobe')
+
+# ffmpeg, or avconv which takes the same options
+FFMPEG_COMMANDS = ('ffmpeg', 'avconv')
+
+
+def _find_command(commands):
+    for command in commands:
+        if is_installed(command):
+            return command
+
+    return None
+
+
+def get_probe_command():
+    return _find_command(PROBE_COMMANDS)
+
+
+def get_ffmpeg_command():
+    return _find_command(FFMPEG_COMMANDS)
+
+
+def is_video_file(filename):
+    ext = os.path.splitext(filename)[1][1:].lower()
+    return ext in VIDEO_EXTENSIONS
+
+
+def list_dir(directory):
+    """
+    The name, path and whether it is a directory of each entry of a
+    directory. Links to directories are not followed.
+    """
+
+    if scandir is not None:
+        return [(entry.name, entry.path, entry.is_dir(follow_symlinks=False))
+                for entry in scandir(directory)]
+
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        entries.append((name, path,
+                        os.path.isdir(path) and not os.path.islink(path)))
+
+    return entries
+
+
+def get_stamp(filepath):
+    """
+    The inode, size and modification time of a file, None if it is gone
+    """
+
+    try:
+        info = os.stat(filepath)
+    except OSError:
+        return None
+
+    return [info.st_ino, info.st_size, int(info.st_mtime)]
+
+
+def iter_videos(directory):
+    """
+    Yields the path of each video file under directory, along with its
+    stamp: inode, size and modification time. Hidden files and folders are
+    skipped.
+    """
+
+    directories = [directory]
+
+    while directories:
+        path = directories.pop()
+
+        try:
+            entries = list_dir(path)
+        except OSError as e:
+            logger.error('Could not scan {}: {}'.format(path, e))
+            continue
+
+        subdirectories = []
+
+        for name, entry_path, is_dir in sorted(entries):
+            if name.startswith('.'):
+                continue
+
+            if is_dir:
+                subdirectories.append(entry_path)
+            elif is_video_file(name):
+                stamp = get_stamp(entry_path)
+                if stamp is not None:
+                    yield entry_path, stamp
+
+        # Popped in alphabetical order
+        directories.extend(reversed(subdirectories))
+
+
+def probe_video(filepath, command=None):
+    """
+    The container, duration, size and codecs of a video file, as far as
+    they could be read
+    """
+
+    command = command or get_probe_command()
+    if command is None:
+        return {}
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen(
+                [command, '-v', 'quiet', '-of', 'json', '-show_format',
+                 '-show_streams', filepath],
+                stdout=subprocess.PIPE, stderr=devnull)
+            output = process.communicate()[0]
+        data = json.loads(output)
+    except (OSError, ValueError) as e:
+        logger.error('Could not probe {}: {}'.format(filepath, e))
+        return {}
+
+    metadata = {}
+
+    if data.get('format', {}).get('format_name'):
+        metadata['container'] = data['format']['format_name']
+
+    try:
+        duration = int(float(data['format']['duration']))
+        metadata['duration'] = duration
+        metadata['duration_min'] = duration / 60
+        metadata['duration_sec'] = duration % 60
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    for stream in data.get('streams', []):
+        kind = stream.get('codec_type')
+
+        if kind == 'video' and 'video_codec' not in metadata:
+            metadata['video_codec'] = stream.get('codec_name')
+            metadata['width'] = stream.get('width')
+            metadata['height'] = stream.get('height')
+        elif kind == 'audio' and 'audio_codec' not in metadata:
+            metadata['audio_codec'] = stream.get('codec_name')
+
+    return metadata
+
+
+def get_cache_name(filepath):
+    """
+    A name for what is made out of a file, e.g. its thumbnail, which
+    changes with the size and modification time of the file. None if the
+    file is gone.
+    """
+
+    try:
+        info = os.stat(filepath)
+    except OSError:
+        return None
+
+    key = '{}:{}:{}'.format(filepath, info.st_size, int(info.st_mtime))
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+
+    return hashlib.sha1(key).hexdigest()
+
+
+def make_entry(filepath, metadata=None):
+    """
+    The playlist entry of a local video file
+    """
+
+    filename = os.path.splitext(os.path.basename(filepath))[0]
+    title_str = filename if len(filename) <= 40 \
+        else filename[:37] + '...'
+
+    entry = {
+        'title': title_str,
+        'video_url': None,
+        'local_path': filepath,
+        'thumbnail': None,
+        'big_thumb': None
+    }
+
+    if metadata:
+        entry.update(metadata)
+
+    return entry
+
+
+class ScanIndex(object):
+    """
+    The stamp of each file scanned and what was read from it
+    """
+
+    def __init__(self, filepath=scan_index_file):
+        super(ScanIndex, self).__init__()
+
+        self.filepath = filepath
+        self._lock = threading.Lock()
+
+        # path -> [stamp, metadata]
+        self.files = {}
+        # Whether there is anything not saved yet
+        self.dirty = False
+
+        try:
+            with open(filepath) as openfile:
+                self.files = json.load(openfile)
+        except (IOError, ValueError):
+            pass
+
+    def get(self, filepath, stamp):
+        """
+        The metadata of a file, None if it changed since it was read
+        """
+
+        item = self.files.get(filepath)
+        if item and item[0] == stamp:
+            return item[1]
+
+        return None
+
+    def update(self, filepath, stamp, metadata):
+        with self._lock:
+            self.files[filepath] = [stamp, metadata]
+            self.dirty = True
+
+    def prune(self):
+        """
+        Drops the files which are gone or changed since they were read,
+        stats each file so better called off the main loop
+        """
+
+        with self._lock:
+            items = self.files.items()
+
+        stale = [(path, item) for path, item in items
+                 if get_stamp(path) != item[0]]
+
+        with self._lock:
+            for path, item in stale:
+                # Unless it was read again meanwhile
+                if self.files.get(path) is item:
+                    del self.files[path]
+                    self.dirty = True
+
+    def save(self):
+        """
+        Writes the index, pruned, if anything changed. Called once per
+        scan rather than per file, as it rewrites the whole index.
+        """
+
+        self.prune()
+
+        with self._lock:
+            if not self.dirty:
+                return
+
+            data = json.dumps(self.files)
+            self.dirty = False
+
+        try:
+            if not os.path.isdir(os.path.dirname(self.filepath)):
+                os.makedirs(os.path.dirname(self.filepath))
+
+            atomic_write(self.filepath, data)
+        except (IOError, OSError) as e:
+            logger.error('Could not save the scan index: {}'.format(e))
+
+            with self._lock:
+                self.dirty = True
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_scan_index():
+    global _index
+
+    with _index_lock:
+        if _index is None:
+            _index = ScanIndex()
+
+    return _index
+
+
+def get_video_info(filepath, index=None, probe=True):
+    """
+    The metadata of a video file, see probe_video(), probed only if the
+    file changed since it was last. Without probe, only what is known
+    already is returned.
+
+    What was probed is kept in the index but not saved, the caller saves
+    it once done with its files.
+    """
+
+    if index is None:
+        index = get_scan_index()
+
+    stamp = get_stamp(filepath)
+    if stamp is None:
+        return {}
+
+    metadata = index.get(filepath, stamp)
+    if metadata is None:
+        if not probe:
+            return {}
+
+        command = get_probe_command()
+        if command is None:
+            return {}
+
+        metadata = probe_video(filepath, command)
+        index.update(filepath, stamp, metadata)
+
+    return metadata
+
+
+def scan_folder(directory, index=None, processes=None):
+    """
+    Returns the entries of the videos under directory. Only the files
+    which are new or changed since the last scan are probed, by a bounded
+    pool of ffprobe processes.
+    """
+
+    if index is None:
+        index = get_scan_index()
+
+    if processes is None:
+        processes = min(MAX_PROBES, cpu_count())
+
+    files = list(iter_videos(directory))
+    changed = [(path, stamp) for path, stamp in files
+               if index.get(path, stamp) is None]
+
+    logger.info('Scanned {}: {} videos, {} to probe'.format(
+        directory, len(files), len(changed)))
+
+    command = get_probe_command()
+    if command is None:
+        logger.warn('Neither of {} is installed, not probing videos'.format(
+            ', '.join(PROBE_COMMANDS)))
+        changed = []
+
+    if changed:
+        def probe(item):
+            path, stamp = item
+            return path, stamp, probe_video(path, command)
+
+        # Each worker waits on its ffprobe, which does the work
+        pool = ThreadPool(processes)
+        try:
+            for path, stamp, metadata in pool.imap_unordered(probe, changed):
+                index.update(path, stamp, metadata)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Also drops the files deleted since the last scan
+    index.save()
+
+    return [make_entry(path, index.get(path, stamp)) for path, stamp in files]
@@ -0,0 +1,363 @@
+# search.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Searches the videos of the library and the playlists, without a network
+#
+# An inverted index maps each word of the title, author, description and
+# file name of a video to the videos it appears in. It is kept up to date
+# as videos are added and removed, and saved to ~/.kano-video/search.idx
+# along with the version of each playlist it was built from, so only the
+# playlists changed since are indexed again at start-up.
+#
+
+
+import os
+import re
+import json
+import bisect
+import threading
+
+from kano.logging import logger
+from kano_video.paths import user_dir
+
+from .playliststore import video_key
+from .settings import get_setting
+from .storage import atomic_write
+
+search_index_file = os.path.join(user_dir, 'search.idx')
+
+# How much a word weighs depending on where it appears
+FIELD_WEIGHTS = (
+    ('title', 3),
+    ('author', 2),
+    ('file_name', 2),
+    ('description', 1)
+)
+
+# A word matching a query word exactly scores this much more than a word
+# starting with it
+EXACT_BONUS = 2
+
+# Bumped when the format of the saved index changes
+INDEX_FORMAT = 1
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    The lowercase words of a text, underscores separating words as in
+    file names
+    """
+
+    if not text:
+        return []
+
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8', 'replace')
+
+    return WORD_RE.findall(text.replace('_', ' ').lower())
+
+
+def get_fields(entry):
+    fields = dict(entry)
+
+    local_path = entry.get('local_path')
+    if local_path:
+        fields['file_name'] = os.path.splitext(
+            os.path.basename(local_path))[0]
+
+    return fields
+
+
+class SearchIndex(object):
+    """
+    The words of the videos in each playlist. A video in several
+    playlists is indexed once, and dropped when the last one goes.
+    """
+
+    def __init__(self):
+        super(SearchIndex, self).__init__()
+
+        # word -> {video key: weight}
+        self._postings = {}
+        # video key -> [entry, names of its playlists, words]
+        self._docs = {}
+        # playlist name -> keys of its videos
+        self._members = {}
+        # playlist name -> version it was indexed from
+        self.versions = {}
+
+        # All the words in order, for prefix matching, rebuilt on demand
+        self._words = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, name, entry):
+        key = video_key(entry)
+
+        with self._lock:
+            self._members.setdefault(name, set()).add(key)
+
+            doc = self._docs.get(key)
+            if doc is not None:
+                # The latest entry is shown, e.g. with a new viewcount
+                doc[0] = entry
+                doc[1].add(name)
+                return
+
+            weights = {}
+            fields = get_fields(entry)
+            for field, weight in FIELD_WEIGHTS:
+                for word in tokenize(fields.get(field)):
+                    weights[word] = max(weights.get(word, 0), weight)
+
+            for word, weight in weights.iteritems():
+                postings = self._postings.get(word)
+                if postings is None:
+                    postings = self._postings[word] = {}
+                    self._words = None
+                postings[key] = weight
+
+            self._docs[key] = [entry, set([name]), list(weights)]
+
+    def remove(self, name, entry):
+        key = video_key(entry)
+
+        with self._lock:
+            self._members.get(name, set()).discard(key)
+            self._unlink(name, key)
+
+    def _unlink(self, name, key):
+        doc = self._docs.get(key)
+        if doc is None:
+            return
+
+        doc[1].discard(name)
+        if doc[1]:
+            return
+
+        del self._docs[key]
+        for word in doc[2]:
+            postings = self._postings[word]
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[word]
+                self._words = None
+
+    def set_playlist(self, name, videos, version=None):
+        """
+        Indexes the videos of a playlist in place of those indexed for it
+        """
+
+        with self._lock:
+            self.remove_playlist(name)
+            for video in videos:
+                self.add(name, video)
+            self.versions[name] = version
+
+    def remove_playlist(self, name):
+        with self._lock:
+            for key in self._members.pop(name, ()):
+                self._unlink(name, key)
+            self.versions.pop(name, None)
+
+    def on_change(self, name, kind, video):
+        """
+        A playlist listener, see playlist.add_listener()
+        """
+
+        with self._lock:
+            if kind == 'add':
+                self.add(name, video)
+            elif kind == 'remove':
+                self.remove(name, video)
+            elif kind == 'delete':
+                self.remove_playlist(name)
+            elif kind == 'reload':
+                self.set_playlist(name, video)
+
+            # No longer what the saved version of the playlist holds
+            if name in self.versions:
+                self.versions[name] = None
+
+    def _match(self, word):
+        """
+        The score of every video with a word starting with word
+        """
+
+        if self._words is None:
+            self._words = sorted(self._postings)
+
+        scores = dict((key, weight * EXACT_BONUS) for key, weight in
+                      self._postings.get(word, {}).iteritems())
+
+        i = bisect.bisect_right(self._words, word)
+        while i < len(self._words) and self._words[i].startswith(word):
+            for key, weight in self._postings[self._words[i]].iteritems():
+                if scores.get(key, 0) < weight:
+                    scores[key] = weight
+            i += 1
+
+        return scores
+
+    def search(self, query, limit=50):
+        """
+        The entries of the videos matching every word of the query, the
+        last one possibly unfinished, best first
+        """
+
+        words = tokenize(query)
+        if not words:
+            return []
+
+        with self._lock:
+            scores = None
+            for word in sorted(set(words), key=len, reverse=True):
+                matches = self._match(word)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = dict((key, score + matches[key])
+                                  for key, score in scores.iteritems()
+                                  if key in matches)
+                if not scores:
+                    return []
+
+            ranked = sorted(
+                scores.iteritems(),
+                key=lambda item: (
+                    -item[1],
+                    (self._docs[item[0]][0].get('title') or '').lower()))
+
+            return [self._docs[key][0] for key, _ in ranked[:limit]]
+
+    def load(self, filepath=search_index_file):
+        """
+        Reads a saved index, returns False if there is none usable
+        """
+
+        try:
+            with open(filepath) as openfile:
+                data = json.load(openfile)
+        except (IOError, ValueError):
+            return False
+
+        if data.get('format') != INDEX_FORMAT:
+            return False
+
+        with self._lock:
+            for name, playlist in data['playlists'].iteritems():
+                self.set_playlist(name, playlist['videos'],
+                                  playlist['version'])
+
+        return True
+
+    def save(self, filepath=search_index_file):
+        with self._lock:
+            playlists = dict((name, {'version': version, 'videos': []})
+                             for name, version in self.versions.iteritems())
+            for entry, names, _ in self._docs.itervalues():
+                for name in names:
+                    if name in playlists:
+                        playlists[name]['videos'].append(entry)
+
+        data = {'format': INDEX_FORMAT, 'playlists': playlists}
+
+        try:
+            if not os.path.isdir(os.path.dirname(filepath)):
+                os.makedirs(os.path.dirname(filepath))
+
+            atomic_write(filepath, json.dumps(data))
+        except (IOError, OSError) as e:
+            logger.error('Could not save the search index: {}'.format(e))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    """
+    The index of the library and the playlists, built the first time it
+    is needed. Playlists changed since the saved index was made, or
+    already loaded in memory, are indexed again.
+    """
+
+    global _index
+
+    with _index_lock:
+        if _index is not None:
+            return _index
+
+        from .playlist import playlistCollection, library_playlist, \
+            add_listener
+
+        index = SearchIndex()
+        if get_setting('persist_search_index'):
+            index.load()
+
+        playlists = dict(playlistCollection.collection)
+        playlists['Library'] = library_playlist
+
+        summaries = playlistCollection.store.get_summaries()
+
+        for name in index.versions.keys():
+            if name not in playlists:
+                index.remove_playlist(name)
+
+        for name, playlist in playlists.iteritems():
+            version = summaries.get(name, {}).get('version')
+
+            if playlist.loaded:
+                # May hold changes not in the saved version
+                index.set_playlist(name, playlist.playlist.to_list(),
+                                   None if playlist.dirty else version)
+            elif index.versions.get(name) != version or version is None:
+                index.set_playlist(name, playlist.playlist.to_list(),
+                                   version)
+
+        add_listener(index.on_change)
+        _index = index
+
+        logger.debug('Search index holds {} videos'.format(len(index)))
+
+        return _index
+
+
+def search_local(query, limit=50):
+    """
+    The saved videos matching a query, see SearchIndex.search()
+    """
+
+    return get_search_index().search(query, limit)
+
+
+def save_search_index():
+    """
+    Saves the index if it was built and saving is enabled. To be called
+    after the playlists are saved, so the versions recorded are theirs.
+    """
+
+    if _index is None or not get_setting('persist_search_index'):
+        return
+
+    from .playlist import playlistCollection, library_playlist
+
+    playlists = dict(playlistCollection.collection)
+    playlists['Library'] = library_playlist
+
+    summaries = playlistCollection.store.get_summaries()
+
+    with _index._lock:
+        # Changed since indexed, now saved
+        for name, version in _index.versions.items():
+            if version is None and name in summaries and \
+                    name in playlists and not playlists[name].dirty:
+                _index.versions[name] = summaries[name].get('version')
+
+    _index.save()
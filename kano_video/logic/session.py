@@ -0,0 +1,224 @@
+# session.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Non-blocking video playback, reporting back through GObject signals
+#
+
+
+import threading
+
+from kano.logging import logger
+
+# Support for Gtk versions 3 and 2
+try:
+    from gi.repository import GObject
+except ImportError:
+    import gobject as GObject
+
+from . import player
+from . import playudev
+from . import processes
+from .speculation import claim
+from .playeroutput import PlayerOutputReader, PlayMetrics
+from .resume import get_video_id, get_resume_store
+
+# Seconds between two position reports
+POSITION_INTERVAL = 1
+
+# Seconds to wait for the player output to be read once it has exited
+OUTPUT_FLUSH_TIMEOUT = 0.5
+
+_session_counter = 0
+
+
+class PlayerSession(GObject.GObject):
+    """
+    A single play of a video which runs alongside the application main loop.
+
+    Connect to the signals before the next main loop iteration, they are
+    always emitted from the main loop:
+        started()
+        position(seconds)
+        player-event(PlayerEvent)
+        ended(return_code)
+        error(message)
+    """
+
+    __gsignals__ = {
+        'started': (GObject.SIGNAL_RUN_FIRST, None, ()),
+        'position': (GObject.SIGNAL_RUN_FIRST, None, (float,)),
+        'player-event': (GObject.SIGNAL_RUN_FIRST, None, (object,)),
+        'ended': (GObject.SIGNAL_RUN_FIRST, None, (int,)),
+        'error': (GObject.SIGNAL_RUN_FIRST, None, (str,))
+    }
+
+    def __init__(self, video_url=None, localfile=None, subtitles=None,
+                 keyboard_engulfer=True, resume=True):
+        GObject.GObject.__init__(self)
+
+        global _session_counter
+        _session_counter += 1
+
+        self.key = 'session-{}'.format(_session_counter)
+        self.video_url = video_url
+        self.localfile = localfile
+        self.subtitles = subtitles
+
+        self.process = None
+        self.control = None
+        self.output = None
+        self.metrics = PlayMetrics()
+        self.position = None
+        self.duration = None
+        self.rc = None
+
+        self.video_id = None
+        self.start_position = None
+        if resume:
+            self.video_id = get_video_id(video_url, localfile)
+            self.start_position = get_resume_store().get_start(self.video_id)
+
+        self._engulfer = None
+        if keyboard_engulfer:
+            self._engulfer = playudev.KeyboardEngulfer()
+
+        self._finished = threading.Event()
+
+    def start(self):
+        if self._engulfer:
+            self._engulfer.show_all()
+
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """
+        Stops the player of this session only, see processes.stop()
+        """
+
+        processes.stop(self.key)
+
+    def is_finished(self):
+        return self._finished.is_set()
+
+    def _emit(self, signal, *args):
+        GObject.idle_add(self.emit, signal, *args)
+
+    def _run(self):
+        speculative = claim(self.video_url, self.localfile)
+
+        if speculative:
+            self.process = speculative.process
+            self.control = speculative.control
+            self.output = speculative.output
+            self.output.set_callback(self._on_player_event)
+            processes.rekey(speculative.process_key, self.key)
+
+            # The stream was opened before the user asked for it
+            self.metrics.stream_opened_at = self.metrics.started_at
+        else:
+            link = player.get_video_link(self.video_url, self.localfile)
+            if not link:
+                self._finish(error='Could not find the video to play')
+                return
+
+            dbus_name = None
+            if player.omxplayer_present:
+                dbus_name = player.get_dbus_name()
+
+            cmd = player.get_player_cmd(link, self.localfile, self.subtitles,
+                                        dbus_name=dbus_name,
+                                        start=self.start_position)
+
+            logger.info('Launching player session: {}'.format(cmd))
+            try:
+                self.process = playudev.start_player(cmd, self.key)
+            except OSError as e:
+                self._finish(error='Could not start the player: {}'.format(e))
+                return
+
+            self.control = player.get_player_control(self.process, dbus_name)
+            processes.set_control(self.key, self.control)
+            self.output = PlayerOutputReader(self.process,
+                                             self._on_player_event).start()
+
+        keys = playudev.listen_for_keys(self.process, self.control)
+
+        self._emit('started')
+
+        positions = threading.Thread(target=self._report_positions)
+        positions.daemon = True
+        positions.start()
+
+        self.rc = self.process.wait()
+        playudev.stop_listening_for_keys(keys)
+        processes.unregister(self.key)
+
+        # Let the last words of the player through before wrapping up
+        self.output.join(OUTPUT_FLUSH_TIMEOUT)
+        self.metrics.finish()
+
+        logger.info('Player session ended with rc={}, {}'.format(
+            self.rc, self.metrics.as_dict()))
+        self._finish()
+
+    def _on_player_event(self, event):
+        # Called from the output reader threads
+        self.metrics.add_event(event)
+        self._emit('player-event', event)
+
+    def _report_positions(self):
+        while not self._finished.wait(POSITION_INTERVAL):
+            position = self.control.get_position()
+            if position is None:
+                continue
+
+            if self.duration is None:
+                self.duration = self.control.get_duration()
+
+            self.position = position
+            self._emit('position', position)
+
+    def do_position(self, position):
+        if self.video_id:
+            get_resume_store().update(self.video_id, position, self.duration)
+
+    def _finish(self, error=None):
+        self._finished.set()
+        GObject.idle_add(self._finish_in_main_loop, error)
+
+    def _finish_in_main_loop(self, error):
+        if self._engulfer:
+            self._engulfer.destroy()
+            self._engulfer = None
+
+        if self.video_id and self.position is not None:
+            store = get_resume_store()
+            store.update(self.video_id, self.position, self.duration)
+            store.flush()
+
+        if error:
+            logger.error(error)
+            self.emit('error', error)
+        else:
+            self.emit('ended', self.rc)
+
+        return False
+
+
+def play_video_async(video_url=None, localfile=None, subtitles=None,
+                     keyboard_engulfer=True, resume=True):
+    """
+    Starts playing a video without blocking the main loop, from where it
+    was left last time if resume is set.
+    Returns the PlayerSession, connect to its signals to follow the play.
+    """
+
+    session = PlayerSession(video_url, localfile, subtitles,
+                            keyboard_engulfer, resume)
+    session.start()
+
+    return session
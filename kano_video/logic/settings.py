@@ -0,0 +1,62 @@
+# settings.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# User configurable options, read from ~/.kano-video/settings.json
+#
+
+
+import os
+import json
+
+from kano.logging import logger
+from kano_video.paths import user_dir
+
+settings_file = os.path.join(user_dir, 'settings.json')
+
+DEFAULT_SETTINGS = {
+    # Start the player paused and hidden when the detail view opens
+    'prespawn_player': False,
+    # Do not speculate unless at least this much memory is available
+    'prespawn_min_free_mb': 160,
+    # Where playlists are kept: 'json' files, an 'sqlite' database or
+    # compact binary 'pack' files
+    'playlist_storage': 'json',
+    # Keep the index of the local search on disk, see search.py
+    'persist_search_index': True,
+    # Queue the videos added to the library which the player cannot
+    # decode in hardware for transcoding, see transcode.py
+    'auto_transcode': False
+}
+
+_settings = None
+
+
+def load_settings(filepath=settings_file):
+    """
+    Reads the user settings on top of the defaults.
+    A missing or broken settings file leaves the defaults in place.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+
+    try:
+        with open(filepath) as openfile:
+            settings.update(json.load(openfile))
+    except IOError:
+        pass
+    except ValueError as e:
+        logger.error('Ignoring malformed settings file {}: {}'.format(
+            filepath, e))
+
+    return settings
+
+
+def get_setting(name):
+    global _settings
+
+    if _settings is None:
+        _settings = load_settings()
+
+    return _settings.get(name, DEFAULT_SETTINGS.get(name))
@@ -0,0 +1,287 @@
+# speculation.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Starts the player ahead of time, while the user is looking at a video's
+# details, so that pressing WATCH only has to reveal it
+#
+
+
+import time
+import threading
+
+from kano.logging import logger
+
+from .settings import get_setting
+from . import player
+from . import playudev
+from . import processes
+from .playeroutput import PlayerOutputReader
+from .resume import get_video_id, get_resume_store
+
+# How long to wait for the prespawned player to open its stream
+READY_TIMEOUT = 20
+READY_POLL_INTERVAL = 0.2
+
+_lock = threading.Lock()
+_current = None
+
+stats = {
+    'prespawned': 0,
+    'claimed': 0,
+    'discarded': 0,
+    'skipped_low_memory': 0,
+    'seconds_saved': 0.0
+}
+
+
+def get_available_memory_mb(meminfo='/proc/meminfo'):
+    """
+    Reads how much memory could be given to a new process without swapping.
+    Kernels before 3.14 lack MemAvailable so it is estimated from the
+    free and reclaimable page cache.
+    """
+
+    values = {}
+    try:
+        with open(meminfo) as openfile:
+            for line in openfile:
+                key, _, rest = line.partition(':')
+                values[key] = int(rest.split()[0])
+    except (IOError, ValueError, IndexError):
+        return None
+
+    if 'MemAvailable' in values:
+        available_kb = values['MemAvailable']
+    else:
+        available_kb = values.get('MemFree', 0) + \
+            values.get('Buffers', 0) + values.get('Cached', 0)
+
+    return available_kb / 1024
+
+
+class SpeculativePlayer(object):
+    """
+    A player started muted, hidden and paused for a given video
+    """
+
+    def __init__(self, key, video_url=None, localfile=None, start=None):
+        super(SpeculativePlayer, self).__init__()
+
+        self.key = key
+        self.video_url = video_url
+        self.localfile = localfile
+        self.start_position = start
+        self.dbus_name = player.get_dbus_name()
+        self.process_key = 'prespawn-{}'.format(self.dbus_name)
+
+        self.process = None
+        self.output = None
+        self.control = None
+        self.requested_at = time.time()
+        self.spawned_at = None
+        self.ready_at = None
+        self.cancelled = False
+        # Set once the player is ready, or will never be
+        self.settled = threading.Event()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._spawn()
+        finally:
+            self.settled.set()
+
+    def _spawn(self):
+        # Resolving a YouTube stream takes a few seconds on its own
+        link = player.get_video_link(self.video_url, self.localfile)
+        if not link or self.cancelled:
+            return
+
+        cmd = player.get_player_cmd(link, self.localfile,
+                                    dbus_name=self.dbus_name,
+                                    speculative=True,
+                                    start=self.start_position)
+
+        with _lock:
+            if self.cancelled:
+                return
+
+            logger.info('Prespawning player for {}'.format(self.key))
+            self.spawned_at = time.time()
+            self.process = playudev.start_player(cmd, self.process_key)
+            self.output = PlayerOutputReader(self.process).start()
+            self.control = player.get_player_control(self.process,
+                                                     self.dbus_name)
+            processes.set_control(self.process_key, self.control)
+
+        # omxplayer only serves DBus once its stream is open, so the pause
+        # going through is also the signal that it is ready to be shown
+        deadline = self.spawned_at + READY_TIMEOUT
+        while time.time() < deadline:
+            if self.cancelled or self.process.poll() is not None:
+                return
+
+            if self.control.pause():
+                self.ready_at = time.time()
+                logger.info('Prespawned player ready after {:.2f}s'.format(
+                    self.ready_at - self.spawned_at))
+                return
+
+            time.sleep(READY_POLL_INTERVAL)
+
+        logger.warn('Prespawned player never became ready, discarding')
+        self.kill()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def reveal(self):
+        """
+        Turns the sound back on, makes the video opaque and resumes it
+        """
+
+        self.control.set_volume(player.get_volume_millibel())
+        self.control.set_alpha(255)
+        return self.control.play()
+
+    def kill(self):
+        self.cancelled = True
+
+        # Once the lock is free, a spawn in progress has registered its
+        # process and no other starts. Stopping may take a while, e.g. from
+        # the main loop through discard(), so it is done without the lock.
+        with _lock:
+            pass
+
+        processes.stop(self.process_key)
+
+
+def _get_key(video_url=None, localfile=None):
+    return video_url or localfile
+
+
+def prespawn(video_url=None, localfile=None):
+    """
+    Opt-in: starts a hidden player for the video the user is looking at.
+    Any previous speculation for another video is discarded.
+    """
+
+    global _current
+
+    if not get_setting('prespawn_player'):
+        return
+
+    # omxplayer is the only backend which can be started hidden and
+    # revealed later on
+    if not player.omxplayer_present:
+        return
+
+    key = _get_key(video_url, localfile)
+    if not key:
+        return
+
+    with _lock:
+        if _current and _current.key == key and not _current.cancelled:
+            return
+
+    discard()
+
+    available = get_available_memory_mb()
+    min_free = get_setting('prespawn_min_free_mb')
+    if available is not None and available < min_free:
+        logger.info('Not prespawning, only {}MB of memory available'.format(
+            available))
+        stats['skipped_low_memory'] += 1
+        return
+
+    # Open the stream where the session will ask for it
+    start = get_resume_store().get_start(get_video_id(video_url, localfile))
+
+    with _lock:
+        _current = SpeculativePlayer(key, video_url, localfile, start)
+        stats['prespawned'] += 1
+
+    _current.start()
+
+
+def claim(video_url=None, localfile=None):
+    """
+    Hands over the prespawned player for this video if there is a usable
+    one, revealed and playing. Returns the SpeculativePlayer or None.
+
+    A player still starting for this video is waited for: it is further
+    along than a new one would be. To be called off the main loop.
+    """
+
+    global _current
+
+    key = _get_key(video_url, localfile)
+
+    with _lock:
+        speculative = _current
+        if not speculative or speculative.key != key or \
+                speculative.cancelled:
+            speculative = None
+
+    if speculative is not None and not speculative.settled.is_set():
+        logger.info('Waiting for the prespawned player to be ready')
+        speculative.settled.wait(max(
+            0, speculative.requested_at + READY_TIMEOUT - time.time()))
+
+    with _lock:
+        speculative = _current
+        if not speculative or speculative.key != key or \
+                not speculative.ready_at or not speculative.is_alive():
+            speculative = None
+        else:
+            _current = None
+
+    if speculative is None:
+        discard()
+        return None
+
+    if not speculative.reveal():
+        logger.warn('Could not reveal the prespawned player')
+        speculative.kill()
+        stats['discarded'] += 1
+        return None
+
+    # Everything from resolving the link to the stream being open
+    # happened before the user pressed WATCH
+    saved = speculative.ready_at - speculative.requested_at
+    stats['claimed'] += 1
+    stats['seconds_saved'] += saved
+    logger.info('Prespawned player saved {:.2f}s of start-up '
+                '({:.2f}s saved over {} plays)'.format(
+                    saved, stats['seconds_saved'], stats['claimed']))
+
+    return speculative
+
+
+def discard():
+    """
+    Throws away the prespawned player, e.g. when leaving the detail view
+    """
+
+    global _current
+
+    with _lock:
+        speculative = _current
+        _current = None
+
+    if speculative:
+        logger.info('Discarding prespawned player for {}'.format(
+            speculative.key))
+        speculative.kill()
+        stats['discarded'] += 1
+
+
+def get_stats():
+    return dict(stats)
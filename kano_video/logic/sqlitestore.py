@@ -0,0 +1,363 @@
+# sqlitestore.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Keeps the playlists in an SQLite database, with indexed lookups
+#
+# Enabled with "playlist_storage": "sqlite" in the settings, the JSON
+# playlists are then imported once.
+#
+# SQLite locks the database itself, other processes are told apart by the
+# version of each playlist, bumped by every write.
+#
+
+
+import os
+import json
+import sqlite3
+import threading
+
+from kano.logging import logger
+
+from .playliststore import playlist_dir, video_key, merge_ops
+
+database_file = os.path.join(playlist_dir, 'playlists.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY,
+    video_key TEXT NOT NULL UNIQUE,
+    video_url TEXT,
+    local_path TEXT,
+    title TEXT,
+    author TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS videos_video_url ON videos (video_url);
+CREATE INDEX IF NOT EXISTS videos_local_path ON videos (local_path);
+CREATE INDEX IF NOT EXISTS videos_title ON videos (title);
+CREATE INDEX IF NOT EXISTS videos_author ON videos (author);
+
+CREATE TABLE IF NOT EXISTS playlists (
+    name TEXT PRIMARY KEY,
+    permanent INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS playlist_videos (
+    playlist TEXT NOT NULL REFERENCES playlists (name),
+    position INTEGER NOT NULL,
+    video_id INTEGER NOT NULL REFERENCES videos (id)
+);
+CREATE INDEX IF NOT EXISTS playlist_videos_position
+    ON playlist_videos (playlist, position);
+CREATE INDEX IF NOT EXISTS playlist_videos_video_id
+    ON playlist_videos (video_id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# Columns of the videos table which can be looked up
+FIELDS = ('video_key', 'video_url', 'local_path', 'title', 'author')
+
+
+class SqlitePlaylistStore(object):
+    """
+    Keeps each video once in the videos table, and the playlists as
+    ordered lists of video ids. Every save is a single transaction.
+
+    Has the same interface as JsonPlaylistStore. A video in several
+    playlists is stored once, with the entry it was last saved with.
+    """
+
+    def __init__(self, filepath=database_file):
+        super(SqlitePlaylistStore, self).__init__()
+
+        self.filepath = filepath
+
+        # Loads happen on the main thread, saves on the autosaver's
+        self._lock = threading.Lock()
+        # name -> version of the playlist when this process last read or
+        # wrote it
+        self._seen = {}
+        self._db = sqlite3.connect(filepath, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+        columns = [row[1] for row in
+                   self._db.execute('PRAGMA table_info(playlists)')]
+        if 'version' not in columns:
+            self._db.execute('ALTER TABLE playlists ADD COLUMN '
+                             'version INTEGER NOT NULL DEFAULT 0')
+
+    def migrate(self, json_store):
+        """
+        Imports the JSON playlists, the first time only
+        """
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM meta WHERE key = 'migrated'").fetchone()
+            if row:
+                return
+
+        playlists = []
+        for name in json_store.get_summaries():
+            data = json_store.load(name)
+            if data is not None:
+                playlists.append((name, data[0], data[1]))
+
+        with self._lock, self._db:
+            for name, permanent, videos in playlists:
+                self._replace(name, permanent, videos)
+            self._db.execute(
+                "INSERT INTO meta (key, value) VALUES ('migrated', '1')")
+
+        logger.info('Imported {} playlists into {}'.format(
+            len(playlists), self.filepath))
+
+    def exists(self, name):
+        with self._lock:
+            return self._get_version(name) is not None
+
+    def get_summaries(self):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT name, permanent, version, COUNT(video_id) '
+                'FROM playlists LEFT JOIN playlist_videos ON playlist = name '
+                'GROUP BY name').fetchall()
+
+            for name, _, version, _ in rows:
+                self._seen.setdefault(name, version)
+
+        return dict((name, {'count': count, 'permanent': bool(permanent),
+                            'version': version})
+                    for name, permanent, version, count in rows)
+
+    def load(self, name):
+        with self._lock:
+            data = self._load(name)
+            self._seen[name] = self._get_version(name)
+
+        return data
+
+    def _load(self, name):
+        row = self._db.execute(
+            'SELECT permanent FROM playlists WHERE name = ?',
+            (name,)).fetchone()
+        if row is None:
+            return None
+
+        rows = self._db.execute(
+            'SELECT data FROM playlist_videos '
+            'JOIN videos ON videos.id = video_id '
+            'WHERE playlist = ? ORDER BY position', (name,)).fetchall()
+
+        return bool(row[0]), [json.loads(data) for data, in rows]
+
+    def replace(self, name, permanent, videos):
+        with self._lock, self._db:
+            self._replace(name, permanent, videos)
+            self._seen[name] = self._get_version(name)
+
+    def write(self, name, permanent, videos, ops):
+        """
+        Returns None, or the merged videos if another process saved the
+        playlist since this one last read it
+        """
+
+        with self._lock, self._db:
+            # No other process writes between the check and the write
+            self._db.execute('BEGIN IMMEDIATE')
+
+            seen = self._seen.get(name)
+            if seen is not None and seen != self._get_version(name):
+                data = self._load(name)
+                if data is not None:
+                    videos = merge_ops(data[1], ops)
+
+                logger.info('Merging playlist {} with the one saved by '
+                            'another process'.format(name))
+                self._replace(name, permanent, videos)
+                self._seen[name] = self._get_version(name)
+                return videos
+
+            self._write(name, permanent, videos, ops)
+            self._seen[name] = self._get_version(name)
+
+        return None
+
+    def _write(self, name, permanent, videos, ops):
+        self._set_playlist(name, permanent)
+
+        # Every position changes with a reorder anyway
+        if any(op['op'] == 'reorder' for op in ops):
+            self._replace(name, permanent, videos)
+            return
+
+        count = self._count(name)
+        try:
+            for op in ops:
+                kind = op['op']
+
+                if kind == 'add':
+                    self._insert(name, count,
+                                 self._get_video_id(op['video']))
+                    count += 1
+                elif kind == 'remove':
+                    self._pop(name, op['index'])
+                    count -= 1
+                elif kind == 'move':
+                    video_id = self._pop(name, op['from'])
+                    self._insert(name, op['to'], video_id)
+        except IndexError:
+            count = None
+
+        if count != len(videos):
+            # Out of step with the playlist in memory, start again
+            logger.warn('Rewriting playlist {}'.format(name))
+            self._replace(name, permanent, videos)
+
+    def delete(self, name):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM playlist_videos WHERE playlist = ?',
+                             (name,))
+            self._db.execute('DELETE FROM playlists WHERE name = ?', (name,))
+            self._db.execute(
+                'DELETE FROM videos WHERE id NOT IN '
+                '(SELECT video_id FROM playlist_videos)')
+            self._seen.pop(name, None)
+
+    def get_changes(self, paths=None):
+        """
+        The names of the playlists saved, created or deleted by another
+        process since this one last read or wrote them, until they are
+        loaded again. The database is a single file, so the paths changed
+        do not narrow it down.
+        """
+
+        with self._lock:
+            versions = dict(self._db.execute(
+                'SELECT name, version FROM playlists').fetchall())
+
+            changed = set(name for name in self._seen
+                          if name not in versions)
+            changed.update(name for name, version in versions.iteritems()
+                           if self._seen.get(name) != version)
+
+            # Seen once read again, see load()
+            for name in changed:
+                if name not in versions:
+                    del self._seen[name]
+
+        return changed
+
+    def watch_paths(self):
+        return [os.path.dirname(self.filepath) or '.']
+
+    def find_videos(self, **fields):
+        """
+        Returns the (playlist name, entry) of every video whose entry has
+        the given values, looked up through the indexes
+        """
+
+        for field in fields:
+            if field not in FIELDS:
+                raise ValueError('Cannot look videos up by {}'.format(field))
+
+        where = ' AND '.join('videos.{} = ?'.format(f) for f in fields)
+
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT playlist, data FROM videos '
+                'JOIN playlist_videos ON video_id = videos.id '
+                'WHERE {} ORDER BY playlist, position'.format(where or '1'),
+                fields.values()).fetchall()
+
+        return [(name, json.loads(data)) for name, data in rows]
+
+    def count(self, name):
+        with self._lock:
+            return self._count(name)
+
+    def flush(self):
+        # Every write is committed already
+        pass
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _get_version(self, name):
+        row = self._db.execute('SELECT version FROM playlists WHERE name = ?',
+                               (name,)).fetchone()
+        return row[0] if row else None
+
+    def _count(self, name):
+        return self._db.execute(
+            'SELECT COUNT(*) FROM playlist_videos WHERE playlist = ?',
+            (name,)).fetchone()[0]
+
+    def _set_playlist(self, name, permanent):
+        self._db.execute(
+            'INSERT OR IGNORE INTO playlists (name, permanent) VALUES (?, ?)',
+            (name, int(permanent)))
+        self._db.execute(
+            'UPDATE playlists SET permanent = ?, version = version + 1 '
+            'WHERE name = ?', (int(permanent), name))
+
+    def _replace(self, name, permanent, videos):
+        self._set_playlist(name, permanent)
+        self._db.execute('DELETE FROM playlist_videos WHERE playlist = ?',
+                         (name,))
+        self._db.executemany(
+            'INSERT INTO playlist_videos (playlist, position, video_id) '
+            'VALUES (?, ?, ?)',
+            ((name, position, self._get_video_id(video))
+             for position, video in enumerate(videos)))
+
+    def _get_video_id(self, video):
+        key = video_key(video)
+        values = (video.get('video_url'), video.get('local_path'),
+                  video.get('title'), video.get('author'), json.dumps(video))
+
+        cursor = self._db.execute(
+            'UPDATE videos SET video_url = ?, local_path = ?, title = ?, '
+            'author = ?, data = ? WHERE video_key = ?', values + (key,))
+        if cursor.rowcount:
+            return self._db.execute(
+                'SELECT id FROM videos WHERE video_key = ?',
+                (key,)).fetchone()[0]
+
+        return self._db.execute(
+            'INSERT INTO videos (video_key, video_url, local_path, title, '
+            'author, data) VALUES (?, ?, ?, ?, ?, ?)',
+            (key,) + values).lastrowid
+
+    def _insert(self, name, position, video_id):
+        self._db.execute(
+            'UPDATE playlist_videos SET position = position + 1 '
+            'WHERE playlist = ? AND position >= ?', (name, position))
+        self._db.execute(
+            'INSERT INTO playlist_videos (playlist, position, video_id) '
+            'VALUES (?, ?, ?)', (name, position, video_id))
+
+    def _pop(self, name, position):
+        row = self._db.execute(
+            'SELECT rowid, video_id FROM playlist_videos '
+            'WHERE playlist = ? AND position = ?', (name, position)).fetchone()
+        if row is None:
+            raise IndexError('no video at {} in {}'.format(position, name))
+
+        self._db.execute('DELETE FROM playlist_videos WHERE rowid = ?',
+                         (row[0],))
+        self._db.execute(
+            'UPDATE playlist_videos SET position = position - 1 '
+            'WHERE playlist = ? AND position > ?', (name, position))
+
+        return row[1]
@@ -0,0 +1,179 @@
+# storage.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Crash safe file writes for the SD card
+#
+
+
+import os
+import json
+import fcntl
+from contextlib import contextmanager
+
+from kano.logging import logger
+
+
+def fsync_dir(directory):
+    """
+    Makes a rename or a removal in directory survive a power cut
+    """
+
+    try:
+        fd = os.open(directory or '.', os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_open(filepath):
+    """
+    Opens a temporary file which replaces filepath, all at once, when the
+    block ends without an exception: after a crash the file holds either
+    the old or the new content, never part of it
+    """
+
+    tmp_path = filepath + '.tmp'
+
+    try:
+        with open(tmp_path, 'w') as openfile:
+            yield openfile
+            openfile.flush()
+            os.fsync(openfile.fileno())
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    os.rename(tmp_path, filepath)
+    fsync_dir(os.path.dirname(filepath))
+
+
+def atomic_write(filepath, data):
+    """
+    Replaces the file with data, all at once, see atomic_open()
+    """
+
+    with atomic_open(filepath) as openfile:
+        openfile.write(data)
+
+
+@contextmanager
+def file_lock(filepath):
+    """
+    Holds an exclusive advisory lock on filepath, created if need be, for
+    the block. Other processes taking it wait until the block ends.
+    """
+
+    with open(filepath, 'a') as openfile:
+        fcntl.flock(openfile.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(openfile.fileno(), fcntl.LOCK_UN)
+
+
+class Journal(object):
+    """
+    An append-only log of JSON records, one per line, each one reaching
+    the disk before append() returns.
+
+    The first record is a header naming the snapshot the operations apply
+    to. A line cut short by a power cut ends the log: it is dropped, along
+    with anything after it, when the log is read.
+    """
+
+    def __init__(self, filepath):
+        super(Journal, self).__init__()
+
+        self.filepath = filepath
+        self.count = 0
+
+    def read(self):
+        """
+        Returns the header and the list of records, or (None, []) if there
+        is no journal
+        """
+
+        header = None
+        records = []
+        valid_size = 0
+
+        try:
+            with open(self.filepath) as openfile:
+                data = openfile.read()
+        except IOError:
+            return None, []
+
+        for line in data.splitlines(True):
+            if not line.endswith('\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+
+            if header is None:
+                header = record
+            else:
+                records.append(record)
+            valid_size += len(line)
+
+        if valid_size != len(data):
+            logger.warn('Dropping the torn end of {}'.format(self.filepath))
+            self._truncate(valid_size)
+
+        self.count = len(records)
+
+        return header, records
+
+    def start(self, header):
+        """
+        Starts a new, empty journal
+        """
+
+        atomic_write(self.filepath, json.dumps(header) + '\n')
+        self.count = 0
+
+    def append(self, record):
+        self.extend([record])
+
+    def extend(self, records):
+        """
+        Appends several records with a single write and fsync
+        """
+
+        with open(self.filepath, 'a') as openfile:
+            openfile.write(''.join(json.dumps(record) + '\n'
+                                   for record in records))
+            openfile.flush()
+            os.fsync(openfile.fileno())
+
+        self.count += len(records)
+
+    def remove(self):
+        try:
+            os.remove(self.filepath)
+        except OSError:
+            pass
+
+        self.count = 0
+
+    def _truncate(self, size):
+        try:
+            with open(self.filepath, 'r+') as openfile:
+                openfile.truncate(size)
+                openfile.flush()
+                os.fsync(openfile.fileno())
+        except IOError as e:
+            logger.error('Could not repair {}: {}'.format(self.filepath, e))
@@ -0,0 +1,267 @@
+# thumbnails.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Makes thumbnails of local videos, and downloads those of YouTube videos,
+# in the background
+#
+# A frame is grabbed from a tenth of the way into each video with ffmpeg,
+# run at the lowest CPU and disk priority, and kept in
+# ~/.kano-video/thumbnails under a name made of the path, size and
+# modification time of the video, so a replaced file gets a new one.
+# Generation stops while a video is playing.
+#
+
+
+import os
+import time
+import threading
+from functools import partial
+from collections import deque
+
+from kano.logging import logger
+from kano.utils import download_url
+from kano_video.paths import user_dir
+
+from . import processes
+from .scanner import probe_video, get_probe_command, get_cache_name, \
+    get_ffmpeg_command
+from .youtube import tmp_dir
+
+thumbnail_dir = os.path.join(user_dir, 'thumbnails')
+
+THUMBNAIL_WIDTH = 120
+
+# Where the frame is taken, as a fraction of the duration
+FRAME_POSITION = 0.1
+
+# Generators running at once
+THUMBNAIL_WORKERS = 1
+
+
+def get_thumbnail_path(filepath):
+    """
+    Where the thumbnail of a video is cached, None if the video is gone
+    """
+
+    name = get_cache_name(filepath)
+    if name is None:
+        return None
+
+    return os.path.join(thumbnail_dir, name + '.jpg')
+
+
+def make_thumbnail(filepath, thumbnail, duration=None):
+    """
+    Grabs a frame of the video into thumbnail, returns whether it worked.
+    The encoder is stopped while a video plays.
+    """
+
+    command = get_ffmpeg_command()
+    if command is None:
+        return False
+
+    if duration is None and get_probe_command():
+        duration = probe_video(filepath).get('duration')
+
+    position = int((duration or 0) * FRAME_POSITION)
+
+    status = processes.run_idle(
+        [command, '-v', 'quiet', '-ss', str(position), '-i', filepath,
+         '-frames:v', '1', '-vf', 'scale={}:-1'.format(THUMBNAIL_WIDTH),
+         '-y', thumbnail + '.tmp.jpg'])
+
+    if status != 0 or not os.path.exists(thumbnail + '.tmp.jpg'):
+        return False
+
+    try:
+        os.rename(thumbnail + '.tmp.jpg', thumbnail)
+    except OSError:
+        return False
+
+    return True
+
+
+class ThumbnailGenerator(object):
+    """
+    Makes the thumbnails requested, one at a time, on background threads.
+    Each callback is called with the video and its thumbnail from the
+    worker thread, the UI has to take it back to the main loop.
+
+    The latest requests are done first: they are for the videos on screen,
+    while those scrolled past are still waiting.
+    """
+
+    def __init__(self, workers=THUMBNAIL_WORKERS):
+        super(ThumbnailGenerator, self).__init__()
+
+        self.workers = workers
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        # Paths in the queue, not started yet
+        self._queued = set()
+        # path -> callbacks waiting for it
+        self._callbacks = {}
+        # Videos which could not be done, not tried again
+        self._failed = set()
+        # url -> the thumbnail downloaded from it
+        self._downloaded = {}
+        self._threads = []
+
+    def request(self, filepath, callback, duration=None):
+        """
+        Queues a video for a thumbnail, ahead of the others. A callback
+        already waiting for it is not added again.
+        """
+
+        self._request(filepath, callback,
+                      partial(self._make, filepath, duration), True)
+
+    def request_download(self, url, callback):
+        """
+        Queues the thumbnail of a YouTube video for download, as request()
+        does. One downloaded already is given straight away.
+        """
+
+        with self._cond:
+            thumbnail = self._downloaded.get(url)
+
+        if thumbnail is not None:
+            callback(url, thumbnail)
+            return
+
+        # The network may be back next time
+        self._request(url, callback, partial(self._download, url), False)
+
+    def _request(self, key, callback, make, remember_failure):
+        with self._cond:
+            if key in self._failed:
+                return
+
+            started = key in self._callbacks and key not in self._queued
+
+            callbacks = self._callbacks.setdefault(key, [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+
+            if started:
+                return
+
+            if key in self._queued:
+                self._drop(key)
+
+            self._queued.add(key)
+            self._queue.append((key, make, remember_failure))
+
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+            self._cond.notify()
+
+    def cancel(self, filepath, callback):
+        """
+        Takes back a request, e.g. for a video which is not on screen
+        anymore. The video is dropped from the queue if nothing else waits
+        for it.
+        """
+
+        with self._cond:
+            callbacks = self._callbacks.get(filepath, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+            if not callbacks and filepath in self._queued:
+                del self._callbacks[filepath]
+                self._drop(filepath)
+
+    def _drop(self, filepath):
+        self._queued.discard(filepath)
+        self._queue = deque(item for item in self._queue
+                            if item[0] != filepath)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+
+                filepath, make, remember_failure = self._queue.pop()
+                self._queued.discard(filepath)
+
+            # Nothing competes with the player
+            while processes.is_playing():
+                time.sleep(processes.JOB_POLL_INTERVAL)
+
+            thumbnail = make()
+
+            with self._cond:
+                callbacks = self._callbacks.pop(filepath, [])
+                if thumbnail is None and remember_failure:
+                    self._failed.add(filepath)
+
+            if thumbnail is None:
+                continue
+
+            for callback in callbacks:
+                try:
+                    callback(filepath, thumbnail)
+                except Exception as e:
+                    logger.error('Thumbnail callback failed: {}'.format(e))
+
+    def _download(self, url):
+        thumbnail = '{}/video_{}.jpg'.format(tmp_dir, time.time())
+
+        try:
+            if not os.path.isdir(tmp_dir):
+                os.makedirs(tmp_dir)
+        except OSError as e:
+            logger.error('Could not create {}: {}'.format(tmp_dir, e))
+            return None
+
+        download_url(url, thumbnail)
+        if not os.path.exists(thumbnail):
+            logger.warn('Could not download the thumbnail {}'.format(url))
+            return None
+
+        with self._cond:
+            self._downloaded[url] = thumbnail
+
+        return thumbnail
+
+    def _make(self, filepath, duration):
+        thumbnail = get_thumbnail_path(filepath)
+        if thumbnail is None:
+            return None
+
+        if os.path.exists(thumbnail):
+            return thumbnail
+
+        try:
+            if not os.path.isdir(thumbnail_dir):
+                os.makedirs(thumbnail_dir)
+        except OSError as e:
+            logger.error('Could not create {}: {}'.format(thumbnail_dir, e))
+            return None
+
+        if not make_thumbnail(filepath, thumbnail, duration):
+            logger.warn('Could not make a thumbnail of {}'.format(filepath))
+            return None
+
+        return thumbnail
+
+
+_generator = None
+
+
+def get_thumbnail_generator():
+    global _generator
+
+    if _generator is None:
+        _generator = ThumbnailGenerator()
+
+    return _generator
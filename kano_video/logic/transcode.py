@@ -0,0 +1,399 @@
+# transcode.py
+#
+# Copyright (C) 2016 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Converts local videos the player cannot decode in hardware to H.264/AAC
+#
+# omxplayer only uses the GPU of the Pi for a few codecs, anything else
+# plays as a slideshow if at all. Such videos can be transcoded in the
+# background, a minute at a time so an interrupted transcode carries on
+# where it was, into ~/.kano-video/transcoded. The player then opens the
+# transcoded copy instead, see get_playable_file().
+#
+
+
+import os
+import json
+import math
+import time
+import shutil
+import threading
+
+from kano.logging import logger
+from kano.utils import is_installed
+from kano_video.paths import user_dir
+
+from . import processes
+from .settings import get_setting
+from .storage import atomic_write
+from .scanner import get_cache_name, get_video_info, get_ffmpeg_command, \
+    get_scan_index
+
+transcode_dir = os.path.join(user_dir, 'transcoded')
+queue_file = os.path.join(user_dir, 'transcode.queue')
+
+# Video codecs each player decodes in hardware, VLC decodes everything in
+# software whatever the codec
+HARDWARE_CODECS = {
+    'omxplayer': ('h264', 'mpeg4', 'h263', 'mjpeg')
+}
+
+# Seconds of video transcoded by each ffmpeg run
+CHUNK_SECONDS = 60
+
+# Cores given to the encoder
+TRANSCODE_THREADS = 1
+
+omxplayer_present = is_installed('omxplayer')
+
+
+def get_player_backend():
+    return 'omxplayer' if omxplayer_present else 'vlc'
+
+
+def needs_transcode(info):
+    """
+    Whether the player cannot decode a video, given its metadata, in
+    hardware
+    """
+
+    codecs = HARDWARE_CODECS.get(get_player_backend())
+    codec = info.get('video_codec')
+
+    return codecs is not None and codec is not None and codec not in codecs
+
+
+def video_needs_transcode(video):
+    """
+    Whether a local video of a playlist needs transcoding and has not been
+    yet, as far as is known without probing it
+    """
+
+    localfile = video.get('local_path')
+    if not localfile:
+        return False
+
+    info = video if 'video_codec' in video else \
+        get_video_info(localfile, probe=False)
+
+    return needs_transcode(info) and get_transcoded(localfile) is None
+
+
+def get_transcoded_path(filepath):
+    name = get_cache_name(filepath)
+    if name is None:
+        return None
+
+    return os.path.join(transcode_dir, name + '.mp4')
+
+
+def get_transcoded(filepath):
+    """
+    The transcoded copy of a video if there is one, None otherwise
+    """
+
+    target = get_transcoded_path(filepath)
+    if target and os.path.exists(target):
+        return target
+
+    return None
+
+
+def get_playable_file(localfile):
+    """
+    What the player should open for a local video: its transcoded copy if
+    it was made, the video itself otherwise
+    """
+
+    if not localfile:
+        return localfile
+
+    return get_transcoded(localfile) or localfile
+
+
+def transcode(filepath, duration):
+    """
+    Transcodes a video to H.264/AAC a chunk of CHUNK_SECONDS at a time,
+    each one kept once done so that an interrupted transcode resumes with
+    the chunk it was at. Returns the transcoded copy, None if it failed.
+    """
+
+    command = get_ffmpeg_command()
+    target = get_transcoded_path(filepath)
+    if command is None or target is None:
+        return None
+
+    parts_dir = target + '.parts'
+    if not os.path.isdir(parts_dir):
+        os.makedirs(parts_dir)
+
+    chunks = max(1, int(math.ceil(float(duration or 0) / CHUNK_SECONDS)))
+    parts = []
+
+    for i in xrange(chunks):
+        part = os.path.join(parts_dir, '{:05d}.ts'.format(i))
+        parts.append(part)
+
+        if os.path.exists(part):
+            continue
+
+        status = processes.run_idle(
+            [command, '-v', 'quiet', '-ss', str(i * CHUNK_SECONDS),
+             '-t', str(CHUNK_SECONDS), '-i', filepath,
+             '-map', '0:v:0', '-map', '0:a:0?',
+             '-c:v', 'libx264', '-preset', 'veryfast',
+             '-threads', str(TRANSCODE_THREADS),
+             '-c:a', 'aac', '-strict', 'experimental', '-b:a', '128k',
+             '-f', 'mpegts', '-y', part + '.tmp'])
+        if status != 0:
+            logger.error('Could not transcode {} from {}s'.format(
+                filepath, i * CHUNK_SECONDS))
+            return None
+
+        os.rename(part + '.tmp', part)
+
+    status = processes.run_idle(
+        [command, '-v', 'quiet', '-i', 'concat:' + '|'.join(parts),
+         '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-f', 'mp4', '-y',
+         target + '.tmp'])
+    if status != 0:
+        logger.error('Could not join the transcoded {}'.format(filepath))
+        return None
+
+    os.rename(target + '.tmp', target)
+    shutil.rmtree(parts_dir, ignore_errors=True)
+
+    return target
+
+
+class TranscodeQueue(object):
+    """
+    The videos waiting to be transcoded, done one at a time on a
+    background thread. The queue is saved, so the transcodes carry on at
+    the next start.
+    """
+
+    def __init__(self, filepath=queue_file):
+        super(TranscodeQueue, self).__init__()
+
+        self.filepath = filepath
+
+        self._cond = threading.Condition()
+        self._queue = []
+        self._thread = None
+
+        try:
+            with open(filepath) as openfile:
+                self._queue = json.load(openfile)
+        except (IOError, ValueError):
+            pass
+
+    def __contains__(self, filepath):
+        with self._cond:
+            return filepath in self._queue
+
+    def __len__(self):
+        with self._cond:
+            return len(self._queue)
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._cond.notify()
+
+    def add(self, filepath):
+        """
+        Queues a video, returns False if it is queued or transcoded already
+        """
+
+        with self._cond:
+            if filepath in self._queue or get_transcoded(filepath):
+                return False
+
+            self._queue.append(filepath)
+            self._save()
+
+        self.start()
+
+        return True
+
+    def _save(self):
+        try:
+            if not os.path.isdir(os.path.dirname(self.filepath)):
+                os.makedirs(os.path.dirname(self.filepath))
+
+            atomic_write(self.filepath, json.dumps(self._queue))
+        except (IOError, OSError) as e:
+            logger.error('Could not save the transcode queue: {}'.format(e))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+
+                filepath = self._queue[0]
+
+            # Nothing competes with the player
+            while processes.is_playing():
+                time.sleep(processes.JOB_POLL_INTERVAL)
+
+            info = get_video_info(filepath)
+
+            try:
+                if info and not get_transcoded(filepath):
+                    logger.info('Transcoding {}'.format(filepath))
+                    if transcode(filepath, info.get('duration')):
+                        logger.info('Transcoded {}'.format(filepath))
+            except (IOError, OSError) as e:
+                logger.error('Could not transcode {}: {}'.format(
+                    filepath, e))
+
+            with self._cond:
+                if filepath in self._queue:
+                    self._queue.remove(filepath)
+                self._save()
+                done = not self._queue
+
+            get_transcode_status().recheck(filepath)
+
+            # What was probed is saved once the queue is through
+            if done:
+                get_scan_index().save()
+
+
+class TranscodeStatus(object):
+    """
+    Whether each local video which was asked about needs transcoding, see
+    video_needs_transcode(). Finding out may stat the video and its
+    transcoded copy, so it is done on a background thread, and videos not
+    looked up yet are taken not to need it.
+
+    The listeners are called from the background thread with the paths
+    whose status changed, the UI has to take them back to the main loop.
+    """
+
+    def __init__(self):
+        super(TranscodeStatus, self).__init__()
+
+        self._cond = threading.Condition()
+        # path -> the video, waiting to be looked up
+        self._queue = {}
+        # path -> whether it needs transcoding
+        self._known = {}
+        self._listeners = []
+        self._thread = None
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def needs_transcode(self, video):
+        """
+        Whether a local video needs transcoding, as far as is known. Unknown
+        ones are looked up in the background.
+        """
+
+        localfile = video.get('local_path')
+        if not localfile:
+            return False
+
+        with self._cond:
+            needed = self._known.get(localfile)
+            if needed is None:
+                self._queue[localfile] = video
+                self._start()
+                self._cond.notify()
+                return False
+
+        return needed
+
+    def recheck(self, filepath):
+        """
+        Looks a video up again, e.g. once it is transcoded
+        """
+
+        with self._cond:
+            self._queue[filepath] = {'local_path': filepath}
+            self._start()
+            self._cond.notify()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+
+                filepath, video = self._queue.popitem()
+
+            needed = video_needs_transcode(video)
+
+            with self._cond:
+                # Taken not to need it until now, if unknown
+                changed = needed != self._known.get(filepath, False)
+                self._known[filepath] = needed
+
+            if changed:
+                self._notify([filepath])
+
+    def _notify(self, paths):
+        for callback in self._listeners:
+            try:
+                callback(paths)
+            except Exception as e:
+                logger.error('Transcode listener failed: {}'.format(e))
+
+
+_queue = None
+_status = None
+
+
+def get_transcode_queue():
+    global _queue
+
+    if _queue is None:
+        _queue = TranscodeQueue()
+
+    return _queue
+
+
+def get_transcode_status():
+    global _status
+
+    if _status is None:
+        _status = TranscodeStatus()
+
+    return _status
+
+
+def _on_playlist_change(name, kind, video):
+    if name == 'Library' and kind == 'add' and video.get('local_path') and \
+            needs_transcode(video):
+        get_transcode_queue().add(video['local_path'])
+
+
+def start_transcoding():
+    """
+    Carries on with the transcodes queued before, and with the
+    auto_transcode setting, queues the videos added to the library which
+    need one
+    """
+
+    from .playlist import add_listener
+
+    queue = get_transcode_queue()
+    if len(queue):
+        queue.start()
+
+    if get_setting('auto_transcode'):
+        add_listener(_on_playlist_change)
@@ -9,6 +9,7 @@
 #
 
 import os
+import urlparse
 from shutil import rmtree
 from kano.utils import requests_get_json, run_cmd
 from kano.logging import logger
@@ -33,6 +34,30 @@ except ImportError:
     pass
 
 
+def get_youtube_id(video_url):
+    """
+    Extracts the video id from the various forms of YouTube url,
+    e.g. watch?v=<id>, youtu.be/<id> or /v/<id>
+    """
+
+    if not video_url:
+        return None
+
+    parsed = urlparse.urlparse(video_url)
+
+    video_id = urlparse.parse_qs(parsed.query).get('v', [None])[0]
+    if video_id:
+        return video_id
+
+    path = [part for part in parsed.path.split('/') if part]
+    if parsed.netloc.endswith('youtu.be') and path:
+        return path[0]
+    if len(path) >= 2 and path[-2] in ('v', 'embed'):
+        return path[-1]
+
+    return None
+
+
 def page_to_index(page, max_results=10):
     return ((page - 1) * max_results) + 1
 
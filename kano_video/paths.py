@@ -33,3 +33,6 @@ media_dir = get_dir_path('media')
 image_dir = os.path.join(media_dir, 'images')
 css_dir = os.path.join(media_dir, 'CSS')
 icon_dir = get_dir_path('icon')
+
+# per-user state such as settings and caches
+user_dir = os.path.join(os.path.expanduser('~'), '.kano-video')
@@ -7,16 +7,26 @@
 #
 
 
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GObject
 import os
+import threading
 from shutil import rmtree
 
+from kano.logging import logger
+from kano.gtk3.kano_dialog import KanoDialog
+
 from kano_video.paths import image_dir
-from kano_video.logic.playlist import playlistCollection, \
+from kano_video.logic.playlist import Playlist, playlistCollection, \
     library_playlist
 from kano_video.logic.youtube import tmp_dir
-
-from .popup import LoadFilePopup, AddPlaylistPopup
+from kano_video.logic.speculation import discard
+from kano_video.logic.search import save_search_index
+from kano_video.logic.scanner import make_entry, scan_folder, \
+    get_video_info, get_scan_index
+from kano_video.logic.playlistfile import PLAYLIST_EXTENSIONS, \
+    IMPORT_ERRORS, read_playlist_file, import_playlist, export_playlist
+
+from .popup import LoadFilePopup, SaveFilePopup, AddPlaylistPopup
 from .general import KanoWidget, Spacer, Button
 
 
@@ -104,8 +114,12 @@ class MenuBar(Gtk.EventBox):
         if os.path.exists(tmp_dir):
             rmtree(tmp_dir)
 
+        discard()
+
         playlistCollection.save()
         library_playlist.save()
+        playlistCollection.store.flush()
+        save_search_index()
 
         Gtk.main_quit()
 
@@ -122,7 +136,7 @@ class SearchBar(KanoWidget):
         self._grid.set_column_spacing(10)
 
         search_keyword_entry = Gtk.Entry(hexpand=True)
-        search_keyword_entry.props.placeholder_text = 'Search YouTube'
+        search_keyword_entry.props.placeholder_text = 'Search'
         search_keyword_entry.set_alignment(0)
         search_keyword_entry.set_size_request(100, 20)
         search_keyword_entry.connect('activate', self.switch_to_youtube,
@@ -182,10 +196,20 @@ class AddVideoBar(HorizontalBar):
     """
 
     def __init__(self):
-        self.right_widget = Button('ADD MEDIA')
-        self.right_widget.get_style_context().add_class('green')
-        self.right_widget.set_size_request(20, 20)
-        self.right_widget.connect('clicked', self._add_handler)
+        self.right_widget = Gtk.Grid()
+        self.right_widget.set_column_spacing(10)
+
+        button = Button('ADD FOLDER')
+        button.get_style_context().add_class('green')
+        button.set_size_request(20, 20)
+        button.connect('clicked', self._add_folder_handler)
+        self.right_widget.attach(button, 0, 0, 1, 1)
+
+        button = Button('ADD MEDIA')
+        button.get_style_context().add_class('green')
+        button.set_size_request(20, 20)
+        button.connect('clicked', self._add_handler)
+        self.right_widget.attach(button, 1, 0, 1, 1)
 
         super(AddVideoBar, self).__init__()
 
@@ -193,26 +217,70 @@ class AddVideoBar(HorizontalBar):
         popup = LoadFilePopup(self.get_toplevel())
         fullpath = popup.run()
 
-        if fullpath and os.path.isfile(fullpath):
-            filename = os.path.basename(fullpath)
-            filename = os.path.splitext(filename)[0]
+        if not fullpath or not os.path.isfile(fullpath):
+            return
+
+        win = self.get_toplevel()
+        win.get_root_window().set_cursor(
+            Gdk.Cursor.new(Gdk.CursorType.WATCH))
 
-            title_str = filename if len(filename) <= 40 \
-                else filename[:37] + '...'
+        # ffprobe may take a while on a large file, keep the UI going
+        thread = threading.Thread(target=self._probe_file,
+                                  args=(win, fullpath))
+        thread.daemon = True
+        thread.start()
 
-            entry = {
-                'title': title_str,
-                'video_url': None,
-                'local_path': fullpath,
-                'thumbnail': None,
-                'big_thumb': None
-            }
+    def _probe_file(self, win, fullpath):
+        entry = make_entry(fullpath, get_video_info(fullpath))
+        get_scan_index().save()
+        GObject.idle_add(self._file_probed, win, entry)
 
-            library_playlist.add(entry)
+    def _file_probed(self, win, entry):
+        library_playlist.add(entry)
 
-            # Refresh
-            win = self.get_toplevel()
-            win.switch_view('library')
+        win.get_root_window().set_cursor(
+            Gdk.Cursor.new(Gdk.CursorType.ARROW))
+
+        # Refresh
+        win.switch_view('library')
+
+        return False
+
+    def _add_folder_handler(self, button):
+        win = self.get_toplevel()
+
+        popup = LoadFilePopup(win, folder=True)
+        dir_path = popup.run()
+
+        if not dir_path or not os.path.isdir(dir_path):
+            return
+
+        button.set_sensitive(False)
+        win.get_root_window().set_cursor(
+            Gdk.Cursor.new(Gdk.CursorType.WATCH))
+
+        # Probing a few hundred videos takes a while, keep the UI going
+        thread = threading.Thread(target=self._scan_folder,
+                                  args=(win, dir_path))
+        thread.daemon = True
+        thread.start()
+
+    def _scan_folder(self, win, dir_path):
+        entries = scan_folder(dir_path)
+        GObject.idle_add(self._folder_scanned, win, entries)
+
+    def _folder_scanned(self, win, entries):
+        added = library_playlist.add_many(entries)
+        library_playlist.save()
+
+        logger.info('Added {} of the {} videos found to the library'.format(
+            added, len(entries)))
+
+        win.get_root_window().set_cursor(
+            Gdk.Cursor.new(Gdk.CursorType.ARROW))
+        win.switch_view('library')
+
+        return False
 
 
 class PlayModeBar(HorizontalBar):
@@ -246,10 +314,20 @@ class PlaylistAddBar(HorizontalBar):
     """
 
     def __init__(self):
-        self.right_widget = Button('CREATE LIST')
-        self.right_widget.get_style_context().add_class('green')
-        self.right_widget.set_size_request(20, 20)
-        self.right_widget.connect('clicked', self._add_handler)
+        self.right_widget = Gtk.Grid()
+        self.right_widget.set_column_spacing(10)
+
+        button = Button('IMPORT')
+        button.get_style_context().add_class('green')
+        button.set_size_request(20, 20)
+        button.connect('clicked', self._import_handler)
+        self.right_widget.attach(button, 0, 0, 1, 1)
+
+        button = Button('CREATE LIST')
+        button.get_style_context().add_class('green')
+        button.set_size_request(20, 20)
+        button.connect('clicked', self._add_handler)
+        self.right_widget.attach(button, 1, 0, 1, 1)
 
         super(PlaylistAddBar, self).__init__()
 
@@ -259,3 +337,99 @@ class PlaylistAddBar(HorizontalBar):
         if res:
             win = self.get_toplevel()
             win.switch_view('playlist-collection')
+
+    def _import_handler(self, button):
+        win = self.get_toplevel()
+
+        popup = LoadFilePopup(win, extensions=PLAYLIST_EXTENSIONS,
+                              filter_name='Playlist files')
+        filepath = popup.run()
+
+        if not filepath or not os.path.isfile(filepath):
+            return
+
+        button.set_sensitive(False)
+        win.get_root_window().set_cursor(
+            Gdk.Cursor.new(Gdk.CursorType.WATCH))
+
+        # A playlist file may list thousands of videos, keep the UI going
+        thread = threading.Thread(target=self._read_file,
+                                  args=(win, button, filepath))
+        thread.daemon = True
+        thread.start()
+
+    def _read_file(self, win, button, filepath):
+        try:
+            videos = read_playlist_file(filepath)
+        except IMPORT_ERRORS as e:
+            logger.error('Could not import {}: {}'.format(filepath, e))
+            videos = None
+
+        GObject.idle_add(self._file_read, win, button, filepath, videos)
+
+    def _file_read(self, win, button, filepath, videos):
+        button.set_sensitive(True)
+        win.get_root_window().set_cursor(
+            Gdk.Cursor.new(Gdk.CursorType.ARROW))
+
+        if videos is None:
+            error = KanoDialog('Could not import the playlist',
+                               'The file "{}" could not be read'.format(
+                                   os.path.basename(filepath)),
+                               parent_window=win)
+            error.run()
+            return False
+
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        if name in ('Kano', 'Library'):
+            name = '{} (imported)'.format(name)
+
+        playlist = playlistCollection.collection.get(name)
+        if playlist is None:
+            playlist = Playlist.new(name)
+            playlistCollection.add(playlist)
+
+        import_playlist(videos, playlist)
+
+        win.switch_view('playlist', name)
+
+        return False
+
+
+class PlaylistExportBar(HorizontalBar):
+    """
+    A horizontal bar for saving a playlist to an M3U or XSPF file
+    """
+
+    def __init__(self, playlist):
+        self._playlist = playlist
+
+        self.right_widget = Button('EXPORT')
+        self.right_widget.get_style_context().add_class('green')
+        self.right_widget.set_size_request(20, 20)
+        self.right_widget.connect('clicked', self._export_handler)
+
+        super(PlaylistExportBar, self).__init__()
+
+    def _export_handler(self, button):
+        win = self.get_toplevel()
+
+        popup = SaveFilePopup(win, '{}.m3u'.format(self._playlist.name))
+        filepath = popup.run()
+
+        if not filepath:
+            return
+
+        ext = os.path.splitext(filepath)[1][1:].lower()
+        if ext not in PLAYLIST_EXTENSIONS:
+            filepath += '.m3u'
+
+        try:
+            export_playlist(self._playlist, filepath)
+        except (IOError, OSError) as e:
+            logger.error('Could not export {}: {}'.format(filepath, e))
+            error = KanoDialog('Could not export the playlist',
+                               'The file "{}" could not be written'.format(
+                                   os.path.basename(filepath)),
+                               parent_window=win)
+            error.run()
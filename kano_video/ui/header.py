@@ -116,3 +116,18 @@ class SearchResultsHeader(HeaderBar):
         super(SearchResultsHeader, self).__init__()
 
         self.get_style_context().add_class('search_results_bar')
+
+
+class LocalResultsHeader(HeaderBar):
+    """
+    Header bar for the saved videos matching a search
+    """
+
+    def __init__(self, search_keyword, result_count):
+        self._title = 'Your videos matching "{}"'.format(search_keyword)
+        self._count = result_count
+        self._item = '{} video'
+
+        super(LocalResultsHeader, self).__init__()
+
+        self.get_style_context().add_class('search_results_bar')
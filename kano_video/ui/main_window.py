@@ -9,18 +9,28 @@
 #
 
 import os
-from gi.repository import Gtk, Gdk
+import threading
+from gi.repository import Gtk, Gdk, GObject
 
+from kano.logging import logger
 from kano.network import is_internet
 from kano_video.logic.playlist import playlistCollection, \
     library_playlist
+from kano_video.logic.speculation import discard
+from kano_video.logic.search import search_local, save_search_index
+from kano_video.logic.transcode import start_transcoding, \
+    get_transcode_status
+from kano_video.logic.playlistwatch import PlaylistWatcher, POLL_INTERVAL
+from kano_video.logic.availability import get_path_validator, \
+    start_validating
 from kano.gtk3.application_window import ApplicationWindow
 
 from .general import Contents
 from .bar import MenuBar
 from .view import HomeView, LocalView, YoutubeView, \
     PlaylistView, PlaylistCollectionView, DetailView, \
-    NoInternetView
+    NoInternetView, LocalSearchView
+from .video import search_youtube
 from kano_video.paths import icon_dir
 
 
@@ -50,6 +60,22 @@ class MainWindow(ApplicationWindow):
         self.connect('delete-event', self.on_close)
         self.connect('show', self.on_show)
 
+        start_transcoding()
+
+        # Missing local videos are greyed out as they are found
+        get_path_validator().add_listener(self._on_videos_checked)
+        get_transcode_status().add_listener(self._on_videos_checked)
+        start_validating()
+
+        # Playlists saved by other processes are shown as they change
+        self._playlist_watcher = PlaylistWatcher()
+        fd = self._playlist_watcher.fileno()
+        if fd is not None:
+            GObject.io_add_watch(fd, GObject.IO_IN, self._on_playlists_changed)
+        else:
+            GObject.timeout_add_seconds(POLL_INTERVAL,
+                                        self._on_playlists_changed)
+
     def switch_view(self, view, playlist=None, search_keyword=None,
                     permanent=False, users=False, video=None, page=1):
         """
@@ -67,6 +93,10 @@ class MainWindow(ApplicationWindow):
             'previous': self.switch_to_previous
         }
 
+        # A player prespawned for the detail view is of no use elsewhere
+        if view != 'detail':
+            discard()
+
         if view is 'playlist':
             views[view](playlist)
         elif view is 'youtube':
@@ -102,21 +132,70 @@ class MainWindow(ApplicationWindow):
             self.prev_view.append(prev_view_)
 
     def switch_to_youtube(self, search_keyword=None, users=False, page=1):
-        if is_internet():
-            cursor = Gdk.Cursor.new(Gdk.CursorType.WATCH)
-            self.get_root_window().set_cursor(cursor)
-
-            Gtk.main_iteration_do(True)
+        local_results = []
+        if search_keyword and search_keyword.get_text() and \
+                users is False and page == 1:
+            local_results = search_local(search_keyword.get_text())
 
+        if local_results:
+            # Shown straight away, whether YouTube answers or not
             self.prev_view = []
 
-            self.view = YoutubeView(search_keyword, users, page=page)
+            self.view = LocalSearchView(search_keyword.get_text(),
+                                        local_results)
             self.contents.set_contents(self.view)
 
-            cursor = Gdk.Cursor.new(Gdk.CursorType.ARROW)
-            self.get_root_window().set_cursor(cursor)
-        else:
-            self.switch_view('no-internet')
+        if not is_internet():
+            if not local_results:
+                self.switch_view('no-internet')
+            return
+
+        cursor = Gdk.Cursor.new(Gdk.CursorType.WATCH)
+        self.get_root_window().set_cursor(cursor)
+
+        text = search_keyword.get_text() if search_keyword else None
+        query = {'page': page}
+        if text and users is False:
+            query['keyword'] = text
+        elif text:
+            query['username'] = text
+
+        # The results replace the view only if it is still the one shown
+        # now, the user may have moved on while waiting
+        thread = threading.Thread(
+            target=self._search_youtube,
+            args=(self.view, query, search_keyword, users, page,
+                  local_results))
+        thread.daemon = True
+        thread.start()
+
+    def _search_youtube(self, view, query, search_keyword, users, page,
+                        local_results):
+        try:
+            entries = search_youtube(**query)
+        except Exception as e:
+            logger.error('Could not search YouTube: {}'.format(e))
+            entries = None
+
+        GObject.idle_add(self._youtube_searched, view, entries,
+                         search_keyword, users, page, local_results)
+
+    def _youtube_searched(self, view, entries, search_keyword, users, page,
+                          local_results):
+        cursor = Gdk.Cursor.new(Gdk.CursorType.ARROW)
+        self.get_root_window().set_cursor(cursor)
+
+        if self.view is not view:
+            return False
+
+        self.prev_view = []
+
+        self.view = YoutubeView(search_keyword, users, page=page,
+                                local_results=local_results,
+                                entries=entries or [])
+        self.contents.set_contents(self.view)
+
+        return False
 
     def switch_to_local(self):
         self.prev_view = []
@@ -147,9 +226,36 @@ class MainWindow(ApplicationWindow):
 
             self.contents.set_contents(self.view)
 
+    def _on_playlists_changed(self, *_):
+        names = self._playlist_watcher.check()
+
+        view = self.view
+        if names and hasattr(view, 'shows') and view.shows(names):
+            if isinstance(view, PlaylistView) and \
+                    view.playlist_name not in playlistCollection.collection:
+                # Deleted by another process
+                self.switch_view('playlist-collection')
+            else:
+                view.reload()
+
+        return True
+
+    def _on_videos_checked(self, paths):
+        # Called from the validator's or the transcode status' thread
+        GObject.idle_add(self._refresh_local_videos, paths)
+
+    def _refresh_local_videos(self, paths):
+        self.view.update_availability(paths)
+
+        return False
+
     def on_close(self, widget=None, event=None):
+        discard()
+
         playlistCollection.save()
         library_playlist.save()
+        playlistCollection.store.flush()
+        save_search_index()
 
         Gtk.main_quit()
 
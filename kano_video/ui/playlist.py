@@ -40,7 +40,7 @@ class PlaylistEntry(Gtk.Button):
         title.get_style_context().add_class('title')
         button_grid.attach(title, 0, 0, 1, 1)
 
-        count = len(playlistCollection.collection[name].playlist)
+        count = playlistCollection.collection[name].count
         item = 'video'
         if count is not 1:
             item = '{}s'.format(item)
@@ -13,6 +13,7 @@ from gi.repository import Gtk
 from kano.gtk3.kano_dialog import KanoDialog
 from kano.gtk3.kano_combobox import KanoComboBox
 from kano_video.logic.playlist import Playlist, playlistCollection
+from kano_video.logic.scanner import VIDEO_EXTENSIONS
 
 from .general import TopBar, Button
 
@@ -181,35 +182,29 @@ class AddPlaylistPopup(PlaylistPopup):
 
 class LoadFilePopup(Gtk.FileChooserDialog):
     """
-    A file selection dialog
+    A file selection dialog, or a folder one
     """
 
-    def __init__(self, main=None):
+    def __init__(self, main=None, folder=False, extensions=VIDEO_EXTENSIONS,
+                 filter_name="Video files"):
+        action = Gtk.FileChooserAction.SELECT_FOLDER if folder \
+            else Gtk.FileChooserAction.OPEN
+
         super(LoadFilePopup, self).__init__(
-            "Please select a folder", self, Gtk.FileChooserAction.OPEN,
+            "Please select a folder", self, action,
             (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OPEN, Gtk.ResponseType.OK))
 
         self._main_win = main
 
-        # Set up file filters
-        filter_text = Gtk.FileFilter()
-        filter_text.set_name("Video files")
-
-        file_extensions = [
-            'mkv',
-            'm4v',
-            'mp4',
-            'avi',
-            'flv',
-            'mov',
-            'ogg',
-            'wmv'
-        ]
+        if not folder:
+            # Set up file filters
+            filter_text = Gtk.FileFilter()
+            filter_text.set_name(filter_name)
 
-        for ext in file_extensions:
-            filter_text.add_pattern('*.{}'.format(ext))
+            for ext in extensions:
+                filter_text.add_pattern('*.{}'.format(ext))
 
-        self.add_filter(filter_text)
+            self.add_filter(filter_text)
 
         self.set_current_folder(os.path.expanduser('~'))
 
@@ -225,3 +220,34 @@ class LoadFilePopup(Gtk.FileChooserDialog):
         self.destroy()
 
         return dir_path
+
+
+class SaveFilePopup(Gtk.FileChooserDialog):
+    """
+    A dialog for picking where to save a file
+    """
+
+    def __init__(self, main=None, filename=None):
+        super(SaveFilePopup, self).__init__(
+            "Please select where to save", self, Gtk.FileChooserAction.SAVE,
+            (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_SAVE, Gtk.ResponseType.OK))
+
+        self._main_win = main
+
+        self.set_do_overwrite_confirmation(True)
+        self.set_current_folder(os.path.expanduser('~'))
+        if filename:
+            self.set_current_name(filename)
+
+    def run(self):
+        self._main_win.blur()
+        response = super(SaveFilePopup, self).run()
+        self._main_win.unblur()
+
+        filepath = None
+        if response == Gtk.ResponseType.OK:
+            filepath = self.get_filename()
+
+        self.destroy()
+
+        return filepath
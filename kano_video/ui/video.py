@@ -5,7 +5,7 @@
 #
 #
 
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GObject
 from time import time
 from random import randint
 
@@ -14,12 +14,16 @@ from kano.gtk3.kano_dialog import KanoDialog
 from kano.utils import download_url
 
 from kano_video.paths import image_dir
-from kano_video.logic.player import play_video
+from kano_video.logic.session import play_video_async
 from kano_video.logic.youtube import search_youtube_by_user, \
     parse_youtube_entries, search_youtube_by_keyword, tmp_dir, \
     page_to_index
 from kano_video.logic.playlist import playlistCollection, \
     library_playlist
+from kano_video.logic.thumbnails import get_thumbnail_generator
+from kano_video.logic.transcode import get_transcode_status, \
+    get_transcode_queue
+from kano_video.logic.availability import get_path_validator
 
 from .popup import AddToPlaylistPopup
 from .general import Spacer, RemoveButton, Button
@@ -27,119 +31,318 @@ from .general import Spacer, RemoveButton, Button
 
 def popup_video(button, url, localfile):
     '''
-    Starts the actual video play on top of the app, synchronously.
+    Starts the actual video play on top of the app, leaving the main loop
+    running. The button is enabled back again once the video is over.
     '''
-    play_video(button, url, localfile, subtitles=None, init_threads=False, keyboard_engulfer=True)
+    session = play_video_async(url, localfile, subtitles=None, keyboard_engulfer=True)
+    session.connect('ended', _enable_button, button)
+    session.connect('error', _enable_button, button)
+
+    if localfile:
+        # The file may have gone since it was last checked
+        session.connect('error', _recheck_file, localfile)
+
+    return session
+
+
+def _recheck_file(_session, _result, localfile):
+    get_path_validator().recheck(localfile)
+
+
+def _enable_button(_session, _result, button):
+    if button:
+        button.set_sensitive(True)
+
+
+def _restore_cursor(_session, *args):
+    widget = args[-1]
+    cursor = Gdk.Cursor.new(Gdk.CursorType.ARROW)
+    widget.get_root_window().set_cursor(cursor)
+
+
+def get_parental_control():
+    """
+    Whether parental control is on in kano-settings, off if it cannot be
+    told
+    """
+
+    try:
+        from kano_settings.set_advance.parental import get_parental_enabled
+        return bool(get_parental_enabled())
+    except Exception:
+        return False
+
+
+def search_youtube(keyword=None, username=None, playlist=None, page=1):
+    """
+    The parsed entries of a YouTube search, or listing, None if there are
+    none. Waits for the network, so better called off the main loop.
+    """
+
+    parent_control = get_parental_control()
+    start_index = page_to_index(page)
+
+    if keyword:
+        entries = search_youtube_by_keyword(
+            keyword, start_index=start_index,
+            parent_control=parent_control)
+        logger.info('searching by keyword: ' + keyword)
+    elif username:
+        entries = search_youtube_by_user(
+            username, parent_control=parent_control)
+        logger.info('listing by username: ' + username)
+    elif playlist:
+        entries = playlist
+        logger.info('listing playlist: ' + playlist)
+    else:
+        entries = search_youtube_by_user(
+            'KanoComputing', parent_control=parent_control)
+        logger.info('listing default videos by KanoComputing')
+
+    if not entries:
+        return None
+
+    return parse_youtube_entries(entries)
+
+
+def set_youtube_thumbnail(img, url):
+    """
+    Shows the thumbnail of a YouTube video, which is downloaded in the
+    background the first time
+    """
+
+    clear_thumbnail(img)
+
+    img.thumbnail_for = url
+    img.set_from_file('{}/icons/no_thumbnail.png'.format(image_dir))
+
+    get_thumbnail_generator().request_download(url,
+                                               _get_thumbnail_callback(img))
+
+
+def set_local_thumbnail(img, video):
+    """
+    Shows the thumbnail of a local video. It is looked up, and made the
+    first time, in the background: nothing is stat'ed here.
+    """
+
+    clear_thumbnail(img)
+    img.set_from_file('{}/icons/no_thumbnail.png'.format(image_dir))
+
+    localfile = video['local_path']
+    # Not worth a stat, the drive of a missing video may hang
+    if not get_path_validator().is_available(localfile):
+        return
+
+    # The image may show another video by the time the thumbnail is made
+    img.thumbnail_for = localfile
+
+    get_thumbnail_generator().request(localfile, _get_thumbnail_callback(img),
+                                      video.get('duration'))
+
+
+def clear_thumbnail(img):
+    """
+    Takes back the thumbnail an image is waiting for, e.g. before it shows
+    another video
+    """
+
+    video = getattr(img, 'thumbnail_for', None)
+    if video:
+        get_thumbnail_generator().cancel(video, _get_thumbnail_callback(img))
+
+    img.thumbnail_for = None
+
+
+def _get_thumbnail_callback(img):
+    # The same one every time, so it is only queued once per image
+    callback = getattr(img, 'thumbnail_callback', None)
+    if callback is None:
+        def callback(video, thumbnail):
+            GObject.idle_add(_set_thumbnail, img, video, thumbnail)
+
+        img.thumbnail_callback = callback
+
+    return callback
+
+
+def _set_thumbnail(img, video, thumbnail):
+    if getattr(img, 'thumbnail_for', None) == video:
+        img.set_from_file(thumbnail)
 
 
 class VideoEntry(Gtk.Button):
     """
     A widget to display an individual video
+
+    The widgets are made once, bind() shows a video in them, so that a
+    list can reuse its entries for other videos as it scrolls.
     """
     _ENTRY_HEIGHT = 110
     _TITLE_HEIGHT = 20
     _DESC_HEIGHT = 15
     _INFO_HEIGHT = 15
 
-    def __init__(self, e, playlist_name=None, permanent=False):
+    def __init__(self, e=None, playlist_name=None, permanent=False):
         super(VideoEntry, self).__init__(hexpand=True)
 
         self._playlist_name = playlist_name
         self._permanent = permanent
+        self._video = None
 
         self.get_style_context().add_class('entry_item')
 
-        self.connect('clicked', self._detail_view_handler, e)
+        self.connect('clicked', self._detail_view_handler)
 
         button_grid = Gtk.Grid()
         button_grid.set_column_spacing(30)
         self.add(button_grid)
 
-        img = Gtk.Image()
+        self._img = Gtk.Image()
+        self._img.set_size_request(self._ENTRY_HEIGHT, self._ENTRY_HEIGHT)
+        self._img.get_style_context().add_class('thumb')
+        button_grid.attach(self._img, 0, 0, 1, 4)
 
-        if e['thumbnail']:
-            thumbnail = '{}/video_{}.jpg'.format(tmp_dir, time())
-            download_url(e['thumbnail'], thumbnail)
-            img.set_from_file(thumbnail)
-        else:
-            img.set_from_file('{}/icons/no_thumbnail.png'.format(image_dir))
-
-        img.set_size_request(self._ENTRY_HEIGHT, self._ENTRY_HEIGHT)
-        img.get_style_context().add_class('thumb')
-        button_grid.attach(img, 0, 0, 1, 4)
-
-        title_str = e['title'] if len(e['title']) <= 70 else e['title'][:67] + '...'
-        label = Gtk.Label(title_str, hexpand=True)
-        label.set_alignment(0, 0.5)
-        label.get_style_context().add_class('title')
-        button_grid.attach(label, 1, 0, 1, 1)
+        self._title = Gtk.Label(hexpand=True)
+        self._title.set_alignment(0, 0.5)
+        self._title.get_style_context().add_class('title')
+        button_grid.attach(self._title, 1, 0, 1, 1)
 
         if playlist_name and not permanent:
             remove = RemoveButton()
-            remove.connect('clicked', self._remove_from_playlist_handler, e, playlist_name)
+            remove.connect('clicked', self._remove_from_playlist_handler)
             button_grid.attach(remove, 2, 0, 1, 1)
 
-        if e['local_path'] is None:
-            stats_str = '{}K views - {}:{} min - by {}'.format(int(e['viewcount'] / 1000.0), e['duration_min'],
-                                                               e['duration_sec'], e['author'])
-            label = Gtk.Label(stats_str)
-            label.get_style_context().add_class('subtitle')
-            label.set_alignment(0, 0.5)
-            button_grid.attach(label, 1, 1, 2, 1)
+        # The stats of YouTube videos, or a note on local ones
+        self._info = Gtk.Label()
+        self._info.get_style_context().add_class('subtitle')
+        self._info.set_alignment(0, 0.5)
+        button_grid.attach(self._info, 1, 1, 2, 1)
 
-            desc_str = e['description'] if len(e['description']) <= 100 else e['description'][:97] + '...'
-            label = Gtk.Label(desc_str)
-            label.get_style_context().add_class('subtitle')
-            label.set_alignment(0, 0.5)
-            button_grid.attach(label, 1, 2, 2, 1)
+        self._desc = Gtk.Label()
+        self._desc.get_style_context().add_class('subtitle')
+        self._desc.set_alignment(0, 0.5)
+        button_grid.attach(self._desc, 1, 2, 2, 1)
 
         action_grid = Gtk.Grid()
         button_grid.attach(action_grid, 1, 3, 2, 1)
 
-        button = Button('WATCH')
-        button.get_style_context().add_class('orange_linktext')
-        self._button_handler_id = button.connect('clicked', self._play_handler, e['video_url'], e['local_path'])
-        action_grid.attach(button, 0, 0, 1, 1)
+        self._watch = Button('WATCH')
+        self._watch.get_style_context().add_class('orange_linktext')
+        self._button_handler_id = self._watch.connect('clicked', self._play_handler)
+        action_grid.attach(self._watch, 0, 0, 1, 1)
 
         if not playlist_name:
             action_grid.attach(Spacer(), 1, 0, 1, 1)
 
             button = Button('SAVE')
             button.get_style_context().add_class('orange_linktext')
-            self._button_handler_id = button.connect('clicked', self.add_to_playlist_handler, e)
+            self._button_handler_id = button.connect('clicked', self.add_to_playlist_handler)
             action_grid.attach(button, 2, 0, 1, 1)
 
-    def _play_handler(self, _button, _url, _localfile):
+        # Only shown for the videos which need transcoding
+        self._convert_spacer = Spacer()
+        action_grid.attach(self._convert_spacer, 3, 0, 1, 1)
+
+        self._convert = Button('CONVERT')
+        self._convert.get_style_context().add_class('orange_linktext')
+        self._convert.connect('clicked', self._convert_handler)
+        action_grid.attach(self._convert, 4, 0, 1, 1)
+
+        if e is not None:
+            self.bind(e)
+
+    def bind(self, e):
+        """
+        Shows a video in the entry, in place of the one it showed
+        """
+
+        self._video = e
+
+        if e['thumbnail']:
+            set_youtube_thumbnail(self._img, e['thumbnail'])
+        elif e['local_path']:
+            set_local_thumbnail(self._img, e)
+        else:
+            clear_thumbnail(self._img)
+            self._img.set_from_file('{}/icons/no_thumbnail.png'.format(image_dir))
+
+        title_str = e['title'] if len(e['title']) <= 70 else e['title'][:67] + '...'
+        self._title.set_text(title_str)
+
+        available = not e['local_path'] or \
+            get_path_validator().is_available(e['local_path'])
+        needs_transcode = available and \
+            get_transcode_status().needs_transcode(e)
+
+        if available:
+            self.get_style_context().remove_class('unavailable')
+        else:
+            self.get_style_context().add_class('unavailable')
+
+        if e['local_path'] is None:
+            stats_str = '{}K views - {}:{} min - by {}'.format(int(e['viewcount'] / 1000.0), e['duration_min'],
+                                                               e['duration_sec'], e['author'])
+            self._info.set_text(stats_str)
+
+            desc_str = e['description'] if len(e['description']) <= 100 else e['description'][:97] + '...'
+            self._desc.set_text(desc_str)
+        else:
+            if not available:
+                self._info.set_text('This video cannot be found')
+            elif needs_transcode:
+                self._info.set_text('This video may not play smoothly')
+            else:
+                self._info.set_text('')
+
+            self._desc.set_text('')
+
+        self._watch.set_sensitive(available)
+
+        self._convert_spacer.set_child_visible(needs_transcode)
+        self._convert.set_child_visible(needs_transcode)
+        if needs_transcode:
+            converting = e['local_path'] in get_transcode_queue()
+            self._convert.set_label('CONVERTING' if converting else 'CONVERT')
+            self._convert.set_sensitive(not converting)
+
+    def _convert_handler(self, button):
+        get_transcode_queue().add(self._video['local_path'])
+
+        button.set_label('CONVERTING')
+        button.set_sensitive(False)
+
+    def _play_handler(self, _button):
         cursor = Gdk.Cursor.new(Gdk.CursorType.WATCH)
         self.get_root_window().set_cursor(cursor)
 
         # disable the button so it is not triggered while the video is playing
         _button.set_sensitive(False)
 
-        popup_video(_button, _url, _localfile)
+        session = popup_video(_button, self._video['video_url'], self._video['local_path'])
+        session.connect('started', _restore_cursor, self)
+        session.connect('error', _restore_cursor, self)
 
-        cursor = Gdk.Cursor.new(Gdk.CursorType.ARROW)
-        self.get_root_window().set_cursor(cursor)
-
-    def add_to_playlist_handler(self, _, video):
-        popup = AddToPlaylistPopup(video, self.get_toplevel())
+    def add_to_playlist_handler(self, _):
+        popup = AddToPlaylistPopup(self._video, self.get_toplevel())
         popup.run()
 
-    def _remove_from_playlist_handler(self, _button, video, name):
+    def _remove_from_playlist_handler(self, _button):
+        name = self._playlist_name
         confirm = KanoDialog('Are you sure?',
                              'You are about to delete this video from the playlist called "{}"'.format(name),
                              {'OK': {'return_value': True}, 'CANCEL': {'return_value': False}},
                              parent_window=self.get_toplevel())
         response = confirm.run()
         if response:
-            playlistCollection.collection[name].remove(video)
+            playlistCollection.collection[name].remove(self._video)
 
             win = self.get_toplevel()
             win.switch_view('playlist', name)
 
-    def _detail_view_handler(self, _, video):
+    def _detail_view_handler(self, _):
         win = self.get_toplevel()
-        win.switch_view('detail', video=video,
+        win.switch_view('detail', video=self._video,
                         playlist=self._playlist_name,
                         permanent=self._permanent)
 
@@ -168,6 +371,8 @@ class VideoDetailEntry(Gtk.Button):
             big_thumb = '{}/video_large_{}.jpg'.format(tmp_dir, time())
             download_url(e['big_thumb'], big_thumb)
             img.set_from_file(big_thumb)
+        elif e['local_path'] and not e['thumbnail']:
+            set_local_thumbnail(img, e)
         else:
             img.set_from_file('{}/icons/no_thumbnail.png'.format(image_dir))
 
@@ -211,6 +416,9 @@ class VideoDetailEntry(Gtk.Button):
         button = Button('WATCH')
         button.get_style_context().add_class('orange_linktext')
         self._button_handler_id = button.connect('clicked', self._play_handler, e['video_url'], e['local_path'])
+        if e['local_path'] and \
+                not get_path_validator().is_available(e['local_path']):
+            button.set_sensitive(False)
         action_grid.attach(button, 0, 0, 1, 1)
 
         if not playlist_name:
@@ -228,10 +436,9 @@ class VideoDetailEntry(Gtk.Button):
         # disable the button so it is not triggered while the video is playing
         _button.set_sensitive(False)
 
-        popup_video(_button, _url, _localfile)
-
-        cursor = Gdk.Cursor.new(Gdk.CursorType.ARROW)
-        self.get_root_window().set_cursor(cursor)
+        session = popup_video(_button, _url, _localfile)
+        session.connect('started', _restore_cursor, self)
+        session.connect('error', _restore_cursor, self)
 
     def add_to_playlist_handler(self, _, video):
         popup = AddToPlaylistPopup(video, self.get_toplevel())
@@ -253,25 +460,32 @@ class VideoDetailEntry(Gtk.Button):
 class VideoList(Gtk.EventBox):
     """
     A list of a collection of videos
+
+    Entries are only made for the videos in view in the scrolled window the
+    list is in, and a few around them. As the list scrolls, the entries
+    which leave the view are given the videos coming into it, and spacers
+    take the place of the others: however many videos there are, only a
+    screenful of entries is ever made.
     """
 
+    _ROW_SPACING = 10
+    # Entries kept on each side of the view, so they are ready to scroll to
+    _OVERSCAN = 2
+    # Shown until the list knows where it is, e.g. outside a scrolled window
+    _INITIAL_ROWS = 10
+
     def __init__(self, videos=None, playlist=None, permanent=False):
         super(VideoList, self).__init__(hexpand=True)
 
-        # Try to get parental boolean flag from kano-settings
-        # By default we assume parental control is turned OFF
-        self.ParentalControl = False
-        try:
-            from kano_settings.set_advance.parental import get_parental_enabled
-            if get_parental_enabled():
-                self.ParentalControl = True
-        except Exception:
-            pass
+        self._playlist_name = playlist
+        self._permanent = permanent
+
+        self.ParentalControl = get_parental_control()
 
         self.get_style_context().add_class('video_list')
 
         self._grid = Gtk.Grid()
-        self._grid.set_row_spacing(10)
+        self._grid.set_row_spacing(self._ROW_SPACING)
         self._grid.set_column_spacing(0)
 
         self.add(self._grid)
@@ -279,12 +493,181 @@ class VideoList(Gtk.EventBox):
         self._no_results = Gtk.Label('No results to display')
         self._no_results.get_style_context().add_class('subtitle')
 
+        self._box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self._top = Gtk.Box()
+        self._bottom = Gtk.Box()
+        self._box.pack_start(self._top, False, False, 0)
+        self._box.pack_start(self._bottom, False, False, 0)
+
+        self._videos = []
+        # index -> the entry showing that video
+        self._rows = {}
+        # Entries out of view, waiting for a video to show
+        self._pool = []
+        self._range = None
+        self._row_height = VideoEntry._ENTRY_HEIGHT + self._ROW_SPACING
+
+        self._adjustment = None
+        self._adjustment_handlers = []
+        self._update_id = None
+
+        self.connect('map', self._on_map)
+        self.connect('unmap', self._on_unmap)
+
         if videos is not None:
-            i = 0
-            for v in videos:
-                entry = VideoEntry(v, playlist_name=playlist, permanent=permanent)
-                self._grid.attach(entry, 0, i, 1, 1)
-                i += 1
+            self.set_videos(videos)
+
+    def set_videos(self, videos):
+        """
+        Shows these videos in place of the ones listed
+        """
+
+        for child in self._grid.get_children():
+            self._grid.remove(child)
+
+        for row in self._rows.itervalues():
+            self._box.remove(row)
+            self._pool.append(row)
+        self._rows = {}
+        self._range = None
+
+        self._videos = list(videos)
+
+        if self._videos:
+            self._grid.attach(self._box, 0, 0, 1, 1)
+            self._update()
+        else:
+            self._grid.attach(self._no_results, 0, 0, 1, 1)
+
+    def update_availability(self, paths):
+        """
+        Binds again the entries showing videos among paths, whose
+        availability or transcode status changed
+        """
+
+        for index, row in self._rows.iteritems():
+            if self._videos[index]['local_path'] in paths:
+                row.bind(self._videos[index])
+
+    def _on_map(self, _widget):
+        scrolled = self.get_ancestor(Gtk.ScrolledWindow)
+        if scrolled is not None:
+            self._adjustment = scrolled.get_vadjustment()
+            self._adjustment_handlers = [
+                self._adjustment.connect('value-changed',
+                                         self._queue_update),
+                self._adjustment.connect('changed', self._queue_update)
+            ]
+
+        self._queue_update()
+
+    def _on_unmap(self, _widget):
+        for handler in self._adjustment_handlers:
+            self._adjustment.disconnect(handler)
+        self._adjustment_handlers = []
+        self._adjustment = None
+
+        if self._update_id is not None:
+            GObject.source_remove(self._update_id)
+            self._update_id = None
+
+    def _queue_update(self, *_):
+        if self._update_id is None:
+            self._update_id = GObject.idle_add(self._on_update)
+
+    def _on_update(self):
+        self._update_id = None
+        self._update()
+
+        return False
+
+    def _get_offset(self):
+        """
+        Where the list starts in the contents of the scrolled window, None
+        if it is not laid out yet
+        """
+
+        contents = self._adjustment and \
+            self.get_ancestor(Gtk.ScrolledWindow).get_child()
+        if isinstance(contents, Gtk.Viewport):
+            contents = contents.get_child()
+        if contents is None or self.get_allocated_height() <= 1:
+            return None
+
+        coords = self.translate_coordinates(contents, 0, 0)
+        if not coords or not coords[0]:
+            return None
+
+        return coords[-1]
+
+    def _get_range(self):
+        """
+        The indexes of the first video to show and of the one after the last
+        """
+
+        count = len(self._videos)
+        offset = self._get_offset()
+        if offset is None:
+            return 0, min(count, self._INITIAL_ROWS)
+
+        top = self._adjustment.get_value() - offset
+        bottom = top + self._adjustment.get_page_size()
+
+        first = int(top // self._row_height) - self._OVERSCAN
+        last = int(bottom // self._row_height) + 1 + self._OVERSCAN
+
+        last = min(last, count)
+
+        return max(min(first, last), 0), max(last, 0)
+
+    def _make_row(self):
+        row = VideoEntry(playlist_name=self._playlist_name,
+                         permanent=self._permanent)
+        row.props.margin_bottom = self._ROW_SPACING
+        row.connect('size-allocate', self._on_row_allocated)
+        row.show_all()
+
+        return row
+
+    def _on_row_allocated(self, row, allocation):
+        # All the entries are as tall, the estimate is corrected once
+        height = allocation.height + self._ROW_SPACING
+        if allocation.height > 1 and height != self._row_height:
+            self._row_height = height
+            self._queue_update()
+
+    def _update(self):
+        """
+        Gives entries to the videos in view, takes them from those which are
+        not anymore
+        """
+
+        first, last = self._get_range()
+        if (first, last, self._row_height) == self._range:
+            return
+        self._range = (first, last, self._row_height)
+
+        for index in self._rows.keys():
+            if not first <= index < last:
+                row = self._rows.pop(index)
+                self._box.remove(row)
+                self._pool.append(row)
+
+        for position, index in enumerate(xrange(first, last)):
+            row = self._rows.get(index)
+            if row is None:
+                row = self._pool.pop() if self._pool else self._make_row()
+                row.bind(self._videos[index])
+                self._rows[index] = row
+                self._box.pack_start(row, False, False, 0)
+
+            self._box.reorder_child(row, position + 1)
+
+        self._box.reorder_child(self._bottom, -1)
+
+        self._top.set_size_request(-1, first * self._row_height)
+        self._bottom.set_size_request(
+            -1, (len(self._videos) - last) * self._row_height)
 
 
 class VideoListLocal(VideoList):
@@ -297,59 +680,36 @@ class VideoListLocal(VideoList):
 
         self.get_style_context().add_class('video_list_local')
 
-        if library_playlist.playlist:
-            for i, e in enumerate(library_playlist.playlist):
-                entry = VideoEntry(e)
-                self._grid.attach(entry, 0, i + 1, 1, 1)
-        else:
-            self._grid.attach(self._no_results, 0, 0, 1, 1)
+        self.set_videos(library_playlist.playlist)
 
 
 class VideoListYoutube(VideoList):
     """
     A video collection list used for videos on YouTube
+
+    Given the entries of a search made already, see search_youtube(), it
+    does not wait for the network.
     """
 
-    def __init__(self, keyword=None, username=None, playlist=None, page=1):
+    def __init__(self, keyword=None, username=None, playlist=None, page=1,
+                 entries=None):
         super(VideoListYoutube, self).__init__()
 
         self.get_style_context().add_class('video_list_youtube')
 
-        start_index = page_to_index(page)
-        entries = None
-        self._parsed_entries = None
-
-        if keyword:
-            entries = search_youtube_by_keyword(
-                keyword, start_index=start_index,
-                parent_control=self.ParentalControl)
-            logger.info('searching by keyword: ' + keyword)
-        elif username:
-            entries = search_youtube_by_user(
-                username, parent_control=self.ParentalControl)
-            logger.info('listing by username: ' + username)
-        elif playlist:
-            entries = playlist
-            logger.info('listing playlist: ' + playlist)
-        else:
-            entries = search_youtube_by_user(
-                'KanoComputing', parent_control=self.ParentalControl)
-            logger.info('listing default videos by KanoComputing')
+        if entries is None:
+            entries = search_youtube(keyword, username, playlist, page)
 
-        if entries:
-            self._parsed_entries = parse_youtube_entries(entries)
-        else:
-            self._grid.attach(self._no_results, 0, 0, 1, 1)
+        self._parsed_entries = entries
 
         self.refresh()
 
     def refresh(self):
         if self._parsed_entries:
-            for i, e in enumerate(self._parsed_entries):
+            for e in self._parsed_entries:
                 e['local_path'] = None
 
-                entry = VideoEntry(e)
-                self._grid.attach(entry, 0, i, 1, 1)
+        self.set_videos(self._parsed_entries or [])
 
 
 class VideoListPopular(VideoList):
@@ -11,12 +11,13 @@ from gi.repository import Gtk
 
 from kano_video.logic.playlist import playlistCollection
 from kano_video.logic.youtube import page_to_index, get_last_search_count
+from kano_video.logic.speculation import prespawn
 
-from .header import SearchResultsHeader, \
+from .header import SearchResultsHeader, LocalResultsHeader, \
     LibraryHeader, PlaylistHeader, \
     PlaylistCollectionHeader, YoutubeHeader
 from .bar import AddVideoBar, PlayModeBar, \
-    PlaylistAddBar
+    PlaylistAddBar, PlaylistExportBar
 from .video import VideoList, VideoListLocal, \
     VideoListYoutube, VideoListPopular, \
     VideoDetailEntry
@@ -45,6 +46,32 @@ class View(Gtk.EventBox):
 
         self.add(align)
 
+    def shows(self, names):
+        """
+        Whether the view shows any of the playlists named
+        """
+
+        return False
+
+    def update_availability(self, paths):
+        """
+        Shows again the local videos among paths, which were found or went
+        missing, or found to need transcoding or not anymore
+        """
+
+        pass
+
+    def reload(self):
+        """
+        Builds the view again, e.g. after its playlists changed
+        """
+
+        for child in self._grid.get_children():
+            self._grid.remove(child)
+
+        self.refresh()
+        self.show_all()
+
 
 class LocalView(View):
     """
@@ -70,34 +97,48 @@ class LocalView(View):
         self._list = VideoListLocal()
         self._grid.attach(self._list, 0, 3, 1, 1)
 
+    def shows(self, names):
+        return 'Library' in names
+
+    def update_availability(self, paths):
+        self._list.update_availability(paths)
+
 
 class YoutubeView(View):
     """
-    The view for browsing videos from YouTube
+    The view for browsing videos from YouTube, below the saved videos
+    matching the search if any
+
+    Given entries, those of the search made already, it does not wait for
+    the network.
     """
 
-    def __init__(self, search_keyword=None, users=False, page=1):
+    def __init__(self, search_keyword=None, users=False, page=1,
+                 local_results=None, entries=None):
         super(YoutubeView, self).__init__()
 
+        self._local_list = None
+
         if search_keyword and search_keyword.get_text():
             index = page_to_index(page)
 
             if users is False:
                 self._list = VideoListYoutube(
-                    keyword=search_keyword.get_text(), page=page)
+                    keyword=search_keyword.get_text(), page=page,
+                    entries=entries)
             else:
                 self._list = VideoListYoutube(
-                    username=search_keyword.get_text())
+                    username=search_keyword.get_text(), entries=entries)
 
             self._header = SearchResultsHeader(
                 search_keyword.get_text(), get_last_search_count(), start=index)
         else:
             self._header = YoutubeHeader()
-            self._list = VideoListYoutube(page=page)
+            self._list = VideoListYoutube(page=page, entries=entries)
 
         if search_keyword and search_keyword.get_text() is not '':
             navigation_grid = Gtk.Grid()
-            self._grid.attach(navigation_grid, 0, 3, 1, 1)
+            self._grid.attach(navigation_grid, 0, 4, 1, 1)
 
             prev_button = Gtk.Button('Back')
             prev_button.get_style_context().add_class('green')
@@ -115,19 +156,50 @@ class YoutubeView(View):
                                 page + 1, search_keyword)
             navigation_grid.attach(next_button, 2, 0, 1, 1)
 
+        # Found first, shown first
+        if local_results:
+            self._grid.attach(LocalResultsHeader(search_keyword.get_text(),
+                                                 len(local_results)),
+                              0, 0, 1, 1)
+            self._local_list = VideoList(videos=local_results)
+            self._grid.attach(self._local_list, 0, 1, 1, 1)
+
         self.refresh()
 
     def refresh(self):
         self._list.refresh()
 
-        self._grid.attach(self._header, 0, 0, 1, 1)
-        self._grid.attach(self._list, 0, 2, 1, 1)
+        self._grid.attach(self._header, 0, 2, 1, 1)
+        self._grid.attach(self._list, 0, 3, 1, 1)
+
+    def update_availability(self, paths):
+        if self._local_list:
+            self._local_list.update_availability(paths)
 
     def _switch_page(self, _, page, search_keyword=None):
         win = self.get_toplevel()
         win.switch_view('youtube', search_keyword=search_keyword, page=page)
 
 
+class LocalSearchView(View):
+    """
+    The view of the saved videos matching a search, found without the
+    network, see search.py
+    """
+
+    def __init__(self, search_keyword, results):
+        super(LocalSearchView, self).__init__()
+
+        self._header = LocalResultsHeader(search_keyword, len(results))
+        self._grid.attach(self._header, 0, 0, 1, 1)
+
+        self._list = VideoList(videos=results)
+        self._grid.attach(self._list, 0, 2, 1, 1)
+
+    def update_availability(self, paths):
+        self._list.update_availability(paths)
+
+
 class DetailView(View):
     """
     The view for showing the extended information and description for a video
@@ -140,6 +212,9 @@ class DetailView(View):
         self._playlist_name = playlist_name
         self._permanent = permanent
 
+        # The user is likely to press WATCH next, get the player going
+        prespawn(video['video_url'], video['local_path'])
+
         self.refresh()
 
     def refresh(self):
@@ -151,6 +226,10 @@ class DetailView(View):
                                       permanent=self._permanent)
         self._grid.attach(self._list, 0, 2, 1, 1)
 
+    def update_availability(self, paths):
+        if self._video['local_path'] in paths:
+            self.reload()
+
 
 class PlaylistCollectionView(View):
     """
@@ -176,6 +255,9 @@ class PlaylistCollectionView(View):
         self._vids = PlaylistList(playlistCollection.collection)
         self._grid.attach(self._vids, 0, 2, 1, 1)
 
+    def shows(self, names):
+        return bool(names)
+
 
 class PlaylistView(View):
     """
@@ -191,6 +273,7 @@ class PlaylistView(View):
         self._header = None
         self.play_mode = None
         self._vids = None
+        self._export = None
 
         self.refresh()
 
@@ -206,6 +289,24 @@ class PlaylistView(View):
                                permanent=self._playlist.permanent)
         self._grid.attach(self._vids, 0, 2, 1, 1)
 
+        self._export = PlaylistExportBar(self._playlist)
+        self._grid.attach(self._export, 0, 3, 1, 1)
+
+    def shows(self, names):
+        return self._playlist_name in names
+
+    def update_availability(self, paths):
+        self._vids.update_availability(paths)
+
+    def reload(self):
+        # The playlist may have been deleted and created again
+        self._playlist = playlistCollection.collection[self._playlist_name]
+        super(PlaylistView, self).reload()
+
+    @property
+    def playlist_name(self):
+        return self._playlist_name
+
 
 class HomeView(View):
     """